@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script measures recall@K and latency of approximate nearest neighbor indexes
+against exact search for user interaction vectors and article keyword vectors.
+
+Usage:
+    python ann_benchmark.py --interactions ../data/user-item-interactions.csv \
+        --articles ../data/articles_community.csv --k 20
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import pandas as pd
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+# make the model package importable when the script is run from any directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from model import recommender_helper_functions as hf
+from model import content_based_helpers as cbh
+from model.ann_index import ExactIndex, RandomProjectionLSH, recall_at_k
+
+def benchmark_vectors(name, vectors, k, grid):
+    '''
+    Compares approximate indexes with parameters from grid to exact search.
+
+    INPUT:
+        name - (str) name of the vectors (used in results)
+        vectors - sparse CSR matrix of vectors
+        k - (int) number of neighbors
+        grid - list of dicts with parameters of RandomProjectionLSH
+
+    OUTPUT:
+        results - list of dicts with parameters, recall@k and timings
+    '''
+    start = time.perf_counter()
+    exact_neighbors, _ = ExactIndex().fit(vectors).all_neighbors(k)
+    exact_time = time.perf_counter() - start
+
+    results = [{'vectors': name, 'method': 'exact', 'recall': 1.0, 'build_time': 0.0, 'query_time': exact_time}]
+
+    for params in grid:
+        start = time.perf_counter()
+        index = RandomProjectionLSH(**params).fit(vectors)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        neighbors, _ = index.all_neighbors(k)
+        query_time = time.perf_counter() - start
+
+        results.append(dict(params, vectors = name, method = 'lsh', recall = recall_at_k(neighbors, exact_neighbors),
+                            build_time = build_time, query_time = query_time))
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Recall@K benchmark of approximate nearest neighbor indexes')
+    parser.add_argument('--interactions', required = True, help = 'path to user-item-interactions.csv')
+    parser.add_argument('--articles', help = 'path to articles_community.csv (article vectors are skipped if not set)')
+    parser.add_argument('--k', type = int, default = 20, help = 'number of neighbors')
+    parser.add_argument('--output', help = 'path to JSON file with results')
+    args = parser.parse_args()
+
+    grid = [{'n_tables': n_tables, 'n_bits': n_bits, 'n_probes': n_probes}
+            for n_tables, n_bits, n_probes in itertools.product([4, 8, 16], [8, 12, 16], [0, 2])]
+
+    _, user_item, _, _, _ = hf.read_interactions(args.interactions)
+    results = benchmark_vectors('users', user_item.matrix, args.k, grid)
+
+    if args.articles:
+        df_new = cbh.prepare_data(pd.read_csv(args.articles))
+        vectors = normalize(CountVectorizer().fit_transform(df_new['keywords']))
+        results += benchmark_vectors('articles', vectors, args.k, grid)
+
+    for result in results:
+        print('{vectors:9s} {method:6s} tables={t!s:4s} bits={b!s:4s} probes={p!s:4s} recall@k={recall:.3f} '
+              'build={build_time:.3f}s query={query_time:.3f}s'.format(
+                  t = result.get('n_tables', '-'), b = result.get('n_bits', '-'), p = result.get('n_probes', '-'), **result))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 2)
+
+if __name__ == '__main__':
+    main()
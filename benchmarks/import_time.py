@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script measures import time of the modules of the model package, each import
+runs in a fresh interpreter, and reports which heavy optional dependencies
+(sklearn, NLTK, rake) were loaded by the import.
+
+Usage:
+    python import_time.py --repeat 5 --output import_time.json
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MODULES = ['model',
+           'model.collaborative_recommender',
+           'model.content_based_recommender',
+           'model.matrix_factorization_recommender',
+           'model.hybrid_recommender',
+           'model.result_cache',
+           'model.service']
+
+# common dependencies, imported by every recommender
+BASELINE = 'numpy, pandas, scipy.sparse'
+
+HEAVY_MODULES = ['sklearn', 'nltk', 'rake_nltk']
+
+# code run in a fresh interpreter, prints import time and loaded heavy modules as JSON
+PROBE = '''
+import sys, json, time
+start = time.perf_counter()
+import {modules}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+def measure(modules, repeat = 5):
+    '''
+    INPUT:
+        modules - (str) comma separated modules imported with one import statement
+        repeat - (int) number of fresh interpreters to measure
+
+    OUTPUT:
+        result - (dict) median and min import time in seconds and loaded heavy modules
+    '''
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(modules = modules, heavy = HEAVY_MODULES)],
+                                cwd = ROOT, check = True, capture_output = True, text = True).stdout
+        probe = json.loads(output.strip().splitlines()[-1])
+        times.append(probe['seconds'])
+
+    return {'module': modules, 'median_s': float(np.median(times)), 'min_s': float(np.min(times)),
+            'heavy_modules': probe['heavy']}
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Measure import time of the model package')
+    parser.add_argument('--modules', nargs = '+', default = MODULES, help = 'modules to import')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'number of measurements of each module')
+    parser.add_argument('--output', help = 'path to JSON file with results')
+    args = parser.parse_args()
+
+    results = [measure(BASELINE, args.repeat)] + [measure(module, args.repeat) for module in args.modules]
+    for result in results:
+        print(json.dumps(result))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'results': results}, f, indent = 2)
+
+if __name__ == '__main__':
+    main()
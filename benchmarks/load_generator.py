@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script generates concurrent load on the recommendation service (see model/service.py)
+and reports p50/p99 latency and throughput.
+
+Usage:
+    python load_generator.py --url http://127.0.0.1:8080 --concurrency 64 --requests 10000 --max-user-id 5000
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+import numpy as np
+
+async def client(host, port, user_ids, rec_num, latencies, errors):
+    '''
+    Sends requests for user_ids one by one over one keep-alive connection
+    and appends latency of each request in seconds to latencies.
+    '''
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for user_id in user_ids:
+            start = time.perf_counter()
+            writer.write('GET /recommendations?user_id={}&n={} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(
+                user_id, rec_num, host).encode('latin-1'))
+            await writer.drain()
+
+            # read status line, headers and body of the response
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+async def run_load(url, concurrency, n_requests, max_user_id, rec_num, seed):
+    '''
+    INPUT:
+        url - (str) base URL of the service
+        concurrency - (int) number of concurrent connections
+        n_requests - (int) total number of requests
+        max_user_id - (int) user ids are drawn uniformly from 1..max_user_id
+        rec_num - (int) number of recommendations per request
+        seed - (int) random seed
+
+    OUTPUT:
+        report - (dict) number of requests, errors, duration, throughput and latency percentiles
+    '''
+    url = urlsplit(url)
+    rng = random.Random(seed)
+    user_ids = [rng.randint(1, max_user_id) for _ in range(n_requests)]
+
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(url.hostname, url.port or 80, user_ids[i::concurrency], rec_num, latencies, errors)
+                           for i in range(concurrency)])
+    duration = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    return {'requests': len(latencies), 'errors': len(errors), 'concurrency': concurrency,
+            'duration_s': duration, 'throughput_rps': len(latencies) / duration,
+            'latency_p50_ms': float(np.percentile(latencies, 50)), 'latency_p90_ms': float(np.percentile(latencies, 90)),
+            'latency_p99_ms': float(np.percentile(latencies, 99)), 'latency_max_ms': float(latencies.max())}
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Load generator for the recommendation service')
+    parser.add_argument('--url', default = 'http://127.0.0.1:8080', help = 'base URL of the service')
+    parser.add_argument('--concurrency', type = int, default = 32, help = 'number of concurrent connections')
+    parser.add_argument('--requests', type = int, default = 5000, help = 'total number of requests')
+    parser.add_argument('--max-user-id', type = int, default = 5000, help = 'maximum user id of generated requests')
+    parser.add_argument('--n', type = int, default = 10, help = 'number of recommendations per request')
+    parser.add_argument('--seed', type = int, default = 0, help = 'random seed')
+    parser.add_argument('--output', help = 'path to JSON file with the report')
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load(args.url, args.concurrency, args.requests, args.max_user_id, args.n, args.seed))
+    print(json.dumps(report, indent = 2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script benchmarks speed, memory and quality of the recommenders on synthetic
+datasets of configurable scale.
+
+For each scale the script generates interactions and articles, holds out the
+last part of the interactions log as a test set, fits each recommender on the rest
+and measures fit time, latency of single make_recs calls, time of batch
+recommendations, peak memory (RSS) and precision/recall@K on the held-out split.
+Each recommender is benchmarked in a separate process, so peak memory is not
+shared between runs. Results are written to a JSON file, so they can be compared
+between versions.
+
+Usage:
+    python run_benchmarks.py --scales 10000 100000 1000000 --output results.json --label v1
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+# make the model package importable when the script is run from any directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from model import recommender_helper_functions as hf
+from model.user_item_store import UserItemMatrix
+from model.collaborative_recommender import CollaborativeRecommender
+from model.content_based_recommender import ContentBasedRecommender
+from model.matrix_factorization_recommender import MatrixFactorizationRecommender
+from model.hybrid_recommender import HybridRecommender
+from synthetic_data import generate
+
+MODELS = {'collaborative': CollaborativeRecommender,
+          'content': ContentBasedRecommender,
+          'matrix_factorization': MatrixFactorizationRecommender,
+          'hybrid': HybridRecommender}
+
+def split_interactions(interactions_pth, output_dir, test_share = 0.1):
+    '''
+    Splits interactions log into train and test parts (the last rows are the test set).
+
+    INPUT:
+        interactions_pth - (str) path to interactions log
+        output_dir - (str) directory to write train log to
+        test_share - (float) share of rows in the test set
+
+    OUTPUT:
+        train_pth - (str) path to the train log
+        df_test - pandas dataframe with test interactions (article_id, title, email columns)
+    '''
+    df = pd.read_csv(interactions_pth)
+    n_test = int(len(df) * test_share)
+
+    train_pth = os.path.join(output_dir, 'train-interactions.csv')
+    df.iloc[:len(df) - n_test].to_csv(train_pth, index = False)
+
+    return train_pth, df.iloc[len(df) - n_test:]
+
+def peak_memory_mb():
+    '''
+    Returns peak resident memory of the current process in megabytes.
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def benchmark_model(name, train_pth, articles_pth, df_test, k, n_single, n_eval, seed, n_jobs = 1):
+    '''
+    Fits one recommender and measures its speed, memory and quality.
+
+    INPUT:
+        name - (str) name of the recommender from MODELS
+        train_pth - (str) path to train interactions log
+        articles_pth - (str) path to articles dataset
+        df_test - pandas dataframe with test interactions
+        k - (int) number of recommendations
+        n_single - (int) number of single make_recs calls to time
+        n_eval - (int) maximum number of test users to evaluate
+        seed - (int) seed for sampling users
+        n_jobs - (int) number of worker processes computing similarities during fit
+
+    OUTPUT:
+        result - (dict) measurements
+    '''
+    rng = np.random.RandomState(seed)
+    # matrix factorization has no pairwise similarity step
+    rec = MODELS[name](**({'n_jobs': n_jobs} if name in ('collaborative', 'content') else {}))
+
+    start = time.perf_counter()
+    if name in ('content', 'hybrid'):
+        rec.fit(train_pth, articles_pth)
+    else:
+        rec.fit(train_pth)
+    fit_time = time.perf_counter() - start
+
+    # map test emails with the mapping of the fitted recommender, new users get new ids
+    test_users = rec.email_encoder.encode(df_test['email'].values)
+    user_item_test = UserItemMatrix.from_interactions(test_users, df_test['article_id'].values)
+
+    # evaluate test users known to the recommender
+    eval_users = user_item_test.user_ids[np.isin(user_item_test.user_ids, rec.user_item.user_ids)]
+    if len(eval_users) > n_eval:
+        eval_users = rng.choice(eval_users, n_eval, replace = False)
+    eval_users = eval_users.tolist()
+
+    single_users = rng.choice(rec.user_item.user_ids, min(n_single, rec.user_item.shape[0]), replace = False).tolist()
+    latencies = []
+    for user_id in single_users:
+        start = time.perf_counter()
+        rec.make_recs(user_id, k)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    recommendations = rec.make_recs_batch(eval_users, k)
+    batch_time = time.perf_counter() - start
+
+    precision, recall, n_users = hf.precision_recall_at_k(eval_users, [recs for recs, _ in recommendations],
+                                                          rec.user_item, user_item_test)
+
+    return {'model': name,
+            'n_jobs': n_jobs,
+            'fit_time': fit_time,
+            'single_latency_mean': float(np.mean(latencies)) if latencies else None,
+            'single_latency_p50': float(np.percentile(latencies, 50)) if latencies else None,
+            'single_latency_p99': float(np.percentile(latencies, 99)) if latencies else None,
+            'batch_users': len(eval_users),
+            'batch_time': batch_time,
+            'peak_memory_mb': peak_memory_mb(),
+            'k': k,
+            'precision_at_k': precision,
+            'recall_at_k': recall,
+            'evaluated_users': n_users}
+
+def _benchmark_worker(queue, *args):
+    try:
+        queue.put(benchmark_model(*args))
+    except Exception as e:
+        queue.put({'model': args[0], 'error': repr(e)})
+
+def run_isolated(*args):
+    '''
+    Runs benchmark_model in a separate process and returns its result.
+    '''
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target = _benchmark_worker, args = (queue,) + args)
+    process.start()
+    result = queue.get()
+    process.join()
+
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark recommenders on synthetic data')
+    parser.add_argument('--scales', type = int, nargs = '+', default = [10000, 100000],
+                        help = 'numbers of interactions of generated datasets')
+    parser.add_argument('--models', nargs = '+', default = sorted(MODELS), choices = sorted(MODELS),
+                        help = 'recommenders to benchmark')
+    parser.add_argument('--k', type = int, default = 10, help = 'number of recommendations')
+    parser.add_argument('--single', type = int, default = 100, help = 'number of single make_recs calls to time')
+    parser.add_argument('--eval-users', type = int, default = 5000, help = 'maximum number of evaluated test users')
+    parser.add_argument('--test-share', type = float, default = 0.1, help = 'share of held-out interactions')
+    parser.add_argument('--seed', type = int, default = 0, help = 'random seed')
+    parser.add_argument('--n-jobs', type = int, default = 1, help = 'number of worker processes computing similarities during fit')
+    parser.add_argument('--workdir', help = 'directory for generated datasets (temporary if not set)')
+    parser.add_argument('--label', default = '', help = 'label of the benchmarked version')
+    parser.add_argument('--output', default = 'benchmark_results.json', help = 'path to JSON file with results')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix = 'recommender_benchmark_')
+
+    results = []
+    for scale in args.scales:
+        data_dir = os.path.join(workdir, str(scale))
+        interactions_pth, articles_pth = generate(scale, data_dir, random_state = args.seed)
+        train_pth, df_test = split_interactions(interactions_pth, data_dir, args.test_share)
+
+        for name in args.models:
+            result = run_isolated(name, train_pth, articles_pth, df_test, args.k, args.single, args.eval_users, args.seed, args.n_jobs)
+            result['interactions'] = scale
+            results.append(result)
+            print(json.dumps(result))
+
+    report = {'label': args.label,
+              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'pandas': pd.__version__,
+              'platform': platform.platform(),
+              'results': results}
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent = 2)
+
+if __name__ == '__main__':
+    main()
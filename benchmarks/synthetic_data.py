@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script generates synthetic interaction logs and article corpora in the format of
+user-item-interactions.csv and articles_community.csv.
+
+Articles belong to topics with topic-specific vocabulary, users prefer articles
+of one topic and article popularity follows a power law, so collaborative and
+content-based recommenders have a signal to learn.
+
+Usage:
+    python synthetic_data.py --interactions 100000 --output ../data/synthetic
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+def generate(n_interactions, output_dir, n_users = None, n_articles = None, n_topics = 20,
+             topic_share = 0.7, words_per_article = 60, random_state = 0):
+    '''
+    Generates synthetic datasets and writes them to output_dir.
+
+    INPUT:
+        n_interactions - (int) number of rows of the interactions log
+        output_dir - (str) directory for user-item-interactions.csv and articles_community.csv
+        n_users - (int) number of users, defaults to n_interactions / 10
+        n_articles - (int) number of articles, defaults to n_interactions / 100 (at least 100)
+        n_topics - (int) number of topics
+        topic_share - (float) share of interactions with articles of the user's topic
+        words_per_article - (int) number of words in the body of each article
+        random_state - (int) seed
+
+    OUTPUT:
+        interactions_pth - (str) path to generated interactions log
+        articles_pth - (str) path to generated articles dataset
+    '''
+    rng = np.random.RandomState(random_state)
+    n_users = n_users or max(n_interactions // 10, 10)
+    n_articles = n_articles or max(n_interactions // 100, 100)
+
+    os.makedirs(output_dir, exist_ok = True)
+
+    # articles: topic of each article and body from topic vocabulary mixed with common words
+    article_topic = rng.randint(0, n_topics, n_articles)
+    common_words = np.array(['data', 'model', 'analysis', 'python', 'cloud', 'learning', 'service', 'api'])
+    topic_words = np.array([['topic{}word{}'.format(t, w) for w in range(30)] for t in range(n_topics)])
+
+    bodies = []
+    for topic in article_topic:
+        words = np.where(rng.rand(words_per_article) < 0.6,
+                         topic_words[topic][rng.randint(0, 30, words_per_article)],
+                         common_words[rng.randint(0, len(common_words), words_per_article)])
+        bodies.append('. '.join(' '.join(sentence) for sentence in np.array_split(words, 6)))
+
+    articles = pd.DataFrame({'doc_body': bodies,
+                             'doc_description': ['Description of article {}'.format(a) for a in range(n_articles)],
+                             'doc_full_name': ['Article {}'.format(a) for a in range(n_articles)],
+                             'doc_status': 'Live',
+                             'article_id': np.arange(n_articles)})
+    articles_pth = os.path.join(output_dir, 'articles_community.csv')
+    articles.to_csv(articles_pth)
+
+    # power law popularity of articles and activity of users
+    article_weight = 1.0 / (rng.permutation(n_articles) + 1) ** 0.9
+    user_weight = 1.0 / (rng.permutation(n_users) + 1) ** 0.7
+    user_topic = rng.randint(0, n_topics, n_users)
+
+    users = rng.choice(n_users, n_interactions, p = user_weight / user_weight.sum())
+
+    # global popular articles
+    articles_global = rng.choice(n_articles, n_interactions, p = article_weight / article_weight.sum())
+
+    # articles of the user's topic, sampled by popularity within the topic
+    articles_topic = np.empty(n_interactions, dtype = np.int64)
+    interaction_topic = user_topic[users]
+    for topic in range(n_topics):
+        rows = np.flatnonzero(interaction_topic == topic)
+        topic_articles = np.flatnonzero(article_topic == topic)
+        if len(topic_articles) == 0:
+            topic_articles = np.arange(n_articles)
+        weights = article_weight[topic_articles]
+        articles_topic[rows] = rng.choice(topic_articles, len(rows), p = weights / weights.sum())
+
+    article_ids = np.where(rng.rand(n_interactions) < topic_share, articles_topic, articles_global)
+
+    emails = np.array(['{:040x}'.format(u * 2654435761 % (1 << 64)) for u in range(n_users)], dtype = object)
+    titles = np.array(['title of article {}'.format(a) for a in range(n_articles)], dtype = object)
+
+    interactions = pd.DataFrame({'article_id': article_ids.astype(float),
+                                 'title': titles[article_ids],
+                                 'email': emails[users]})
+    interactions_pth = os.path.join(output_dir, 'user-item-interactions.csv')
+    interactions.to_csv(interactions_pth)
+
+    return interactions_pth, articles_pth
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Generate synthetic interactions and articles datasets')
+    parser.add_argument('--interactions', type = int, default = 100000, help = 'number of interactions')
+    parser.add_argument('--users', type = int, help = 'number of users')
+    parser.add_argument('--articles', type = int, help = 'number of articles')
+    parser.add_argument('--seed', type = int, default = 0, help = 'random seed')
+    parser.add_argument('--output', required = True, help = 'output directory')
+    args = parser.parse_args()
+
+    for pth in generate(args.interactions, args.output, args.users, args.articles, random_state = args.seed):
+        print(pth)
+
+if __name__ == '__main__':
+    main()
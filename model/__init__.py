@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains the recommenders package. Recommender classes are imported on
+first access, so importing the package (or one of its modules) doesn't load
+modules of the other recommenders.
+
+Usage:
+    from model import CollaborativeRecommender
+    from model.result_cache import CachedRecommender
+"""
+
+import importlib
+
+# exported class name -> module which defines it
+_EXPORTS = {'CollaborativeRecommender': 'collaborative_recommender',
+            'ContentBasedRecommender': 'content_based_recommender',
+            'MatrixFactorizationRecommender': 'matrix_factorization_recommender',
+            'HybridRecommender': 'hybrid_recommender',
+            'CachedRecommender': 'result_cache'}
+
+__all__ = sorted(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    return getattr(importlib.import_module('.' + _EXPORTS[name], __name__), name)
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
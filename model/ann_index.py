@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains approximate nearest neighbor indexes (pure NumPy) used to find
+similar users and similar articles without comparing every pair of vectors.
+"""
+
+import numpy as np
+from scipy import sparse
+from .similarity_index import blocked_top_k, tile_rows
+
+def _dot(vectors, queries):
+    '''
+    Dot product of rows of vectors and rows of queries (sparse or dense), returns dense array.
+    '''
+    product = queries @ vectors.T
+    if sparse.issparse(product):
+        product = product.toarray()
+    return np.asarray(product, dtype = np.float64)
+
+def _select_top_k(candidates, sims, k, tie_breaker = None):
+    '''
+    Selects k candidates with the largest positive similarity sorted by similarity
+    (equal similarities by larger tie_breaker value if provided, then by candidate index).
+    '''
+    positive = sims > 0
+    candidates, sims = candidates[positive], sims[positive]
+
+    ties = -np.asarray(tie_breaker)[candidates] if tie_breaker is not None else np.zeros(len(candidates))
+    order = np.lexsort((candidates, ties, -sims))[:k]
+
+    return candidates[order], sims[order]
+
+class ExactIndex():
+    '''
+    Exact nearest neighbor search by dot product of vectors, used as a baseline
+    and as a fallback for approximate indexes.
+    '''
+
+    def __init__(self, batch_size = 1024):
+        '''
+        INPUT:
+            batch_size - (int) maximum number of vectors compared at once (see similarity_index.tile_rows)
+        '''
+        self.batch_size = batch_size
+
+    def fit(self, vectors):
+        '''
+        INPUT:
+            vectors - (n x d sparse CSR or dense array) indexed vectors
+
+        OUTPUT:
+            self
+        '''
+        self.vectors = vectors
+        return self
+
+    def query(self, queries, k, exclude = None, tie_breaker = None):
+        '''
+        INPUT:
+            queries - (b x d sparse CSR or dense array) query vectors
+            k - (int) number of neighbors to return for each query
+            exclude - (array) optional index of vector to exclude for each query (e.g. the query itself), -1 for none
+            tie_breaker - (array) optional value for each indexed vector, neighbors with equal
+            similarity are ordered by larger value
+
+        OUTPUT:
+            neighbors - (b x k int32 array) indexes of neighbors sorted by similarity, -1 for empty positions
+            similarities - (b x k float32 array) similarity to each of the neighbors
+        '''
+        n = self.vectors.shape[0]
+        neighbors = np.full((queries.shape[0], k), -1, dtype = np.int32)
+        similarities = np.zeros((queries.shape[0], k), dtype = np.float32)
+
+        # dense similarities of a batch of queries are kept within the tile memory budget
+        batch_size = tile_rows(self.batch_size, n)
+        for start in range(0, queries.shape[0], batch_size):
+            end = min(start + batch_size, queries.shape[0])
+            sims = _dot(self.vectors, queries[start:end])
+
+            for i, row in enumerate(sims):
+                if exclude is not None and exclude[start + i] >= 0:
+                    row[exclude[start + i]] = -np.inf
+                top, top_sims = _select_top_k(np.arange(n), row, k, tie_breaker)
+                neighbors[start + i, :len(top)] = top
+                similarities[start + i, :len(top)] = top_sims
+
+        return neighbors, similarities
+
+    def all_neighbors(self, k, tie_breaker = None):
+        '''
+        Finds k nearest neighbors of each indexed vector (excluding the vector itself).
+
+        INPUT:
+            k - (int) number of neighbors
+            tie_breaker - (array) optional value for each vector, see query
+
+        OUTPUT:
+            neighbors, similarities - (n x k arrays) as returned by query
+        '''
+        return blocked_top_k(sparse.csr_matrix(self.vectors), k, self.batch_size, tie_breaker)
+
+class RandomProjectionLSH():
+    '''
+    Locality sensitive hashing with random hyperplane projections. Each vector
+    is hashed into a bucket of each of n_tables tables by signs of n_bits random
+    projections, vectors with small angle between them are likely to share a bucket.
+    Candidates from the buckets of a query (and buckets which differ in n_probes bits)
+    are re-ranked by exact dot product.
+
+    Recall grows with n_tables and n_probes and falls with n_bits, latency grows
+    with the number of candidates. If a query gets less than min_candidates
+    candidates, exact search is used for it (if exact_fallback is True).
+    '''
+
+    def __init__(self, n_tables = 8, n_bits = 12, n_probes = 0, min_candidates = None,
+                 exact_fallback = True, random_state = 0):
+        '''
+        INPUT:
+            n_tables - (int) number of hash tables
+            n_bits - (int) number of random projections (bits of hash) in each table
+            n_probes - (int) number of bits flipped one at a time to probe neighboring buckets
+            min_candidates - (int) minimum number of candidates for a query before falling back
+            to exact search, defaults to k
+            exact_fallback - (bool) if True queries with too few candidates use exact search
+            random_state - (int) seed of random projections
+        '''
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.n_probes = n_probes
+        self.min_candidates = min_candidates
+        self.exact_fallback = exact_fallback
+        self.random_state = random_state
+
+    def _hash(self, vectors):
+        '''
+        Returns (number of vectors x n_tables) array of bucket keys.
+        '''
+        projected = vectors @ self.projections
+        if sparse.issparse(projected):
+            projected = projected.toarray()
+        bits = (np.asarray(projected) > 0).reshape(vectors.shape[0], self.n_tables, self.n_bits)
+
+        return bits.astype(np.int64) @ (1 << np.arange(self.n_bits, dtype = np.int64))
+
+    def fit(self, vectors):
+        '''
+        INPUT:
+            vectors - (n x d sparse CSR or dense array) indexed vectors
+
+        OUTPUT:
+            self
+        '''
+        rng = np.random.RandomState(self.random_state)
+
+        self.vectors = vectors
+        self.projections = rng.standard_normal((vectors.shape[1], self.n_tables * self.n_bits)).astype(np.float32)
+
+        # for each table keep vector indexes sorted by bucket key, buckets are found with binary search
+        keys = self._hash(vectors)
+        self.order = np.argsort(keys, axis = 0, kind = 'stable').T
+        self.sorted_keys = np.take_along_axis(keys, self.order.T, axis = 0).T
+
+        self._exact = ExactIndex().fit(vectors)
+
+        return self
+
+    def candidates(self, query_keys):
+        '''
+        INPUT:
+            query_keys - (n_tables array) bucket keys of one query
+
+        OUTPUT:
+            array of unique indexes of vectors in the buckets of the query and probed buckets
+        '''
+        flips = [0] + [1 << bit for bit in range(min(self.n_probes, self.n_bits))]
+
+        found = []
+        for table in range(self.n_tables):
+            for flip in flips:
+                key = query_keys[table] ^ flip
+                left = np.searchsorted(self.sorted_keys[table], key, side = 'left')
+                right = np.searchsorted(self.sorted_keys[table], key, side = 'right')
+                found.append(self.order[table, left:right])
+
+        return np.unique(np.concatenate(found))
+
+    def query(self, queries, k, exclude = None, tie_breaker = None):
+        '''
+        INPUT:
+            queries - (b x d sparse CSR or dense array) query vectors
+            k - (int) number of neighbors to return for each query
+            exclude - (array) optional index of vector to exclude for each query (e.g. the query itself), -1 for none
+            tie_breaker - (array) optional value for each indexed vector, neighbors with equal
+            similarity are ordered by larger value
+
+        OUTPUT:
+            neighbors - (b x k int32 array) indexes of neighbors sorted by similarity, -1 for empty positions
+            similarities - (b x k float32 array) similarity to each of the neighbors
+        '''
+        min_candidates = k if self.min_candidates is None else self.min_candidates
+
+        neighbors = np.full((queries.shape[0], k), -1, dtype = np.int32)
+        similarities = np.zeros((queries.shape[0], k), dtype = np.float32)
+        query_keys = self._hash(queries)
+
+        fallback = []
+        for i in range(queries.shape[0]):
+            candidates = self.candidates(query_keys[i])
+            if exclude is not None and exclude[i] >= 0:
+                candidates = candidates[candidates != exclude[i]]
+
+            if len(candidates) < min_candidates and self.exact_fallback:
+                fallback.append(i)
+                continue
+
+            # re-rank candidates by exact similarity
+            sims = _dot(self.vectors[candidates], queries[i:i + 1]).ravel()
+            top, top_sims = _select_top_k(candidates, sims, k, tie_breaker)
+            neighbors[i, :len(top)] = top
+            similarities[i, :len(top)] = top_sims
+
+        if len(fallback) > 0:
+            fallback = np.array(fallback)
+            neighbors[fallback], similarities[fallback] = self._exact.query(
+                queries[fallback], k, None if exclude is None else np.asarray(exclude)[fallback], tie_breaker)
+
+        return neighbors, similarities
+
+    def all_neighbors(self, k, tie_breaker = None):
+        '''
+        Finds approximate k nearest neighbors of each indexed vector (excluding the vector itself).
+
+        INPUT:
+            k - (int) number of neighbors
+            tie_breaker - (array) optional value for each vector, see query
+
+        OUTPUT:
+            neighbors, similarities - (n x k arrays) as returned by query
+        '''
+        n = self.vectors.shape[0]
+        k = max(min(k, n - 1), 0)
+
+        return self.query(self.vectors, k, exclude = np.arange(n), tie_breaker = tie_breaker)
+
+def build_ann_index(method = 'exact', **params):
+    '''
+    Creates nearest neighbor index by name.
+
+    INPUT:
+        method - (str) 'exact' or 'lsh'
+        params - parameters of the index class
+
+    OUTPUT:
+        index - not fitted index instance
+    '''
+    methods = {'exact': ExactIndex, 'lsh': RandomProjectionLSH}
+    if method not in methods:
+        raise ValueError('Unknown index method {}, expected one of {}'.format(method, sorted(methods)))
+
+    return methods[method](**params)
+
+def recall_at_k(approx_neighbors, exact_neighbors):
+    '''
+    Computes recall@k of approximate neighbors: share of exact neighbors found
+    by approximate search (positions filled with -1 are ignored).
+
+    INPUT:
+        approx_neighbors - (n x k array) neighbors found by approximate index
+        exact_neighbors - (n x k array) neighbors found by exact search
+
+    OUTPUT:
+        recall - (float) recall@k averaged over all exact neighbors
+    '''
+    found = 0
+    total = 0
+    for approx, exact in zip(approx_neighbors, exact_neighbors):
+        exact = exact[exact >= 0]
+        found += np.isin(exact, approx[approx >= 0]).sum()
+        total += len(exact)
+
+    return found / total if total > 0 else 1.0
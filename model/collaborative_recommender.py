@@ -8,9 +8,15 @@ Created on Tue Mar 26 13:58:18 2019
 File contains class for making user-user collaborative recommendations.
 """
 
+import uuid
 import numpy as np
-import pandas as pd
-import recommender_helper_functions as hf
+from scipy import sparse
+from . import recommender_helper_functions as hf
+from .similarity_index import NeighborIndex
+from .ann_index import build_ann_index
+from .user_item_store import UserItemMatrix, InteractionCounts, EmailEncoder, ArticleTitles, InteractionLog
+from . import persistence
+from .instrumentation import timed, stage
 
 class CollaborativeRecommender():
     '''
@@ -18,6 +24,43 @@ class CollaborativeRecommender():
     articles.
     '''
     
+    def __init__(self, n_neighbors = 100, batch_size = 1024, chunksize = None, ann_params = None, n_jobs = 1,
+                 scoring = 'popularity'):
+        '''
+        INPUT:
+            n_neighbors - (int) number of most similar users stored for each user
+            batch_size - (int) maximum number of users processed in one block when
+            building the neighbor index, blocks are reduced to keep dense similarities
+            of a block within 256 MB (similarity_index.TILE_MEMORY)
+            chunksize - (int) number of rows of interactions dataset read at once,
+            None to read the whole dataset at once
+            ann_params - (dict) optional parameters of approximate nearest neighbor index
+            used to build the neighbor index, e.g. {'method': 'lsh', 'n_tables': 8, 'n_bits': 12},
+            None for exact search
+            n_jobs - (int) number of worker processes building the neighbor index with exact search,
+            None to use all available cores (each worker holds a block of up to 256 MB)
+            scoring - (str) how articles of similar users are ranked: 'popularity' - by number
+            of interactions, 'similarity' - by sum of similarities of the similar users who
+            interacted with the article (articles with equal sums by number of interactions)
+        '''
+        if scoring not in ('popularity', 'similarity'):
+            raise ValueError('Unknown scoring {}, expected one of {}'.format(scoring, ['popularity', 'similarity']))
+        
+        self.n_neighbors = n_neighbors
+        self.batch_size = batch_size
+        self.chunksize = chunksize
+        self.ann_params = ann_params
+        self.n_jobs = n_jobs
+        self.scoring = scoring
+    
+    @property
+    def df(self):
+        '''
+        Log of interactions as pandas dataframe with article_id, title, user_id columns.
+        '''
+        return self.log.frame
+    
+    @timed('collaborative.fit')
     def fit(self, user_articles_pth):
         '''
         Fits the recommender to data which contains interactions between users
@@ -28,18 +71,43 @@ class CollaborativeRecommender():
             information on interactions between users and articles
             
         '''
-        # read dataset with interactions with articles
-        self.df = pd.read_csv(user_articles_pth)
+        # read dataset with interactions with articles (chunk by chunk if chunksize is set),
+        # map emails to user_ids, create user-article matrix, count interactions and take titles
+        df, user_item, email_encoder, counts, article_titles = hf.read_interactions(user_articles_pth, self.chunksize)
         
-        # map emails to user_ids
-        email_encoded = hf.email_mapper(self.df)
-        del self.df['email']
-        self.df['user_id'] = email_encoded
+        self.fit_store(df, user_item, email_encoder, counts, article_titles)
+    
+    def fit_store(self, df, user_item, email_encoder, counts = None, article_titles = None):
+        '''
+        Fits the recommender to an already read log of interactions. Passed objects
+        are used without copying, so they can be shared with other recommenders.
+        
+        INPUT:
+            df - pandas dataframe with article_id, title, user_id columns
+            user_item - (UserItemMatrix) sparse matrix of users by articles
+            email_encoder - (EmailEncoder) mapping of emails to user ids
+            counts - (InteractionCounts) optional precomputed interaction counts
+            article_titles - (ArticleTitles) optional precomputed titles of articles
+        '''
+        self.log, self.user_item, self.email_encoder = InteractionLog.from_frame(df), user_item, email_encoder
         
-        # create user-article matrix
-        self.user_item = hf.create_user_item_matrix(self.df)
+        # count interactions of articles and users and rank articles by popularity once
+        with stage('collaborative.fit.counts'):
+            self.counts = counts if counts is not None else InteractionCounts.build(self.df, self.user_item)
         
+        # titles of articles aligned with columns of user-article matrix
+        self.article_titles = article_titles if article_titles is not None else ArticleTitles.build(self.df, self.user_item)
+        
+        # build top-K neighbor index, neighbors with equal similarity are ordered by number of interactions
+        with stage('collaborative.fit.neighbor_index') as s:
+            ann_index = build_ann_index(**self.ann_params) if self.ann_params is not None else None
+            self.neighbor_index = NeighborIndex.build(self.user_item, self.n_neighbors, self.batch_size, self.counts.user_counts, ann_index, self.n_jobs)
+            s.add_bytes(self.neighbor_index.neighbors.nbytes + self.neighbor_index.similarities.nbytes)
+        
+        # new version of the fitted state, cached recommendations of other versions are not served
+        self.model_version = uuid.uuid4().hex
     
+    @timed('collaborative.make_recs')
     def make_recs(self, user_id, rec_num = 5):
         '''
         Makes recommendations for articles for provided user.
@@ -53,51 +121,174 @@ class CollaborativeRecommender():
             rec_names - list of recommended article names
             
         '''
-        recs = [] 
+        return self.make_recs_batch([user_id], rec_num)[0]
     
-        # if provided user has no views then recommend top m most popular articles
-        if user_id not in self.df.user_id.unique().tolist():
-            recs = hf.get_top_article_ids(rec_num, self.df)
-            rec_names = hf.get_article_names(recs, self.df)
+    def article_scores(self, user_idx, seen):
+        '''
+        Scores articles of neighbors of a block of users with one sparse product
+        of the neighbor lists and the neighbors' rows of the user-article matrix.
         
-            return recs, rec_names
+        INPUT:
+            user_idx - array of row indexes of users, -1 for unknown users
+            seen - (b x m sparse matrix) articles the users interacted with (UserItemMatrix.rows)
+            
+        OUTPUT:
+            scores - (b x m array) score of each candidate article, 0 for other articles:
+            popularity of the article for 'popularity' scoring, sum of similarities
+            of neighbors who interacted with the article for 'similarity' scoring
+        '''
+        # sparse matrix of users by their neighbors, weighted by similarity for similarity scoring
+        neighbors = np.where(user_idx[:, None] >= 0, self.neighbor_index.neighbors[np.maximum(user_idx, 0)], -1)
+        rows, cols = np.nonzero(neighbors >= 0)
+        if self.scoring == 'similarity':
+            weights = self.neighbor_index.similarities[user_idx[rows], cols]
+        else:
+            weights = np.ones(len(rows), dtype = np.float32)
+        user_neighbors = sparse.csr_matrix((weights, (rows, neighbors[rows, cols])),
+                                           shape = (len(user_idx), self.user_item.shape[0]))
+        
+        # accumulate votes of neighbors for their articles and drop articles the users already interacted with
+        votes = user_neighbors @ self.user_item.matrix
+        if self.scoring != 'similarity':
+            votes.data[:] = 1
+        votes = votes - votes.multiply(seen)
+        
+        # with popularity scoring candidates are ordered by number of interactions
+        if self.scoring != 'similarity':
+            votes = votes.multiply(self.counts.popularity[None, :])
+        
+        return votes.toarray()
     
-        # get similar users sorted by similarity and then by number of interactions
-        similar_users = hf.get_top_sorted_users(user_id, self.df, self.user_item)['neighbor_id'].values
+    @timed('collaborative.make_recs_batch')
+    def make_recs_batch(self, user_ids, rec_num = 5, block_size = 1024):
+        '''
+        Makes recommendations for articles for many users at once. Articles of
+        similar users are recommended first (ordered by number of interactions or
+        by similarity-weighted votes, see scoring), then the most popular articles.
+        Users with no views get the most popular articles.
+        
+        INPUT:
+            user_ids - list of ids of the users to make recommendations for
+            rec_num - number of recommended articles for each user
+            block_size - number of users scored with one matrix product,
+            memory is bounded by block_size x number of articles
+            
+        OUTPUT:
+            recommendations - list of (recs, rec_names) tuples for each user:
+            recs - list of recommended article_ids
+            rec_names - list of recommended article names
+            
+        '''
+        popularity = self.counts.popularity
+        user_idx = self.user_item.user_indexes(user_ids)
+        
+        recommendations = []
+        for start in range(0, len(user_idx), block_size):
+            block = user_idx[start:start + block_size]
+            
+            with stage('collaborative.make_recs_batch.scores') as s:
+                seen = self.user_item.rows(block)
+                scores = self.article_scores(block, seen)
+                s.add_bytes(scores.nbytes)
+            
+            # candidates with equal scores and backfilled articles are ordered by popularity
+            top_articles = hf.select_top_articles(scores, seen, popularity, rec_num)
+            
+            with stage('collaborative.make_recs_batch.names'):
+                for top in top_articles:
+                    recommendations.append((self.user_item.article_labels[top].tolist(), self.article_titles.names(top)))
+        
+        return recommendations
     
-        # get articles user already interacted with
-        user_articles = hf.get_user_articles(user_id, self.user_item, self.df)[0]
+    @timed('collaborative.add_interactions')
+    def add_interactions(self, records):
+        '''
+        Adds new interactions to the fitted recommender without refitting:
+        extends mapping of emails to user ids, appends interactions to the
+        user-article matrix and updates popularity counts and neighbor lists in place.
+        
+        INPUT:
+            records - pandas dataframe or list of dicts with article_id, title, email
+            of new interactions
+            
+        OUTPUT:
+            user_ids - list of ids of users whose scores of articles changed, recommendations
+            of other users can change only if they contain articles which moved in the
+            popularity ranking (see InteractionCounts.moved_articles)
+        '''
+        # update the log, user-article matrix, counts and titles
+        user_map, article_map, rows, cols, ranking_changed = hf.store_interactions(
+            self.log, self.user_item, self.email_encoder, self.counts, self.article_titles, records)
+        
+        return self.update_indexes(user_map, article_map, rows)
     
-        # loop through similar users
-        for similar_user in similar_users:
-            # find articles for each user
-            recommended_articles = hf.get_user_articles(similar_user, self.user_item, self.df)[0]
-        
-            # for each article of the user
-            for article in recommended_articles:
-                # if acticle is not already viewed by the user and not in list already then append the article to recs
-                if (article not in user_articles) and (article not in recs):
-                    recs.append(article)
-        
-        # if number of recommendations exceeds required then sort articles by number of interactions
-        if (len(recs) > rec_num):
-            article_interactions_df = hf.get_number_of_interactions_for_articles(recs, self.df)
-            article_interactions_df = article_interactions_df.sort_values(['num_interactions'], ascending = False)
-        
-            recs = article_interactions_df['article_id'].values
+    def update_indexes(self, user_map, article_map, rows):
+        '''
+        Updates neighbor lists after new interactions were added to the store
+        with recommender_helper_functions.store_interactions. Popularity only orders
+        articles, so a changed popularity ranking doesn't replace model_version.
+        
+        INPUT:
+            user_map, article_map, rows - arrays returned by UserItemMatrix.add_interactions
+            
+        OUTPUT:
+            user_ids - list of ids of users whose recommendations changed: users of the new
+            interactions, users whose neighbor lists changed and users who have users of the
+            new interactions among their neighbors
+        '''
+        if len(rows) == 0:
+            return []
+        
+        # recompute neighbors of users with new interactions and merge them into lists of other users,
+        # candidates of users come from articles of their neighbors, so users who have users of the
+        # new interactions among their neighbors are reported as well
+        with stage('collaborative.add_interactions.neighbor_index'):
+            changed = self.neighbor_index.update(self.user_item, user_map, rows, self.counts.user_counts, self.batch_size)
+        
+        return self.user_item.user_ids[changed].tolist()
     
-        # if number of recommendations is less than required then recommend top viewed articles
-        if len(recs) < rec_num:
-            top_articles = hf.get_top_article_ids(rec_num * 2, self.df)
-            for article in top_articles:
-                # if acticle is not already viewed by the user and not in list already then append the article to recs
-                if (article not in user_articles) and (article not in recs):
-                    recs.append(article)
-             
-                # if exceed the number of required recommendations then break the loop and return results
-                if len(recs) >= rec_num:
-                    break
-                
-        rec_names = hf.get_article_names(recs, self.df)
+    def save(self, path):
+        '''
+        Saves fitted recommender to a versioned binary artifact.
+        
+        INPUT:
+            path - (str) path to the artifact directory
+        '''
+        arrays = dict()
+        arrays.update(persistence.prefixed('df', self.log.to_arrays()))
+        arrays.update(persistence.prefixed('user_item', self.user_item.to_arrays()))
+        arrays.update(persistence.prefixed('counts', self.counts.to_arrays()))
+        arrays.update(persistence.prefixed('neighbor_index', self.neighbor_index.to_arrays()))
+        arrays.update(persistence.prefixed('email_encoder', self.email_encoder.to_arrays()))
+        arrays.update(persistence.prefixed('article_titles', self.article_titles.to_arrays()))
+        
+        params = {'n_neighbors': self.n_neighbors, 'batch_size': self.batch_size, 'chunksize': self.chunksize,
+                  'ann_params': self.ann_params, 'n_jobs': self.n_jobs, 'scoring': self.scoring}
+        
+        persistence.save_artifact(path, type(self).__name__, params, arrays)
     
-        return recs[:rec_num], rec_names[:rec_num]
\ No newline at end of file
+    @classmethod
+    def load(cls, path, mmap = True):
+        '''
+        Loads fitted recommender from an artifact created by save.
+        
+        INPUT:
+            path - (str) path to the artifact directory
+            mmap - (bool) if True large arrays are memory-mapped read-only, so
+            worker processes loading the same artifact share memory pages
+            
+        OUTPUT:
+            rec - fitted CollaborativeRecommender
+        '''
+        params, arrays = persistence.load_artifact(path, cls.__name__, mmap)
+        
+        rec = cls(**params)
+        rec.log = InteractionLog.from_arrays(persistence.unprefixed('df', arrays))
+        rec.user_item = UserItemMatrix.from_arrays(persistence.unprefixed('user_item', arrays))
+        rec.counts = InteractionCounts.from_arrays(persistence.unprefixed('counts', arrays))
+        rec.neighbor_index = NeighborIndex.from_arrays(persistence.unprefixed('neighbor_index', arrays))
+        rec.email_encoder = EmailEncoder.from_arrays(persistence.unprefixed('email_encoder', arrays))
+        rec.article_titles = ArticleTitles.from_arrays(persistence.unprefixed('article_titles', arrays))
+        rec.model_version = uuid.uuid4().hex
+        
+        return rec
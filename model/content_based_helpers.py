@@ -8,45 +8,245 @@ Created on Tue Mar 26 18:51:34 2019
 File contains helper functions for content-based recommender class.
 """
 
+import os
+import re
+import json
+import hashlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-from rake_nltk import Rake # import rake to extract keywords from article text
-from sklearn.metrics.pairwise import cosine_similarity # import cosine similarity to calculate similarity between articles
-from sklearn.feature_extraction.text import CountVectorizer # import count vectorizer for vercorization of keywords from article
+from scipy import sparse
+from .similarity_index import blocked_top_k
+from .instrumentation import timed
 
-def get_keywords(row):
+# Rake instance reused for all texts processed by the current process
+# (each worker process of the extraction pool creates its own instance once)
+_rake = None
+
+def _get_rake():
     '''
-    Function used to extract keywords from article content
+    Returns Rake instance of the current process, creates it on first call.
+    '''
+    global _rake
+    
+    if _rake is None:
+        # import rake (and NLTK corpora) only when keywords are extracted, so loading
+        # a fitted recommender doesn't pay for it
+        from rake_nltk import Rake
+        
+        # instantiating Rake, by default it uses english stopwords from NLTK
+        # and discards all puntuation characters as well
+        _rake = Rake()
+    
+    return _rake
+
+def text_keywords(text, r):
+    '''
+    Function used to extract keywords from text
     INPUT:
-    row - row from df_new pandas dataframe
+    text - string with article content
+    r - Rake instance used for extraction
     
     OUTPUT:
-    keywords - string, containing keywords from 'doc_body' column separated by spaces
-    keywords are extracted using nltk_rake library
+    keywords - string, containing keywords from text separated by spaces
     '''
-    decsription = row['doc_body']
-     
-    # instantiating Rake, by default it uses english stopwords from NLTK
-    # and discards all puntuation characters as well
-    r = Rake()
-
     # extracting the words by passing the text
-    r.extract_keywords_from_text(decsription)
+    r.extract_keywords_from_text(text)
 
     # getting the dictionary whith key words as keys and their scores as values
     key_words_dict_scores = r.get_word_degrees()
     
-    # assigning the key words to the new column for the corresponding movie
+    # join the key words into a single string
     keywords = list(key_words_dict_scores.keys())
     keywords = ' '.join(keywords)
     
     return keywords
 
-def prepare_data(df_content):
+def get_keywords(row):
+    '''
+    Function used to extract keywords from article content
+    INPUT:
+    row - row from df_new pandas dataframe
+    
+    OUTPUT:
+    keywords - string, containing keywords from 'doc_body' column separated by spaces
+    keywords are extracted using nltk_rake library
+    '''
+    return text_keywords(row['doc_body'], _get_rake())
+
+def _extract_keywords_batch(texts):
+    '''
+    Extracts keywords for a batch of texts with the Rake instance of the current process.
+    '''
+    r = _get_rake()
+    
+    return [text_keywords(text, r) for text in texts]
+
+@timed('content_helpers.extract_keywords')
+def extract_keywords(texts, n_jobs = 1, chunk_size = 256):
+    '''
+    Extracts keywords for a sequence of texts in batches, batches are processed
+    by a pool of worker processes if n_jobs is not 1
+    INPUT:
+    texts - sequence of strings with article content
+    n_jobs - (int) number of worker processes, 1 to extract keywords in the current process,
+    None to use all available cores
+    chunk_size - (int) number of texts sent to a worker at once
+    
+    OUTPUT:
+    keywords - list of strings with keywords separated by spaces, in the same order as texts
+    (the result doesn't depend on n_jobs and chunk_size)
+    '''
+    texts = list(texts)
+    batches = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    
+    if n_jobs == 1 or len(batches) <= 1:
+        results = [_extract_keywords_batch(batch) for batch in batches]
+    else:
+        # executor.map returns results in the order of batches
+        with ProcessPoolExecutor(max_workers = min(n_jobs, len(batches))) as executor:
+            results = list(executor.map(_extract_keywords_batch, batches))
+    
+    return [keywords for batch in results for keywords in batch]
+
+class KeywordCache():
+    '''
+    Persistent on-disk cache of article keywords. Entries are keyed by article_id
+    and hash of article's doc_body, so only new or changed articles are passed to
+    keywords extraction. Cache also stores vocabulary of keyword tokens,
+    which is extended incrementally: new tokens are appended as new columns, so
+    columns of previously vectorized articles don't change.
+    '''
+    
+    VERSION = 1
+    
+    # same tokenization as default CountVectorizer
+    TOKEN_PATTERN = re.compile(r'(?u)\b\w\w+\b')
+    
+    def __init__(self, path = None):
+        '''
+        INPUT:
+        path - (str) path to the cache file, cache is loaded from the file if it exists,
+        if None cache is kept in memory only
+        '''
+        self.path = path
+        self.entries = dict()
+        self.vocabulary = dict()
+        
+        if path is not None and os.path.exists(path):
+            self.load()
+    
+    @staticmethod
+    def content_hash(text):
+        '''
+        INPUT:
+        text - string with article content
+        
+        OUTPUT:
+        hex digest of the text
+        '''
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def _key(article_id, text_hash):
+        return '{}:{}'.format(article_id, text_hash)
+    
+    def load(self):
+        '''
+        Loads entries and vocabulary from the cache file, cache files of other versions are ignored.
+        '''
+        with open(self.path, 'r') as f:
+            data = json.load(f)
+        
+        if data.get('version') != self.VERSION:
+            return
+        
+        self.entries = data['entries']
+        self.vocabulary = data['vocabulary']
+    
+    def save(self):
+        '''
+        Writes entries and vocabulary to the cache file.
+        '''
+        if self.path is None:
+            return
+        
+        # write to temporary file first, so a failed write doesn't corrupt the cache
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': self.VERSION, 'entries': self.entries, 'vocabulary': self.vocabulary}, f)
+        os.replace(tmp_path, self.path)
+    
+    @timed('content_helpers.KeywordCache.get_keywords')
+    def get_keywords(self, article_ids, texts, n_jobs = 1, chunk_size = 256):
+        '''
+        Returns keywords for articles, extracts keywords only for articles which are not in the cache.
+        Entries of articles which are not passed anymore are removed from the cache.
+        INPUT:
+        article_ids - sequence of article ids
+        texts - sequence of strings with article content
+        n_jobs - (int) number of worker processes used for keywords extraction
+        chunk_size - (int) number of articles sent to a worker at once
+        
+        OUTPUT:
+        keywords - list of strings with keywords separated by spaces, in the same order as texts
+        '''
+        keys = [self._key(article_id, self.content_hash(text)) for article_id, text in zip(article_ids, texts)]
+        
+        # extract keywords only for new or changed articles
+        missing = [i for i, key in enumerate(keys) if key not in self.entries]
+        missing_keywords = extract_keywords([texts[i] for i in missing], n_jobs, chunk_size)
+        
+        entries = {key: self.entries[key] for key in keys if key in self.entries}
+        for i, keywords in zip(missing, missing_keywords):
+            entries[keys[i]] = keywords
+        self.entries = entries
+        
+        return [self.entries[key] for key in keys]
+    
+    def count_matrix(self, keywords):
+        '''
+        Vectorizes keywords into a sparse matrix of token counts, tokens which are
+        not in the vocabulary yet are added to it.
+        INPUT:
+        keywords - sequence of strings with keywords separated by spaces
+        
+        OUTPUT:
+        count_matrix - scipy sparse CSR matrix of articles by tokens
+        '''
+        indptr = [0]
+        indices = []
+        data = []
+        
+        for text in keywords:
+            counts = Counter(self.TOKEN_PATTERN.findall(text.lower()))
+            for token, count in counts.items():
+                if token not in self.vocabulary:
+                    self.vocabulary[token] = len(self.vocabulary)
+                indices.append(self.vocabulary[token])
+                data.append(count)
+            indptr.append(len(indices))
+        
+        count_matrix = sparse.csr_matrix((np.array(data, dtype = np.int64), np.array(indices, dtype = np.int64), np.array(indptr, dtype = np.int64)),
+                                         shape = (len(indptr) - 1, len(self.vocabulary)))
+        count_matrix.sort_indices()
+        
+        return count_matrix
+
+@timed('content_helpers.prepare_data')
+def prepare_data(df_content, n_jobs = 1, chunk_size = 256, keyword_cache = None):
     '''
     Creates pandas dataframe, which is used for making content-based recommendations
     INPUT:
     df_content - pandas dataframe containing details on articles' content
+    n_jobs - (int) number of worker processes used for keywords extraction
+    chunk_size - (int) number of articles sent to a worker at once
+    keyword_cache - (KeywordCache) optional cache, if provided keywords are extracted
+    only for articles which are not in the cache
     
     OUTPUT:
     df_new - pandas dataframe which contains following columns: 'article_id' - id of article from df_content,
@@ -58,26 +258,180 @@ def prepare_data(df_content):
     df_new = df_new.dropna(subset=['doc_body'])
     
     # the new column for keywords
-    df_new['keywords'] = df_new.apply(lambda row: get_keywords(row),axis=1)
+    if keyword_cache is not None:
+        df_new['keywords'] = keyword_cache.get_keywords(df_new['article_id'].values, df_new['doc_body'].values, n_jobs, chunk_size)
+    else:
+        df_new['keywords'] = extract_keywords(df_new['doc_body'].values, n_jobs, chunk_size)
 
     # dropping the Plot column
     df_new.drop(columns = ['doc_body'], inplace = True)
     
     return df_new
 
-def get_similar_articles(article_id, df_new):
+class ArticleSimilarityIndex():
+    '''
+    Precomputed top-K similar articles table. Keywords are vectorized once
+    and for each article k most similar articles (by cosine similarity of keyword
+    count vectors) are stored, so similar articles are looked up in O(k).
+    '''
+    
+    def __init__(self, neighbors, similarities, article_ids):
+        '''
+        INPUT:
+        neighbors - (n x k array) row indexes of similar articles, -1 for empty positions
+        similarities - (n x k array) cosine similarity to each of the similar articles
+        article_ids - array of article ids corresponding to rows
+        '''
+        self.neighbors = neighbors
+        self.similarities = similarities
+        self.article_ids = np.asarray(article_ids).astype(np.int64)
+        
+        # array mapping article_id to row, -1 for unknown articles (first row is used for duplicated ids)
+        self.article_rows = np.full(self.article_ids.max() + 1 if len(self.article_ids) else 0, -1, dtype = np.int64)
+        self.article_rows[self.article_ids[::-1]] = np.arange(len(self.article_ids))[::-1]
+    
+    @classmethod
+    @timed('content_helpers.ArticleSimilarityIndex.build')
+    def build(cls, df_new, k = 50, chunk_size = 1024, count_matrix = None, ann_index = None, n_jobs = 1):
+        '''
+        Builds similar articles table.
+        INPUT:
+        df_new - pandas dataframe which contains following columns: 'article_id' - id of article from df_content,
+        'keywords' - contains strings with keywords extracted from article content separated by spaces
+        k - (int) number of similar articles to store for each article
+        chunk_size - (int) number of articles to compute similarity for at once, if None similarity
+        is computed for all articles at once (full number of articles x number of articles matrix)
+        count_matrix - optional sparse matrix of keyword counts (rows aligned with df_new),
+        if None keywords are vectorized with CountVectorizer
+        ann_index - optional not fitted approximate nearest neighbor index (see ann_index.py),
+        if provided similar articles are found with it instead of exact search
+        n_jobs - (int) number of worker processes computing chunks of similarities with exact search,
+        None to use all available cores
+        
+        OUTPUT:
+        similarity_index - ArticleSimilarityIndex instance
+        '''
+        # import normalize to compute cosine similarity as dot product of normalized vectors
+        from sklearn.preprocessing import normalize
+        
+        # instantiating and generating the count matrix only once
+        if count_matrix is None:
+            from sklearn.feature_extraction.text import CountVectorizer
+            count = CountVectorizer()
+            count_matrix = count.fit_transform(df_new['keywords'])
+        count_matrix = normalize(count_matrix)
+        
+        if chunk_size is None:
+            chunk_size = max(count_matrix.shape[0], 1)
+        
+        if ann_index is not None:
+            neighbors, similarities = ann_index.fit(count_matrix).all_neighbors(k)
+        else:
+            neighbors, similarities = blocked_top_k(count_matrix, k, chunk_size, n_jobs = n_jobs)
+        
+        return cls(neighbors, similarities, df_new['article_id'].values)
+    
+    def to_arrays(self):
+        '''
+        OUTPUT:
+        arrays - (dict) numpy arrays to save the table
+        '''
+        return {'neighbors': self.neighbors, 'similarities': self.similarities, 'article_ids': self.article_ids}
+    
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        INPUT:
+        arrays - (dict) numpy arrays produced by to_arrays (can be memory-mapped)
+        
+        OUTPUT:
+        similarity_index - ArticleSimilarityIndex instance
+        '''
+        return cls(arrays['neighbors'], arrays['similarities'], arrays['article_ids'])
+    
+    def article_row(self, article_id):
+        '''
+        INPUT:
+        article_id - (int) id of the article
+        
+        OUTPUT:
+        row of the article in the table or -1 if article is unknown
+        '''
+        if 0 <= article_id < len(self.article_rows):
+            return self.article_rows[article_id]
+        return -1
+    
+    @timed('content_helpers.ArticleSimilarityIndex.similarity_matrix')
+    def similarity_matrix(self, article_ids):
+        '''
+        Returns similar articles table as a sparse matrix for provided articles.
+        INPUT:
+        article_ids - array of article ids (e.g. columns of user-item matrix), ids are rounded to int
+        
+        OUTPUT:
+        similarity - sparse CSR matrix of articles by articles (aligned with article_ids) with
+        cosine similarity of k most similar articles for each article, 0 for articles which are unknown
+        '''
+        article_ids = np.asarray(article_ids)
+        rows = np.array([self.article_row(int(round(a))) for a in article_ids], dtype = np.int64)
+        
+        # map rows of the table to positions in article_ids
+        position = np.full(len(self.article_ids), -1, dtype = np.int64)
+        position[rows[rows >= 0]] = np.flatnonzero(rows >= 0)
+        known = np.flatnonzero(rows >= 0)
+        neighbors = self.neighbors[rows[known]]
+        neighbor_position = np.where(neighbors >= 0, position[neighbors], -1)
+        
+        # keep pairs of articles which are both in article_ids
+        i, j = np.nonzero(neighbor_position >= 0)
+        similarity = sparse.csr_matrix((self.similarities[rows[known]][i, j], (known[i], neighbor_position[i, j])),
+                                       shape = (len(article_ids), len(article_ids)))
+        similarity.setdiag(0)
+        similarity.eliminate_zeros()
+        
+        return similarity
+    
+    def get_similar_articles(self, article_id):
+        '''
+        INPUT:
+        article_id - (int) id of the article
+        
+        OUTPUT:
+        similar_articles - list of ids of similar articles sorted by similarity,
+        the list is empty if article is unknown
+        '''
+        row = self.article_row(article_id)
+        if row < 0:
+            return []
+        
+        neighbors = self.neighbors[row]
+        similar_articles = self.article_ids[neighbors[neighbors >= 0]]
+        
+        return similar_articles[similar_articles != article_id].tolist()
+
+@timed('content_helpers.get_similar_articles')
+def get_similar_articles(article_id, df_new, similarity_index = None):
     '''
     Returns list of similar articles using content-based approach  
     INPUT:
     article_id - id of the article to provide similar articles
     df_new - pandas dataframe which contains following columns: 'article_id' - id of article from df_content,
     'keywords' - contains strings with keywords extracted from article content separated by spaces
+    similarity_index - (ArticleSimilarityIndex) optional precomputed similar articles table,
+    if provided top-K similar articles are looked up from the table
     
     OUTPUT:
     similar_articles - list of similar articles, the list is empty if article with passed article_id
     is not in df_new dataset
     
     '''    
+    if similarity_index is not None:
+        return similarity_index.get_similar_articles(article_id)
+    
+    # import count vectorizer and cosine similarity only when similarity is computed from scratch
+    from sklearn.feature_extraction.text import CountVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
+    
     try:
     
         # instantiating and generating the count matrix
@@ -85,14 +439,14 @@ def get_similar_articles(article_id, df_new):
         count_matrix = count.fit_transform(df_new['keywords'])
     
         # find row number corresponding to article id
-        article_idx = df_new[df_new['article_id'] == article_id].index[0]
+        article_idx = np.flatnonzero(df_new['article_id'].values == article_id)[0]
     
         # find vector from cosine_sim matrix with similarity
         article_similarity = cosine_similarity(count_matrix, count_matrix, dense_output = True)[article_idx, :]
     
         # create dataframe with article ids and corresponding similarity to passed article
         similar_articles = pd.DataFrame(columns = ['article_id', 'similarity'])
-        similar_articles.article_id = df_new.article_id.index
+        similar_articles.article_id = df_new.article_id.values
         similar_articles.similarity = article_similarity
     
         # sort dataframe by similarity
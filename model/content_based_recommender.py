@@ -8,10 +8,16 @@ Created on Tue Mar 26 14:36:55 2019
 File contains class for making content based recommendations using NLP.
 """
 
+import uuid
 import numpy as np
 import pandas as pd
-import recommender_helper_functions as hf
-import content_based_helpers as cbh
+from . import recommender_helper_functions as hf
+from . import content_based_helpers as cbh
+from .ann_index import build_ann_index
+from scipy import sparse
+from .user_item_store import UserItemMatrix, InteractionCounts, EmailEncoder, ArticleTitles, InteractionLog
+from . import persistence
+from .instrumentation import timed, stage
 
 class ContentBasedRecommender():
     '''
@@ -19,6 +25,40 @@ class ContentBasedRecommender():
     articles using NLP.
     '''
     
+    def __init__(self, n_similar = 50, chunk_size = 1024, n_jobs = 1, keywords_chunk_size = 256,
+                 keywords_cache_path = None, chunksize = None, ann_params = None):
+        '''
+        INPUT:
+            n_similar - (int) number of most similar articles stored for each article
+            chunk_size - (int) number of articles processed at once when building
+            the similar articles table, None to compute the full similarity matrix at once
+            n_jobs - (int) number of worker processes for keywords extraction and
+            for building the similar articles table, None to use all available cores
+            keywords_chunk_size - (int) number of articles sent to a keywords extraction worker at once
+            keywords_cache_path - (str) optional path to keywords cache file, if provided keywords
+            are extracted only for new or changed articles and the cache is updated on each fit
+            chunksize - (int) number of rows of interactions dataset read at once,
+            None to read the whole dataset at once
+            ann_params - (dict) optional parameters of approximate nearest neighbor index
+            used to build the similar articles table, e.g. {'method': 'lsh', 'n_tables': 8, 'n_bits': 12},
+            None for exact search
+        '''
+        self.n_similar = n_similar
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+        self.keywords_chunk_size = keywords_chunk_size
+        self.keywords_cache_path = keywords_cache_path
+        self.chunksize = chunksize
+        self.ann_params = ann_params
+    
+    @property
+    def df(self):
+        '''
+        Log of interactions as pandas dataframe with article_id, title, user_id columns.
+        '''
+        return self.log.frame
+    
+    @timed('content.fit')
     def fit(self, user_articles_pth, articles_content_pth):
         '''
         Fits the recommender to data which contains details about articles'
@@ -31,21 +71,59 @@ class ContentBasedRecommender():
             articles_content_pth - (str) ath to dataset, which contains
             information on content of articles
         '''
-        # read dataset with interactions with articles
-        self.df = pd.read_csv(user_articles_pth)
+        # read dataset with interactions with articles (chunk by chunk if chunksize is set),
+        # map emails to user_ids, create user-article matrix, count interactions and take titles
+        df, user_item, email_encoder, counts, article_titles = hf.read_interactions(user_articles_pth, self.chunksize)
+        
+        with stage('content.fit.read_articles'):
+            df_content = pd.read_csv(articles_content_pth)
+        
+        self.fit_store(df, user_item, email_encoder, df_content, counts, article_titles)
+    
+    def fit_store(self, df, user_item, email_encoder, df_content, counts = None, article_titles = None):
+        '''
+        Fits the recommender to an already read log of interactions and articles' content.
+        Passed objects are used without copying, so they can be shared with other recommenders.
         
-        # map emails to user_ids
-        email_encoded = hf.email_mapper(self.df)
-        del self.df['email']
-        self.df['user_id'] = email_encoded
+        INPUT:
+            df - pandas dataframe with article_id, title, user_id columns
+            user_item - (UserItemMatrix) sparse matrix of users by articles
+            email_encoder - (EmailEncoder) mapping of emails to user ids
+            df_content - pandas dataframe with content of articles (articles_community.csv)
+            counts - (InteractionCounts) optional precomputed interaction counts
+            article_titles - (ArticleTitles) optional precomputed titles of articles
+        '''
+        self.log, self.user_item, self.email_encoder = InteractionLog.from_frame(df), user_item, email_encoder
+        self.df_content = df_content
         
-        self.df_content = pd.read_csv(articles_content_pth)
+        if self.keywords_cache_path is not None:
+            # reuse keywords and vocabulary of articles, which didn't change since the last fit
+            keyword_cache = cbh.KeywordCache(self.keywords_cache_path)
+            self.df_new = cbh.prepare_data(self.df_content, self.n_jobs, self.keywords_chunk_size, keyword_cache)
+            count_matrix = keyword_cache.count_matrix(self.df_new['keywords'])
+            keyword_cache.save()
+        else:
+            self.df_new = cbh.prepare_data(self.df_content, self.n_jobs, self.keywords_chunk_size)
+            count_matrix = None
         
-        self.df_new = cbh.prepare_data(self.df_content)
+        # vectorize keywords once and precompute similar articles table
+        ann_index = build_ann_index(**self.ann_params) if self.ann_params is not None else None
+        self.similarity_index = cbh.ArticleSimilarityIndex.build(self.df_new, self.n_similar, self.chunk_size, count_matrix, ann_index, self.n_jobs)
         
-        # create user-article matrix
-        self.user_item = hf.create_user_item_matrix(self.df)
+        # count interactions of articles and users and rank articles by popularity once
+        with stage('content.fit.counts'):
+            self.counts = counts if counts is not None else InteractionCounts.build(self.df, self.user_item)
         
+        # titles of articles aligned with columns of user-article matrix
+        self.article_titles = article_titles if article_titles is not None else ArticleTitles.build(self.df, self.user_item)
+        
+        # similar articles table aligned with user-article matrix columns
+        self.article_similarity = self.similarity_index.similarity_matrix(self.user_item.article_ids)
+        
+        # new version of the fitted state, cached recommendations of other versions are not served
+        self.model_version = uuid.uuid4().hex
+        
+    @timed('content.make_recs')
     def make_recs(self, user_id, rec_num = 5):
         '''
         Makes recommendations for articles for provided user.
@@ -58,48 +136,162 @@ class ContentBasedRecommender():
             recs - list of recommended article_ids
             rec_names - list of recommended article names      
         '''
-        recs = []
+        return self.make_recs_batch([user_id], rec_num)[0]
     
-        # if provided user has no views then recommend top m most popular articles
-        if user_id not in self.df.user_id.unique().tolist():
-            recs = hf.get_top_article_ids(rec_num, self.df)
+    def article_scores(self, user_idx, seen):
+        '''
+        INPUT:
+            user_idx - array of row indexes of users, -1 for unknown users
+            seen - (b x m sparse matrix) articles the users interacted with (UserItemMatrix.rows)
+            
+        OUTPUT:
+            scores - (b x m array) sum of similarity of each article to the articles the users interacted with
+        '''
+        return (seen @ self.article_similarity).toarray()
+    
+    @timed('content.make_recs_batch')
+    def make_recs_batch(self, user_ids, rec_num = 5, block_size = 1024):
+        '''
+        Makes recommendations for articles for many users at once. Each article
+        is scored by the sum of its similarity to articles the user interacted with,
+        articles with positive score are recommended first, then the most popular
+        articles. Users with no views get the most popular articles.
         
-        else:
-            # get list of user articles
-            user_articles = hf.get_user_articles(user_id, self.user_item, self.df)[0]
+        INPUT:
+            user_ids - list of ids of the users to make recommendations for
+            rec_num - number of recommended articles for each user
+            block_size - number of users scored with one matrix product,
+            memory is bounded by block_size x number of articles
+            
+        OUTPUT:
+            recommendations - list of (recs, rec_names) tuples for each user:
+            recs - list of recommended article_ids
+            rec_names - list of recommended article names
+        '''
+        popularity = self.counts.popularity
+        user_idx = self.user_item.user_indexes(user_ids)
         
-            # for each user article find similar article using content-based approach
-            for article in user_articles:
-                similar_articles_int = cbh.get_similar_articles(round(float(article)), self.df_new)
-                similar_articles = [str(float(a)) for a in similar_articles_int]
+        recommendations = []
+        for start in range(0, len(user_idx), block_size):
+            block = user_idx[start:start + block_size]
+            
+            # sum similarity of each article to the articles block users interacted with
+            with stage('content.make_recs_batch.scores') as s:
+                seen = self.user_item.rows(block)
+                scores = self.article_scores(block, seen)
+                s.add_bytes(scores.nbytes)
             
-                # for each of similar articles append article to recommendations if it is not in recs so far and
-                # user didn't interact with this article before
-                for sim_article in similar_articles:
-                    if (sim_article not in user_articles) and (sim_article not in recs):
-                        recs.append(sim_article)
-                    
-                    if len(recs) >= rec_num:
-                        break
-                    
-                # if found recommendations less than required  add articles from top viewed articles
-                if len(recs) < rec_num:
-                    top_articles = hf.get_top_article_ids(2 * rec_num)
-                    for article in top_articles:
-                        # if acticle is not already viewed by the user and not in list already then append the article to recs
-                        if (article not in user_articles) and (article not in recs):
-                            recs.append(article)
-             
-                    # if exceed the number of required recommendations then break the loop and return results
-                    if len(recs) >= rec_num:
-                        break
-        
-        recs = recs[:rec_num]
+            top_articles = hf.select_top_articles(scores, seen, popularity, rec_num)
+            
+            with stage('content.make_recs_batch.names'):
+                for top in top_articles:
+                    recommendations.append((self.user_item.article_labels[top].tolist(), self.article_titles.names(top)))
+        
+        return recommendations
     
-        # get article names
-        rec_names = hf.get_article_names(recs, self.df) 
+    @timed('content.add_interactions')
+    def add_interactions(self, records):
+        '''
+        Adds new interactions to the fitted recommender without refitting:
+        extends mapping of emails to user ids, appends interactions to the
+        user-article matrix and updates popularity counts in place.
+        
+        INPUT:
+            records - pandas dataframe or list of dicts with article_id, title, email
+            of new interactions
+            
+        OUTPUT:
+            user_ids - list of ids of users whose scores of articles changed, recommendations
+            of other users can change only if they contain articles which moved in the
+            popularity ranking (see InteractionCounts.moved_articles)
+        '''
+        # update the log, user-article matrix, counts and titles
+        user_map, article_map, rows, cols, ranking_changed = hf.store_interactions(
+            self.log, self.user_item, self.email_encoder, self.counts, self.article_titles, records)
+        
+        return self.update_indexes(user_map, article_map, rows)
     
-        return recs , rec_names
-
-
-
+    def update_indexes(self, user_map, article_map, rows):
+        '''
+        Realigns the similar articles table after new interactions were added to the store
+        with recommender_helper_functions.store_interactions. Popularity only orders
+        articles, so a changed popularity ranking doesn't replace model_version.
+        
+        INPUT:
+            user_map, article_map, rows - arrays returned by UserItemMatrix.add_interactions
+            
+        OUTPUT:
+            user_ids - list of ids of users of the new interactions and users who interacted
+            with articles similar to new articles
+        '''
+        users = np.unique(rows)
+        
+        # similar articles table is aligned with columns of user-article matrix, realign it for new articles
+        if len(article_map) != self.user_item.shape[1]:
+            with stage('content.add_interactions.article_similarity'):
+                self.article_similarity = self.similarity_index.similarity_matrix(self.user_item.article_ids)
+            
+            # new articles become candidates of users who interacted with articles similar to them
+            new_articles = np.setdiff1d(np.arange(self.user_item.shape[1]), article_map)
+            similar = np.unique(self.article_similarity[:, new_articles].nonzero()[0])
+            users = np.union1d(users, self.user_item.csc[:, similar].indices)
+        
+        return self.user_item.user_ids[users].tolist()
+    
+    def save(self, path):
+        '''
+        Saves fitted recommender to a versioned binary artifact. Articles' content
+        and keywords (df_content, df_new) are not saved, they are only needed for fitting.
+        
+        INPUT:
+            path - (str) path to the artifact directory
+        '''
+        arrays = dict()
+        arrays.update(persistence.prefixed('df', self.log.to_arrays()))
+        arrays.update(persistence.prefixed('user_item', self.user_item.to_arrays()))
+        arrays.update(persistence.prefixed('counts', self.counts.to_arrays()))
+        arrays.update(persistence.prefixed('similarity_index', self.similarity_index.to_arrays()))
+        arrays.update(persistence.prefixed('email_encoder', self.email_encoder.to_arrays()))
+        arrays.update(persistence.prefixed('article_titles', self.article_titles.to_arrays()))
+        arrays.update(persistence.prefixed('article_similarity', {'data': self.article_similarity.data,
+                                                                 'indices': self.article_similarity.indices,
+                                                                 'indptr': self.article_similarity.indptr}))
+        
+        params = {'n_similar': self.n_similar, 'chunk_size': self.chunk_size, 'n_jobs': self.n_jobs,
+                  'keywords_chunk_size': self.keywords_chunk_size, 'keywords_cache_path': self.keywords_cache_path,
+                  'chunksize': self.chunksize, 'ann_params': self.ann_params}
+        
+        persistence.save_artifact(path, type(self).__name__, params, arrays)
+    
+    @classmethod
+    def load(cls, path, mmap = True):
+        '''
+        Loads fitted recommender from an artifact created by save.
+        
+        INPUT:
+            path - (str) path to the artifact directory
+            mmap - (bool) if True large arrays are memory-mapped read-only, so
+            worker processes loading the same artifact share memory pages
+            
+        OUTPUT:
+            rec - fitted ContentBasedRecommender (df_content and df_new are None)
+        '''
+        params, arrays = persistence.load_artifact(path, cls.__name__, mmap)
+        
+        rec = cls(**params)
+        rec.log = InteractionLog.from_arrays(persistence.unprefixed('df', arrays))
+        rec.df_content = None
+        rec.df_new = None
+        rec.user_item = UserItemMatrix.from_arrays(persistence.unprefixed('user_item', arrays))
+        rec.counts = InteractionCounts.from_arrays(persistence.unprefixed('counts', arrays))
+        rec.similarity_index = cbh.ArticleSimilarityIndex.from_arrays(persistence.unprefixed('similarity_index', arrays))
+        rec.email_encoder = EmailEncoder.from_arrays(persistence.unprefixed('email_encoder', arrays))
+        rec.article_titles = ArticleTitles.from_arrays(persistence.unprefixed('article_titles', arrays))
+        
+        article_similarity = persistence.unprefixed('article_similarity', arrays)
+        n_articles = rec.user_item.shape[1]
+        rec.article_similarity = sparse.csr_matrix((article_similarity['data'], article_similarity['indices'], article_similarity['indptr']),
+                                                   shape = (n_articles, n_articles), copy = False)
+        rec.model_version = uuid.uuid4().hex
+        
+        return rec
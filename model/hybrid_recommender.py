@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains class for making hybrid recommendations: collaborative and
+content-based scores of articles are fused with configurable weights.
+"""
+
+import uuid
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from . import recommender_helper_functions as hf
+from . import content_based_helpers as cbh
+from .collaborative_recommender import CollaborativeRecommender
+from .content_based_recommender import ContentBasedRecommender
+from .similarity_index import NeighborIndex
+from .user_item_store import UserItemMatrix, InteractionCounts, EmailEncoder, ArticleTitles, InteractionLog
+from . import persistence
+from .instrumentation import timed, stage
+
+def normalize_scores(scores):
+    '''
+    Scales scores of each user to [0, 1] by the largest score of the user,
+    so scores of different engines are comparable.
+
+    INPUT:
+        scores - (b x m array) non-negative scores of articles for each user
+
+    OUTPUT:
+        normalized - (b x m array) scaled scores, rows without positive scores stay 0
+    '''
+    scores = np.asarray(scores, dtype = np.float64)
+    top = scores.max(axis = 1, keepdims = True) if scores.shape[1] > 0 else np.zeros((scores.shape[0], 1))
+
+    return np.divide(scores, top, out = np.zeros(scores.shape), where = top > 0)
+
+class HybridRecommender():
+    '''
+    Class which contains methods to make recommendations for articles by
+    combining collaborative and content-based scores. Both engines share one
+    log of interactions, user-article matrix, email mapping, interaction counts
+    and titles, so they are read and stored once. Each engine scores all articles
+    for a block of users, scores are normalized per user, combined with weights
+    and top articles are selected in one pass, the most popular articles fill
+    the rest of recommendations.
+    '''
+
+    def __init__(self, collaborative_weight = 0.5, content_weight = 0.5, collaborative_params = None,
+                 content_params = None, chunksize = None):
+        '''
+        INPUT:
+            collaborative_weight - (float) weight of normalized collaborative scores
+            content_weight - (float) weight of normalized content-based scores
+            collaborative_params - (dict) parameters of CollaborativeRecommender (except chunksize),
+            None for {'scoring': 'similarity'}, so candidates are scored by similarity-weighted votes
+            content_params - (dict) parameters of ContentBasedRecommender (except chunksize)
+            chunksize - (int) number of rows of interactions dataset read at once,
+            None to read the whole dataset at once
+        '''
+        self.collaborative_weight = collaborative_weight
+        self.content_weight = content_weight
+        self.collaborative_params = collaborative_params if collaborative_params is not None else {'scoring': 'similarity'}
+        self.content_params = content_params if content_params is not None else dict()
+        self.chunksize = chunksize
+
+    @property
+    def df(self):
+        '''
+        Shared log of interactions as pandas dataframe with article_id, title, user_id columns.
+        '''
+        return self.log.frame
+
+    @timed('hybrid.fit')
+    def fit(self, user_articles_pth, articles_content_pth):
+        '''
+        Fits both engines to data which contains interactions between users and
+        articles and details about articles' content.
+
+        INPUT:
+            user_articles_pth - (str) path to dataset, which contains
+            information on interactions between users and articles
+
+            articles_content_pth - (str) path to dataset, which contains
+            information on content of articles
+        '''
+        # read dataset with interactions with articles once, map emails to user_ids, create user-article
+        # matrix, count interactions, rank articles by popularity and take titles once for both engines
+        df, self.user_item, self.email_encoder, self.counts, self.article_titles = hf.read_interactions(
+            user_articles_pth, self.chunksize)
+        self.log = InteractionLog.from_frame(df)
+
+        with stage('hybrid.fit.read_articles'):
+            df_content = pd.read_csv(articles_content_pth)
+
+        # engines build their own indexes on top of the shared store
+        self.collaborative = CollaborativeRecommender(**self.collaborative_params)
+        self.collaborative.fit_store(self.df, self.user_item, self.email_encoder, self.counts, self.article_titles)
+
+        self.content = ContentBasedRecommender(**self.content_params)
+        self.content.fit_store(self.df, self.user_item, self.email_encoder, df_content, self.counts, self.article_titles)
+
+        # engines share one log, so interactions appended by add_interactions are seen by both
+        self.collaborative.log = self.content.log = self.log
+
+        # new version of the fitted state, cached recommendations of other versions are not served
+        self.model_version = uuid.uuid4().hex
+
+    @timed('hybrid.make_recs')
+    def make_recs(self, user_id, rec_num = 5):
+        '''
+        Makes recommendations for articles for provided user.
+
+        INPUT:
+            user_id - id of the user to make recommendations for
+            rec_num - number of recommended articles
+
+        OUTPUT:
+            recs - list of recommended article_ids
+            rec_names - list of recommended article names
+        '''
+        return self.make_recs_batch([user_id], rec_num)[0]
+
+    def article_scores(self, user_idx, seen):
+        '''
+        INPUT:
+            user_idx - array of row indexes of users, -1 for unknown users
+            seen - (b x m sparse matrix) articles the users interacted with (UserItemMatrix.rows)
+
+        OUTPUT:
+            scores - (b x m array) weighted sum of normalized scores of the engines,
+            articles the users interacted with get no score
+        '''
+        seen_coo = seen.tocoo()
+        scores = np.zeros(seen.shape, dtype = np.float64)
+
+        for weight, engine in ((self.collaborative_weight, self.collaborative), (self.content_weight, self.content)):
+            if weight == 0:
+                continue
+
+            # seen articles are masked before normalization, so they don't scale down the other scores
+            engine_scores = engine.article_scores(user_idx, seen)
+            engine_scores[seen_coo.row, seen_coo.col] = 0
+            scores += weight * normalize_scores(engine_scores)
+
+        return scores
+
+    @timed('hybrid.make_recs_batch')
+    def make_recs_batch(self, user_ids, rec_num = 5, block_size = 1024):
+        '''
+        Makes recommendations for articles for many users at once. Articles with
+        positive combined score are recommended first (by score, equal scores by
+        popularity), then the most popular articles. Users with no views get
+        the most popular articles.
+
+        INPUT:
+            user_ids - list of ids of the users to make recommendations for
+            rec_num - number of recommended articles for each user
+            block_size - number of users scored at once,
+            memory is bounded by block_size x number of articles
+
+        OUTPUT:
+            recommendations - list of (recs, rec_names) tuples for each user:
+            recs - list of recommended article_ids
+            rec_names - list of recommended article names
+        '''
+        popularity = self.counts.popularity
+        user_idx = self.user_item.user_indexes(user_ids)
+
+        recommendations = []
+        for start in range(0, len(user_idx), block_size):
+            block = user_idx[start:start + block_size]
+
+            with stage('hybrid.make_recs_batch.scores') as s:
+                seen = self.user_item.rows(block)
+                scores = self.article_scores(block, seen)
+                s.add_bytes(scores.nbytes)
+
+            top_articles = hf.select_top_articles(scores, seen, popularity, rec_num)
+
+            with stage('hybrid.make_recs_batch.names'):
+                for top in top_articles:
+                    recommendations.append((self.user_item.article_labels[top].tolist(), self.article_titles.names(top)))
+
+        return recommendations
+
+    @timed('hybrid.add_interactions')
+    def add_interactions(self, records):
+        '''
+        Adds new interactions to the fitted recommender without refitting: the shared
+        store is updated once, then each engine updates its own indexes (neighbor
+        lists of the collaborative engine, similar articles table of the content engine).
+
+        INPUT:
+            records - pandas dataframe or list of dicts with article_id, title, email
+            of new interactions
+
+        OUTPUT:
+            user_ids - list of ids of users whose scores of articles changed in any of the
+            engines, recommendations of other users can change only if they contain articles
+            which moved in the popularity ranking (see InteractionCounts.moved_articles)
+        '''
+        # update the shared log, user-article matrix, counts and titles once
+        user_map, article_map, rows, cols, ranking_changed = hf.store_interactions(
+            self.log, self.user_item, self.email_encoder, self.counts, self.article_titles, records)
+
+        # collaborative scores with popularity scoring are popularity values, which are combined
+        # with content scores after normalization, so a changed ranking changes scores of every user
+        if ranking_changed and self.collaborative_weight != 0 and self.collaborative.scoring != 'similarity':
+            self.model_version = uuid.uuid4().hex
+
+        # engines update their indexes and report users whose scores changed
+        user_ids = set()
+        for engine in (self.collaborative, self.content):
+            user_ids.update(engine.update_indexes(user_map, article_map, rows))
+
+        return sorted(user_ids)
+
+    def save(self, path):
+        '''
+        Saves fitted recommender to a versioned binary artifact, the shared store
+        is saved once. Articles' content and keywords are not saved.
+
+        INPUT:
+            path - (str) path to the artifact directory
+        '''
+        arrays = dict()
+        arrays.update(persistence.prefixed('df', self.log.to_arrays()))
+        arrays.update(persistence.prefixed('user_item', self.user_item.to_arrays()))
+        arrays.update(persistence.prefixed('counts', self.counts.to_arrays()))
+        arrays.update(persistence.prefixed('email_encoder', self.email_encoder.to_arrays()))
+        arrays.update(persistence.prefixed('article_titles', self.article_titles.to_arrays()))
+        arrays.update(persistence.prefixed('neighbor_index', self.collaborative.neighbor_index.to_arrays()))
+        arrays.update(persistence.prefixed('similarity_index', self.content.similarity_index.to_arrays()))
+        arrays.update(persistence.prefixed('article_similarity', {'data': self.content.article_similarity.data,
+                                                                 'indices': self.content.article_similarity.indices,
+                                                                 'indptr': self.content.article_similarity.indptr}))
+
+        params = {'collaborative_weight': self.collaborative_weight, 'content_weight': self.content_weight,
+                  'collaborative_params': self.collaborative_params, 'content_params': self.content_params,
+                  'chunksize': self.chunksize}
+
+        persistence.save_artifact(path, type(self).__name__, params, arrays)
+
+    @classmethod
+    def load(cls, path, mmap = True):
+        '''
+        Loads fitted recommender from an artifact created by save.
+
+        INPUT:
+            path - (str) path to the artifact directory
+            mmap - (bool) if True large arrays are memory-mapped read-only, so
+            worker processes loading the same artifact share memory pages
+
+        OUTPUT:
+            rec - fitted HybridRecommender
+        '''
+        params, arrays = persistence.load_artifact(path, cls.__name__, mmap)
+
+        rec = cls(**params)
+        rec.log = InteractionLog.from_arrays(persistence.unprefixed('df', arrays))
+        rec.user_item = UserItemMatrix.from_arrays(persistence.unprefixed('user_item', arrays))
+        rec.counts = InteractionCounts.from_arrays(persistence.unprefixed('counts', arrays))
+        rec.email_encoder = EmailEncoder.from_arrays(persistence.unprefixed('email_encoder', arrays))
+        rec.article_titles = ArticleTitles.from_arrays(persistence.unprefixed('article_titles', arrays))
+
+        # engines share the store of the hybrid recommender
+        rec.collaborative = CollaborativeRecommender(**rec.collaborative_params)
+        rec.content = ContentBasedRecommender(**rec.content_params)
+        for engine in (rec.collaborative, rec.content):
+            engine.log, engine.user_item, engine.email_encoder = rec.log, rec.user_item, rec.email_encoder
+            engine.counts, engine.article_titles = rec.counts, rec.article_titles
+
+        rec.collaborative.neighbor_index = NeighborIndex.from_arrays(persistence.unprefixed('neighbor_index', arrays))
+
+        rec.content.df_content = None
+        rec.content.df_new = None
+        rec.content.similarity_index = cbh.ArticleSimilarityIndex.from_arrays(persistence.unprefixed('similarity_index', arrays))
+        article_similarity = persistence.unprefixed('article_similarity', arrays)
+        n_articles = rec.user_item.shape[1]
+        rec.content.article_similarity = sparse.csr_matrix((article_similarity['data'], article_similarity['indices'],
+                                                            article_similarity['indptr']),
+                                                           shape = (n_articles, n_articles), copy = False)
+
+        rec.model_version = uuid.uuid4().hex
+        for engine in (rec.collaborative, rec.content):
+            engine.model_version = rec.model_version
+
+        return rec
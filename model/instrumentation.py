@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains optional instrumentation of the recommenders: in-process registry
+of per-stage wall time, call counts and allocation sizes and exporters of the
+collected metrics (log lines, Prometheus text format).
+
+Instrumentation is disabled by default, disabled hooks cost one attribute check.
+"""
+
+import time
+import logging
+import threading
+import functools
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+def nbytes(obj):
+    '''
+    Returns approximate size in bytes of arrays, sparse matrices and pandas objects
+    (tuples and lists of them are summed), 0 for other objects.
+    '''
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if sparse.issparse(obj):
+        return sum(getattr(obj, name).nbytes for name in ('data', 'indices', 'indptr', 'row', 'col')
+                   if isinstance(getattr(obj, name, None), np.ndarray))
+    if isinstance(obj, pd.Index):
+        return obj.memory_usage()
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(np.sum(obj.memory_usage(index = False)))
+    if isinstance(obj, (tuple, list)) and len(obj) <= 16:
+        return sum(nbytes(item) for item in obj)
+    return 0
+
+class StageStats():
+    '''
+    Accumulated measurements of one stage.
+    '''
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.total_bytes = 0
+
+    def to_dict(self):
+        return {'calls': self.calls, 'total_time': self.total_time, 'max_time': self.max_time,
+                'mean_time': self.total_time / self.calls if self.calls > 0 else 0.0,
+                'total_bytes': self.total_bytes}
+
+class _NullStage():
+    '''
+    Context manager used for stages when instrumentation is disabled.
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_bytes(self, n):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+class _Stage():
+    '''
+    Context manager which measures wall time of a block and records it to the registry.
+    '''
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.bytes = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.record(self.name, time.perf_counter() - self.start, self.bytes)
+        return False
+
+    def add_bytes(self, n):
+        '''
+        Adds size of memory allocated in the stage.
+        '''
+        self.bytes += int(n)
+
+class MetricsRegistry():
+    '''
+    In-process registry of per-stage metrics (wall time, number of calls,
+    size of allocated results). Recording is thread-safe.
+    '''
+
+    def __init__(self, enabled = False):
+        self.enabled = enabled
+        self._stats = dict()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def record(self, name, seconds, allocated = 0):
+        '''
+        INPUT:
+            name - (str) name of the stage
+            seconds - (float) wall time of one call of the stage
+            allocated - (int) size in bytes of memory allocated by the call
+        '''
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = StageStats()
+            stats.calls += 1
+            stats.total_time += seconds
+            stats.max_time = max(stats.max_time, seconds)
+            stats.total_bytes += allocated
+
+    def stage(self, name):
+        '''
+        Returns context manager which measures the enclosed block as stage name,
+        a no-op context manager if the registry is disabled.
+        '''
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def snapshot(self):
+        '''
+        OUTPUT:
+            snapshot - (dict) stage name -> dict with calls, total_time, max_time, mean_time and total_bytes
+        '''
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in sorted(self._stats.items())}
+
+    def reset(self):
+        with self._lock:
+            self._stats = dict()
+
+    def export(self, exporter):
+        '''
+        Exports current snapshot with exporter (an object with export(snapshot) method).
+        '''
+        return exporter.export(self.snapshot())
+
+class LogExporter():
+    '''
+    Exporter which writes one log line per stage.
+    '''
+
+    def __init__(self, logger = None, level = logging.INFO):
+        self.logger = logger or logging.getLogger('recommender.metrics')
+        self.level = level
+
+    def export(self, snapshot):
+        for name, stats in snapshot.items():
+            self.logger.log(self.level, 'stage=%s calls=%d total=%.6fs mean=%.6fs max=%.6fs bytes=%d',
+                            name, stats['calls'], stats['total_time'], stats['mean_time'],
+                            stats['max_time'], stats['total_bytes'])
+
+class PrometheusExporter():
+    '''
+    Exporter which renders metrics in Prometheus text exposition format.
+    '''
+
+    METRICS = [('stage_calls_total', 'calls', 'counter', 'Number of calls of the stage'),
+               ('stage_seconds_total', 'total_time', 'counter', 'Total wall time of the stage in seconds'),
+               ('stage_seconds_max', 'max_time', 'gauge', 'Maximum wall time of one call of the stage in seconds'),
+               ('stage_allocated_bytes_total', 'total_bytes', 'counter', 'Total size of memory allocated by the stage')]
+
+    def __init__(self, prefix = 'recommender'):
+        self.prefix = prefix
+
+    def export(self, snapshot):
+        '''
+        OUTPUT:
+            text - (str) metrics in Prometheus text format
+        '''
+        lines = []
+        for metric, key, metric_type, description in self.METRICS:
+            name = '{}_{}'.format(self.prefix, metric)
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            for stage, stats in snapshot.items():
+                lines.append('{}{{stage="{}"}} {}'.format(name, stage.replace('"', '\\"'), repr(stats[key])))
+
+        return '\n'.join(lines) + '\n'
+
+# default registry used by the recommenders and helpers
+registry = MetricsRegistry()
+
+def enable():
+    registry.enable()
+
+def disable():
+    registry.disable()
+
+def stage(name):
+    '''
+    Returns context manager which measures the enclosed block in the default registry.
+    '''
+    return registry.stage(name)
+
+def timed(name):
+    '''
+    Decorator which records wall time, calls and size of the result of the
+    decorated function in the default registry as stage name.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            registry.record(name, time.perf_counter() - start, nbytes(result))
+
+            return result
+        return wrapper
+    return decorator
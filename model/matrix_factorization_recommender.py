@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains class for making recommendations with matrix factorization
+(truncated SVD) of the user-item matrix.
+"""
+
+import uuid
+import numpy as np
+from . import recommender_helper_functions as hf
+from .user_item_store import UserItemMatrix, InteractionCounts, EmailEncoder, ArticleTitles
+from . import persistence
+from .instrumentation import timed, stage
+
+class MatrixFactorizationRecommender():
+    '''
+    Class which contains methods to make recommendations for articles
+    using latent factors of users and articles. Factors are found with
+    randomized truncated SVD of the sparse user-item matrix, so the dense matrix
+    is never built. Articles are scored by dot product of user and article factors,
+    which costs O(k x number of articles) per user.
+    '''
+
+    def __init__(self, latent_features = 20, n_iter = 5, random_state = 42, chunksize = None):
+        '''
+        INPUT:
+            latent_features - (int) number of latent features (dimension of factors)
+            n_iter - (int) number of power iterations of randomized SVD
+            random_state - (int) seed of randomized SVD
+            chunksize - (int) number of rows of interactions dataset read at once,
+            None to read the whole dataset at once
+        '''
+        self.latent_features = latent_features
+        self.n_iter = n_iter
+        self.random_state = random_state
+        self.chunksize = chunksize
+
+    @timed('matrix_factorization.fit')
+    def fit(self, user_articles_pth):
+        '''
+        Fits the recommender to data which contains interactions between users
+        and articles.
+
+        INPUT:
+            user_articles_pth - (str) path to dataset, which contains
+            information on interactions between users and articles
+        '''
+        # read dataset with interactions with articles, map emails to user_ids, create user-article matrix,
+        # count interactions of articles and users, rank articles by popularity and take titles of articles
+        self.df, self.user_item, self.email_encoder, self.counts, self.article_titles = hf.read_interactions(
+            user_articles_pth, self.chunksize)
+
+        # truncated SVD of the sparse user-article matrix (sklearn is imported only for fitting)
+        from sklearn.utils.extmath import randomized_svd
+        with stage('matrix_factorization.fit.svd'):
+            k = max(min(self.latent_features, min(self.user_item.shape) - 1), 1)
+            u, s, vt = randomized_svd(self.user_item.matrix, k, n_iter = self.n_iter, random_state = self.random_state)
+
+        # singular values are merged into user factors, so scores are plain dot products
+        self.user_factors = (u * s).astype(np.float32)
+        self.article_factors = np.ascontiguousarray(vt.T, dtype = np.float32)
+
+        # new version of the fitted state, cached recommendations of other versions are not served
+        self.model_version = uuid.uuid4().hex
+
+    @timed('matrix_factorization.make_recs')
+    def make_recs(self, user_id, rec_num = 5):
+        '''
+        Makes recommendations for articles for provided user.
+
+        INPUT:
+            user_id - id of the user to make recommendations for
+            rec_num - number of recommended articles
+
+        OUTPUT:
+            recs - list of recommended article_ids
+            rec_names - list of recommended article names
+        '''
+        return self.make_recs_batch([user_id], rec_num)[0]
+
+    def article_scores(self, user_idx, seen):
+        '''
+        INPUT:
+            user_idx - array of row indexes of users, -1 for unknown users
+            seen - (b x m sparse matrix) articles the users interacted with (UserItemMatrix.rows), not used
+
+        OUTPUT:
+            scores - (b x m array) predicted scores (dot products of latent factors), unknown users get no scores
+        '''
+        scores = self.user_factors[np.maximum(user_idx, 0)] @ self.article_factors.T
+        scores[user_idx < 0] = 0
+
+        return scores
+
+    @timed('matrix_factorization.make_recs_batch')
+    def make_recs_batch(self, user_ids, rec_num = 5, block_size = 1024):
+        '''
+        Makes recommendations for articles for many users at once. Articles with
+        positive predicted score are recommended first (by score), then the most
+        popular articles. Users with no views get the most popular articles.
+
+        INPUT:
+            user_ids - list of ids of the users to make recommendations for
+            rec_num - number of recommended articles for each user
+            block_size - number of users scored with one matrix product,
+            memory is bounded by block_size x number of articles
+
+        OUTPUT:
+            recommendations - list of (recs, rec_names) tuples for each user:
+            recs - list of recommended article_ids
+            rec_names - list of recommended article names
+        '''
+        popularity = self.counts.popularity
+        user_idx = self.user_item.user_indexes(user_ids)
+
+        recommendations = []
+        for start in range(0, len(user_idx), block_size):
+            block = user_idx[start:start + block_size]
+
+            # predicted scores are dot products of latent factors, unknown users get no scores
+            with stage('matrix_factorization.make_recs_batch.scores') as st:
+                seen = self.user_item.rows(block)
+                scores = self.article_scores(block, seen)
+                st.add_bytes(scores.nbytes)
+
+            top_articles = hf.select_top_articles(scores, seen, popularity, rec_num)
+
+            with stage('matrix_factorization.make_recs_batch.names'):
+                for top in top_articles:
+                    recommendations.append((self.user_item.article_labels[top].tolist(), self.article_titles.names(top)))
+
+        return recommendations
+
+    def save(self, path):
+        '''
+        Saves fitted recommender to a versioned binary artifact.
+
+        INPUT:
+            path - (str) path to the artifact directory
+        '''
+        arrays = dict()
+        arrays.update(persistence.prefixed('df', hf.interactions_to_arrays(self.df)))
+        arrays.update(persistence.prefixed('user_item', self.user_item.to_arrays()))
+        arrays.update(persistence.prefixed('counts', self.counts.to_arrays()))
+        arrays.update(persistence.prefixed('email_encoder', self.email_encoder.to_arrays()))
+        arrays.update(persistence.prefixed('article_titles', self.article_titles.to_arrays()))
+        arrays.update({'user_factors': self.user_factors, 'article_factors': self.article_factors})
+
+        params = {'latent_features': self.latent_features, 'n_iter': self.n_iter,
+                  'random_state': self.random_state, 'chunksize': self.chunksize}
+
+        persistence.save_artifact(path, type(self).__name__, params, arrays)
+
+    @classmethod
+    def load(cls, path, mmap = True):
+        '''
+        Loads fitted recommender from an artifact created by save.
+
+        INPUT:
+            path - (str) path to the artifact directory
+            mmap - (bool) if True large arrays are memory-mapped read-only
+
+        OUTPUT:
+            rec - fitted MatrixFactorizationRecommender
+        '''
+        params, arrays = persistence.load_artifact(path, cls.__name__, mmap)
+
+        rec = cls(**params)
+        rec.df = hf.interactions_from_arrays(persistence.unprefixed('df', arrays))
+        rec.user_item = UserItemMatrix.from_arrays(persistence.unprefixed('user_item', arrays))
+        rec.counts = InteractionCounts.from_arrays(persistence.unprefixed('counts', arrays))
+        rec.email_encoder = EmailEncoder.from_arrays(persistence.unprefixed('email_encoder', arrays))
+        rec.article_titles = ArticleTitles.from_arrays(persistence.unprefixed('article_titles', arrays))
+        rec.user_factors = arrays['user_factors']
+        rec.article_factors = arrays['article_factors']
+        rec.model_version = uuid.uuid4().hex
+
+        return rec
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains functions for saving fitted recommenders to a versioned
+binary artifact and loading them back with memory-mapped arrays.
+
+Artifact is a directory with one .npy file per array and manifest.json
+with format version, model class, model parameters and list of arrays.
+"""
+
+import os
+import json
+import uuid
+import shutil
+import numpy as np
+
+FORMAT_VERSION = 2
+
+MANIFEST_NAME = 'manifest.json'
+
+def save_artifact(path, model_class, params, arrays):
+    '''
+    Saves fitted state of a model to a directory.
+
+    INPUT:
+        path - (str) path to the artifact directory, an existing artifact is replaced
+        model_class - (str) name of the model class
+        params - (dict) JSON serializable parameters of the model
+        arrays - (dict) numpy arrays of the fitted state by name
+    '''
+    path = os.path.normpath(path)
+
+    # artifact is written to a new sibling directory and swapped in, so arrays
+    # memory-mapped from an artifact at path are never overwritten
+    suffix = uuid.uuid4().hex
+    tmp_path = '{}.tmp-{}'.format(path, suffix)
+    os.makedirs(tmp_path)
+
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(array), allow_pickle = False)
+
+        manifest = {'format_version': FORMAT_VERSION,
+                    'model_class': model_class,
+                    'params': params,
+                    'arrays': sorted(arrays)}
+
+        with open(os.path.join(tmp_path, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent = 2)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors = True)
+        raise
+
+    # previous artifact is moved aside, files stay valid for processes which mapped them
+    old_path = None
+    if os.path.exists(path):
+        old_path = '{}.old-{}'.format(path, suffix)
+        os.rename(path, old_path)
+
+    os.rename(tmp_path, path)
+
+    if old_path is not None:
+        shutil.rmtree(old_path, ignore_errors = True)
+
+def load_artifact(path, model_class, mmap = True):
+    '''
+    Loads fitted state of a model from a directory.
+
+    INPUT:
+        path - (str) path to the artifact directory
+        model_class - (str) name of the expected model class
+        mmap - (bool) if True arrays are memory-mapped read-only, so processes
+        loading the same artifact share memory pages
+
+    OUTPUT:
+        params - (dict) parameters of the model
+        arrays - (dict) numpy arrays of the fitted state by name
+    '''
+    with open(os.path.join(path, MANIFEST_NAME), 'r') as f:
+        manifest = json.load(f)
+
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError('Unsupported artifact format version {}, expected {}'.format(
+            manifest.get('format_version'), FORMAT_VERSION))
+
+    if manifest.get('model_class') != model_class:
+        raise ValueError('Artifact contains {}, expected {}'.format(manifest.get('model_class'), model_class))
+
+    mmap_mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode = mmap_mode, allow_pickle = False)
+              for name in manifest['arrays']}
+
+    return manifest['params'], arrays
+
+def prefixed(prefix, arrays):
+    '''
+    INPUT:
+        prefix - (str) prefix of array names
+        arrays - (dict) arrays by name
+
+    OUTPUT:
+        dict with array names prefixed by prefix and a dot
+    '''
+    return {prefix + '.' + name: array for name, array in arrays.items()}
+
+def unprefixed(prefix, arrays):
+    '''
+    INPUT:
+        prefix - (str) prefix of array names
+        arrays - (dict) arrays by name
+
+    OUTPUT:
+        dict with arrays which names start with prefix, prefix is removed from names
+    '''
+    start = len(prefix) + 1
+    return {name[start:]: array for name, array in arrays.items() if name.startswith(prefix + '.')}
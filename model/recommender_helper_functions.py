@@ -10,6 +10,9 @@ File contains helper functions for collaborative recommender class.
 
 import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+from .user_item_store import UserItemMatrix, EmailEncoder, InteractionCounts, ArticleTitles
+from .instrumentation import timed
 
 def email_mapper(df):
     '''
@@ -20,21 +23,203 @@ def email_mapper(df):
         to be mapped to user ids
         
     OUTPUT:
-        email_encoded - list of user ids 
+        email_encoded - array of user ids (ids are assigned in order of first appearance starting from 1)
     '''
-    coded_dict = dict()
-    cter = 1
-    email_encoded = []
+    return EmailEncoder().encode(df['email'].values)
+
+def _unique_keys(keys):
+    '''
+    INPUT:
+        keys - array of integer keys (modified in place)
+        
+    OUTPUT:
+        sorted array of unique keys (sorting is faster than hashing for integer keys)
+    '''
+    keys.sort()
+    
+    return keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+
+@timed('helpers.read_interactions')
+def read_interactions(user_articles_pth, chunksize = None):
+    '''
+    Reads log of interactions between users and articles chunk by chunk with compact
+    dtypes and maps emails to user ids. Each chunk is reduced to its unique user-article
+    pairs, counts of its users and articles and first rows of its articles, so the
+    user-item matrix is built once at the end and temporary memory is bounded by the
+    number of unique pairs. The returned log itself keeps every row (4 bytes of
+    article_id, 4 bytes of user_id and a title code per interaction), as recommenders
+    keep the log of interactions.
+    
+    INPUT:
+        user_articles_pth - (str) path to dataset, which contains
+        information on interactions between users and articles
+        chunksize - (int) number of rows read at once, if None the whole file is read at once
+        
+    OUTPUT:
+        df - pandas dataframe with article_id (float32), title (categorical), user_id (int32) columns
+        user_item - (UserItemMatrix) sparse matrix of users by articles
+        email_encoder - (EmailEncoder) mapping of emails to user ids
+        counts - (InteractionCounts) interaction counts aligned with user_item
+        article_titles - (ArticleTitles) titles of articles aligned with user_item
+    '''
+    email_encoder = EmailEncoder()
+    
+    user_ids = []
+    article_ids = []
+    titles = []
+    pairs = []
+    chunk_articles = []
+    user_counts = np.zeros(0, dtype = np.int64)
+    n_rows = 0
+    
+    reader = pd.read_csv(user_articles_pth, usecols = ['article_id', 'title', 'email'],
+                         dtype = {'article_id': np.float32, 'title': 'category', 'email': object},
+                         chunksize = chunksize)
+    if chunksize is None:
+        reader = [reader]
+    
+    for chunk in reader:
+        users = email_encoder.encode(chunk['email'].values)
+        articles = chunk['article_id'].values
+        
+        user_ids.append(users)
+        article_ids.append(articles)
+        # a chunk without titles gets categories of another dtype, which can't be combined with others
+        titles.append(chunk['title'].cat.set_categories(chunk['title'].cat.categories.astype(str)))
+        
+        # unique user-article pairs of the chunk as one integer key (user id and bits of article id)
+        pairs.append(_unique_keys((users.astype(np.int64) << 32) | articles.view(np.uint32).astype(np.int64)))
+        
+        # interactions of users (user ids are dense) and articles of the chunk with their first rows
+        chunk_counts = np.bincount(users, minlength = len(user_counts))
+        chunk_counts[:len(user_counts)] += user_counts
+        user_counts = chunk_counts
+        unique_articles, first_rows, article_counts = np.unique(articles, return_index = True, return_counts = True)
+        chunk_articles.append((unique_articles, first_rows + n_rows, article_counts))
+        n_rows += len(chunk)
+    
+    df = pd.DataFrame({'article_id': np.concatenate(article_ids),
+                       'title': union_categoricals(titles),
+                       'user_id': np.concatenate(user_ids)})
+    
+    # build the user-item matrix once from unique pairs of all chunks
+    pairs = _unique_keys(np.concatenate(pairs))
+    user_item = UserItemMatrix.from_interactions((pairs >> 32).astype(np.int32),
+                                                 (pairs & 0xFFFFFFFF).astype(np.uint32).view(np.float32))
+    
+    # combine counts and first rows of articles of the chunks (chunks are in order, the first row wins)
+    articles, first_rows, article_counts = (np.concatenate(values) for values in zip(*chunk_articles))
+    cols = user_item.article_indexes(articles)
+    article_counts = np.bincount(cols, weights = article_counts, minlength = user_item.shape[1]).astype(np.int64)
+    counts = InteractionCounts(user_item.article_ids, article_counts, user_item.user_ids, user_counts[user_item.user_ids])
+    first = np.full(user_item.shape[1], n_rows, dtype = np.int64)
+    np.minimum.at(first, cols, first_rows)
+    article_titles = ArticleTitles(user_item.article_ids, df['title'].cat.codes.values[first].astype(np.int32),
+                                   df['title'].cat.categories.values)
+    
+    return df, user_item, email_encoder, counts, article_titles
+
+@timed('helpers.append_interactions')
+def append_interactions(log, user_item, email_encoder, records):
+    '''
+    Appends new interactions to the log of interactions and to the user-item matrix
+    (both in place), emails of new users get new user ids.
     
-    for val in df['email']:
-        if val not in coded_dict:
-            coded_dict[val] = cter
-            cter+=1
+    INPUT:
+        log - (InteractionLog) log of interactions
+        user_item - (UserItemMatrix) sparse matrix of users by articles
+        email_encoder - (EmailEncoder) mapping of emails to user ids
+        records - pandas dataframe or list of dicts with article_id, title, email of new interactions
         
-        email_encoded.append(coded_dict[val])
-    return email_encoded
+    OUTPUT:
+        user_ids - array of user ids of the new interactions
+        user_map, article_map, rows, cols - arrays returned by UserItemMatrix.add_interactions
+    '''
+    records = pd.DataFrame(records)
+    
+    # nothing to append, indexes of users and articles don't change
+    if len(records) == 0:
+        n_users, n_articles = user_item.shape
+        empty = np.zeros(0, dtype = np.int64)
+        return np.zeros(0, dtype = np.int32), np.arange(n_users), np.arange(n_articles), empty, empty
+    
+    user_ids = email_encoder.encode(records['email'].values)
+    article_ids = records['article_id'].values.astype(np.float32)
+    
+    # append rows to the log (amortized, buffers of the log grow geometrically), missing titles stay missing
+    log.append(article_ids, records['title'].values, user_ids)
+    
+    # add interactions to the user-item matrix
+    user_map, article_map, rows, cols = user_item.add_interactions(user_ids, article_ids)
+    
+    return user_ids, user_map, article_map, rows, cols
+
+def store_interactions(log, user_item, email_encoder, counts, article_titles, records):
+    '''
+    Adds new interactions to the store of a fitted recommender (shared by the engines
+    of the hybrid recommender): appends them to the log and to the user-item matrix
+    and updates counts, ranking and titles of articles in place.
+    
+    INPUT:
+        log - (InteractionLog) log of interactions
+        user_item - (UserItemMatrix) sparse matrix of users by articles
+        email_encoder - (EmailEncoder) mapping of emails to user ids
+        counts - (InteractionCounts) interaction counts aligned with user_item
+        article_titles - (ArticleTitles) titles of articles aligned with user_item
+        records - pandas dataframe or list of dicts with article_id, title, email of new interactions
+        
+    OUTPUT:
+        user_map, article_map, rows, cols - arrays returned by UserItemMatrix.add_interactions
+        ranking_changed - (bool) True if articles were added or their popularity ranking changed,
+        so recommendations of any user (including unknown users) can change
+    '''
+    n_rows = len(log)
+    ranking = counts.ranking
+    
+    # append interactions to the log and user-article matrix, new emails get new user ids
+    user_ids, user_map, article_map, rows, cols = append_interactions(log, user_item, email_encoder, records)
+    if len(rows) == 0:
+        return user_map, article_map, rows, cols, False
+    
+    # update counts and ranking of articles
+    counts.add_interactions(user_item, user_map, article_map, rows, cols)
+    
+    # align titles with columns of user-article matrix, new articles get titles of the new interactions
+    df = log.frame
+    article_titles.add_interactions(user_item, article_map, df['article_id'].values[n_rows:], df['title'].values[n_rows:])
+    
+    # popularity of articles depends only on their ranking, ranking of the same articles is compared
+    ranking_changed = len(article_map) != user_item.shape[1] or not np.array_equal(ranking, counts.ranking)
+    
+    return user_map, article_map, rows, cols, ranking_changed
+
+def interactions_to_arrays(df):
+    '''
+    INPUT:
+        df - pandas dataframe with article_id, title (categorical), user_id columns
+        
+    OUTPUT:
+        arrays - (dict) numpy arrays to save the log of interactions
+    '''
+    title = pd.Categorical(df['title'])
+    
+    return {'article_id': df['article_id'].values, 'user_id': df['user_id'].values,
+            'title_codes': title.codes, 'title_categories': np.asarray(title.categories, dtype = str)}
+
+def interactions_from_arrays(arrays):
+    '''
+    INPUT:
+        arrays - (dict) numpy arrays produced by interactions_to_arrays (can be memory-mapped)
+        
+    OUTPUT:
+        df - pandas dataframe with article_id, title (categorical), user_id columns,
+        numeric columns share memory with arrays
+    '''
+    title = pd.Categorical.from_codes(arrays['title_codes'], categories = arrays['title_categories'])
+    
+    return pd.DataFrame({'article_id': arrays['article_id'], 'title': title, 'user_id': arrays['user_id']}, copy = False)
 
-def get_top_articles(n, df):
+def get_top_articles(n, df, counts = None, article_titles = None):
     '''
     Function returns names of most popular articles (articles which have
     the largest number of interactions with users)
@@ -42,26 +227,24 @@ def get_top_articles(n, df):
     INPUT:
     n - (int) the number of top articles to return
     df - (pandas dataframe) df which contains user interactions with articles
+    counts - (InteractionCounts) optional precomputed interaction counts, if provided
+             popularity ranking is taken from it instead of grouping df
+    article_titles - (ArticleTitles) optional precomputed titles
     
     OUTPUT:
     top_articles - (list) A list of the top 'n' article titles 
     
     '''
-    # Count number of iteractions for each article_id
-    article_user = df.groupby('article_id')['user_id'].count()
-    
-    # Sort articles by number of iteractions
-    article_user = article_user.sort_values(ascending = False)
-    
     # Get top-n article ids
-    top_n = article_user.iloc[:n].index
+    top_n = get_top_article_ids(n, df, counts)
     
-    # Get article titles for top-n article ids
-    top_articles = df[df['article_id'].isin(top_n)]['title'].unique()
+    # Get article titles for top-n article ids in the order of popularity
+    top_articles = get_article_names(top_n, df, article_titles)
     
     return top_articles # Return the top article titles from df (not df_content)
 
-def get_top_article_ids(n, df):
+@timed('helpers.get_top_article_ids')
+def get_top_article_ids(n, df, counts = None):
     '''
     Function returns ids of most popular articles (articles which have
     the largest number of interactions with users)
@@ -69,16 +252,22 @@ def get_top_article_ids(n, df):
     INPUT:
     n - (int) the number of top articles to return
     df - (pandas dataframe) df which contains user interactions with articles 
+    counts - (InteractionCounts) optional precomputed interaction counts, if provided
+             top articles are looked up in O(n)
     
     OUTPUT:
     top_articles - (list) A list of the top 'n' article titles 
     
     '''
+    # Take top-n article ids from precomputed ranking
+    if counts is not None:
+        return pd.Index(counts.top_article_ids(n)).astype(str)
+    
     # Count number of iteractions for each article_id
     article_user = df.groupby('article_id')['user_id'].count()
     
-    # Sort articles by number of iteractions
-    article_user = article_user.sort_values(ascending = False)
+    # Sort articles by number of iteractions, articles with equal number of interactions are ordered by id
+    article_user = article_user.sort_values(ascending = False, kind = 'stable')
     
     # Get top-n article ids
     top_articles = article_user.iloc[:n].index
@@ -86,38 +275,95 @@ def get_top_article_ids(n, df):
  
     return top_articles # Return the top article ids
 
+@timed('helpers.create_user_item_matrix')
 def create_user_item_matrix(df):
     '''
     INPUT:
     df - pandas dataframe with article_id, title, user_id columns
     
     OUTPUT:
-    user_item - user item matrix 
+    user_item - (UserItemMatrix) sparse user item matrix 
     
     Description:
-    Return a matrix with user ids as rows and article ids on the columns with 1 values where a user interacted with 
+    Return a sparse matrix with user ids as rows and article ids on the columns with 1 values where a user interacted with 
     an article and a 0 otherwise
     '''
-    # Copy df dataframe and create a dummy column
-    user_item = df.copy()
-    user_item['cnt'] = 1
+    # Create sparse matrix with users in rows and articles in columns, only interactions are stored
+    user_item = UserItemMatrix.from_interactions(df['user_id'].values, df['article_id'].values)
     
-    # Create matrix with users in rows and articles in columns, if user interacted with article - 1 where
-    # user row meets article column and NaN if user didn't interact with the article
-    user_item = user_item.groupby(['user_id', 'article_id'])['cnt'].max().unstack()
+    return user_item # return the user_item matrix 
 
-    # Turn NaN into 0 where there was no interaction between user and article
-    user_item = user_item.fillna(0)
+def create_test_and_train_user_item(df_train, df_test):
+    '''
+    INPUT:
+    df_train - training dataframe with article_id, user_id columns
+    df_test - test dataframe with article_id, user_id columns
     
-    return user_item # return the user_item matrix 
+    OUTPUT:
+    user_item_train - (UserItemMatrix) a user-item matrix of the training dataframe 
+                      (unique users for each row and unique articles for each column)
+    user_item_test - (UserItemMatrix) a user-item matrix of the testing dataframe 
+                    (unique users for each row and unique articles for each column)
+    test_idx - all of the test user ids
+    test_arts - all of the test article ids
+    
+    '''
+    # Create user_item matrices
+    user_item_train = create_user_item_matrix(df_train)
+    user_item_test = create_user_item_matrix(df_test)
+    
+    # Find ids of users from the test set
+    test_idx = user_item_test.user_ids
+    
+    # Find article ids from the test set
+    test_arts = user_item_test.article_ids
+    
+    return user_item_train, user_item_test, test_idx, test_arts
 
-def find_similar_users_similarity(user_id, user_item, df):
+def precision_recall_at_k(user_ids, recommendations, user_item_train, user_item_test):
+    '''
+    INPUT:
+    user_ids - (list) ids of evaluated users
+    recommendations - (list) lists of recommended article ids for each of the users
+    user_item_train - (UserItemMatrix) user-item matrix the recommender was fitted on
+    user_item_test - (UserItemMatrix) user-item matrix of held-out interactions
+    
+    OUTPUT:
+    precision - (float) precision@k averaged over users
+    recall - (float) recall@k averaged over users
+    n_users - (int) number of users with held-out articles they didn't see in the training data
+    
+    Description:
+    Relevant articles of a user are test articles the user didn't interact with in the training data,
+    users without relevant articles are skipped
+    '''
+    precisions = []
+    recalls = []
+    
+    for user_id, recs in zip(user_ids, recommendations):
+        relevant = set(user_item_test.user_articles(user_id).tolist()) - set(user_item_train.user_articles(user_id).tolist())
+        if len(relevant) == 0 or len(recs) == 0:
+            continue
+        
+        hits = len(relevant & set(np.asarray(recs, dtype = float).tolist()))
+        precisions.append(hits / len(recs))
+        recalls.append(hits / len(relevant))
+    
+    if len(precisions) == 0:
+        return 0.0, 0.0, 0
+    
+    return float(np.mean(precisions)), float(np.mean(recalls)), len(precisions)
+
+@timed('helpers.find_similar_users_similarity')
+def find_similar_users_similarity(user_id, user_item, df, neighbor_index = None):
     '''
     INPUT:
     user_id - (int) a user_id
-    user_item - (pandas dataframe) matrix of users by articles: 
+    user_item - (UserItemMatrix) sparse matrix of users by articles: 
                 1's when a user has interacted with an article, 0 otherwise
     df - pandas dataframe with article_id, title, user_id columns
+    neighbor_index - (NeighborIndex) optional precomputed top-K neighbor index,
+                if provided only top-K neighbors with positive similarity are looked up from the index
     
     OUTPUT:
     similar_users_df - (pandas dataframe) where the closest users (largest dot product users)
@@ -129,14 +375,19 @@ def find_similar_users_similarity(user_id, user_item, df):
     Returns an ordered
     
     '''
-    # if user_id is not in df then return empty list of similar users
-    if user_id not in df.user_id.unique().tolist():
+    # if user_id is not in df then return empty list of similar users (user_item contains all users of df)
+    if user_id not in user_item:
         return []
     
-    # compute similarity of each user to the provided user
-    user_articles = np.array(user_item)
-    dot_prod_users = user_articles.dot(np.transpose(user_articles))[user_id - 1]
-    similarity = pd.DataFrame({'neighbor_id':user_item.index,'similarity':dot_prod_users})
+    # look up precomputed neighbors, they are already sorted by similarity
+    if neighbor_index is not None:
+        neighbor_ids, similarities = neighbor_index.get_neighbors(user_item.user_index(user_id))
+        return pd.DataFrame({'neighbor_id':neighbor_ids,'similarity':similarities})
+    
+    # compute similarity of each user to the provided user (single sparse row against all users)
+    user_row = user_item.matrix[user_item.user_index(user_id)]
+    dot_prod_users = (user_item.matrix @ user_row.T).toarray().ravel()
+    similarity = pd.DataFrame({'neighbor_id':user_item.user_ids,'similarity':dot_prod_users})
 
     # sort by similarity
     similar_users_df = similarity.sort_values('similarity', ascending = False)
@@ -146,13 +397,15 @@ def find_similar_users_similarity(user_id, user_item, df):
        
     return similar_users_df # return a dataframe with user ids and similarity to the user with specified user_id
 
-def find_similar_users(user_id, user_item, df):
+@timed('helpers.find_similar_users')
+def find_similar_users(user_id, user_item, df, neighbor_index = None):
     '''
     INPUT:
     user_id - (int) a user_id
-    user_item - (pandas dataframe) matrix of users by articles: 
+    user_item - (UserItemMatrix) sparse matrix of users by articles: 
                 1's when a user has interacted with an article, 0 otherwise
     df - pandas dataframe with article_id, title, user_id columns
+    neighbor_index - (NeighborIndex) optional precomputed top-K neighbor index
     
     OUTPUT:
     similar_users - (list) an ordered list where the closest users (largest dot product users)
@@ -163,37 +416,45 @@ def find_similar_users(user_id, user_item, df):
     Returns an ordered
     
     '''
-    # if user_id is not in df then return empty list of similar users
-    if user_id not in df.user_id.unique().tolist():
+    # if user_id is not in df then return empty list of similar users (user_item contains all users of df)
+    if user_id not in user_item:
         return []
    
     # obtain dataframe of users sorted by similarity and their
-    most_similar_users = find_similar_users_similarity(user_id, user_item, df)['neighbor_id'].values
+    most_similar_users = find_similar_users_similarity(user_id, user_item, df, neighbor_index)['neighbor_id'].values
        
     return most_similar_users # return a list of the users in order from most to least similar
 
-def get_article_names(article_ids, df):
+@timed('helpers.get_article_names')
+def get_article_names(article_ids, df, article_titles = None):
     '''
     INPUT:
-    article_ids - (list) a list of article ids
+    article_ids - (list) a list of article ids (numbers or strings like '1430.0')
     df - pandas dataframe with article_id, title, user_id columns
+    article_titles - (ArticleTitles) optional precomputed titles, if provided
+                     names are looked up in O(k) without scanning df
     
     OUTPUT:
     article_names - (list) a list of article names associated with the list of article ids 
-                    (this is identified by the title column)
+                    in the same order (this is identified by the title column)
     '''
-    article_names = df[df['article_id'].isin(article_ids)]['title'].unique()
+    if article_titles is not None:
+        return article_titles.get_names(article_ids)
+    
+    # ids are compared as numbers, titles are taken in the order of article_ids
+    article_names = get_article_titles(df).reindex(np.asarray(article_ids, dtype = float)).tolist()
     
     return article_names # Return the article names associated with list of article ids
 
 
-def get_user_articles(user_id, user_item, df):
+def get_user_articles(user_id, user_item, df, article_titles = None):
     '''
     INPUT:
     user_id - (int) a user id
-    user_item - (pandas dataframe) matrix of users by articles: 
+    user_item - (UserItemMatrix) sparse matrix of users by articles: 
                 1's when a user has interacted with an article, 0 otherwise
     df - pandas dataframe with article_id, title, user_id columns
+    article_titles - (ArticleTitles) optional precomputed titles
     
     OUTPUT:
     article_ids - (list) a list of the article ids seen by the user
@@ -203,48 +464,69 @@ def get_user_articles(user_id, user_item, df):
     Description:
     Provides a list of the article_ids and article titles that have been seen by a user
     '''
-    # find article_ids user interacted with
-    article_ids = user_item.loc[user_id][user_item.loc[user_id] == 1].index.astype(str).tolist()
+    # find column indexes of articles user interacted with
+    user_idx = user_item.user_index(user_id)
+    article_idx = user_item.user_article_indexes(user_idx) if user_idx >= 0 else np.zeros(0, dtype = np.int32)
+    article_ids = user_item.article_labels[article_idx].tolist()
     
-    #find article names for articles user interacted with
-    article_names = get_article_names(article_ids, df)
+    #find article names for articles user interacted with (titles are aligned with columns, so no id lookup is needed)
+    if article_titles is not None:
+        article_names = article_titles.names(article_idx)
+    else:
+        article_names = get_article_names(article_ids, df)
     
     return article_ids, article_names # return the ids and names
 
-def get_number_of_interactions(user_id, df):
+def get_number_of_interactions(user_id, df, counts = None):
     '''
     INPUT:
     user_id - (int)
     df - pandas dataframe with article_id, title, user_id columns
+    counts - (InteractionCounts) optional precomputed interaction counts
     
     OUTPUT:
     Number of iteractions of the user with given user_id
     '''
+    if counts is not None:
+        return counts.get_user_counts([user_id])[0]
+    
     return df[df['user_id'] == user_id]['user_id'].count()
 
-def get_number_of_interactions_for_articles(article_ids, df):
+def get_number_of_interactions_for_articles(article_ids, df, counts = None):
     '''
     INPUT:
-    user_id - (int)
+    article_ids - (list) a list of article ids
     df - pandas dataframe with article_id, title, user_id columns
+    counts - (InteractionCounts) optional precomputed interaction counts, if provided
+             counts are looked up in O(k) for k article ids
     
     OUTPUT:
     Dataframe with article_id and number of iteractions for each article
     '''
+    if counts is not None:
+        article_ids = np.unique(np.asarray(article_ids, dtype = float))
+        num_interactions = counts.get_article_counts(article_ids)
+        article_interactions = pd.DataFrame({'article_id': article_ids, 'num_interactions': num_interactions})
+        
+        return article_interactions[article_interactions['num_interactions'] > 0]
+    
     df_articles = df.groupby(['article_id']).count().reset_index()
     
-    article_interactions = df_articles[df_articles['article_id'].isin(article_ids)]
+    article_interactions = df_articles[df_articles['article_id'].isin(np.asarray(article_ids, dtype = float))]
     article_interactions = article_interactions[['article_id', 'title']].rename(index=str, columns={"title": "num_interactions"})
 
     return article_interactions
 
-def get_top_sorted_users(user_id, df, user_item):
+@timed('helpers.get_top_sorted_users')
+def get_top_sorted_users(user_id, df, user_item, neighbor_index = None, counts = None):
     '''
     INPUT:
     user_id - (int)
     df - pandas dataframe with article_id, title, user_id columns
-    user_item - (pandas dataframe) matrix of users by articles: 
+    user_item - (UserItemMatrix) sparse matrix of users by articles: 
             1's when a user has interacted with an article, 0 otherwise
+    neighbor_index - (NeighborIndex) optional precomputed top-K neighbor index
+    counts - (InteractionCounts) optional precomputed interaction counts
     
             
     OUTPUT:
@@ -258,12 +540,79 @@ def get_top_sorted_users(user_id, df, user_item):
      
     '''
     # Get dataframe with similar users ids and their similarity sorted by similarity
-    neighbors_df = find_similar_users_similarity(user_id, user_item, df)
+    neighbors_df = find_similar_users_similarity(user_id, user_item, df, neighbor_index)
     
     # Add column with number of interactions in descending order
-    neighbors_df['num_interactions'] = neighbors_df.apply(lambda row: get_number_of_interactions(row['neighbor_id'], df),axis=1)
+    if counts is not None:
+        neighbors_df['num_interactions'] = counts.get_user_counts(neighbors_df['neighbor_id'].values)
+    else:
+        neighbors_df['num_interactions'] = neighbors_df['neighbor_id'].map(lambda neighbor_id: get_number_of_interactions(neighbor_id, df))
     
     # Sort by similarity then by number of interactions in descending order
     neighbors_df = neighbors_df.sort_values(['similarity', 'num_interactions'], ascending=[False, False])
     
-    return neighbors_df # Return the dataframe specified in the doc_string
\ No newline at end of file
+    return neighbors_df # Return the dataframe specified in the doc_string
+
+@timed('helpers.select_top_articles')
+def select_top_articles(scores, seen, popularity, n):
+    '''
+    Selects top-n articles for a block of users.
+    
+    INPUT:
+    scores - (b x m array) scores of candidate articles for each user, 0 if article is not a candidate
+    seen - (b x m sparse matrix) articles the users already interacted with
+    popularity - (array) popularity score of each article in (0, 1] (InteractionCounts.popularity)
+    n - (int) number of articles to select for each user
+    
+    OUTPUT:
+    top_articles - (list) arrays of column indexes of selected articles for each user:
+                   candidates ordered by score (and popularity for equal scores), then other articles ordered by popularity,
+                   articles already seen by the user are never selected
+    '''
+    # mask articles already seen by the users
+    seen = seen.tocoo()
+    unseen = np.ones(scores.shape, dtype = bool)
+    unseen[seen.row, seen.col] = False
+    is_candidate = (scores > 0) & unseen
+    
+    n = min(n, scores.shape[1])
+    if n == 0:
+        return [np.zeros(0, dtype = np.int64) for _ in range(scores.shape[0])]
+    
+    # candidates are ranked by two exact keys (score, then popularity), so equal scores
+    # are never mixed with popularity in one floating point key:
+    # the n-th largest score is the threshold, candidates above it are selected,
+    # candidates equal to it compete for the remaining places by popularity
+    candidate_scores = np.where(is_candidate, scores, -np.inf)
+    threshold = -np.partition(-candidate_scores, n - 1, axis = 1)[:, n - 1:n]
+    key = np.where(candidate_scores > threshold, 2.0,
+                   np.where(is_candidate & (candidate_scores == threshold), popularity, -np.inf))
+    top = np.argpartition(-key, n - 1, axis = 1)[:, :n]
+    
+    # sort only selected candidates by score, equal scores by popularity (and by column)
+    top_scores = np.take_along_axis(candidate_scores, top, axis = 1)
+    order = np.lexsort((top, -popularity[top], -top_scores), axis = 1)
+    top = np.take_along_axis(top, order, axis = 1)
+    top_scores = np.take_along_axis(top_scores, order, axis = 1)
+    
+    # other unseen articles fill the rest of recommendations in the order of popularity
+    backfill_key = np.where(unseen & ~is_candidate, popularity, -np.inf)
+    backfill = np.argpartition(-backfill_key, n - 1, axis = 1)[:, :n]
+    backfill_key = np.take_along_axis(backfill_key, backfill, axis = 1)
+    order = np.lexsort((backfill, -backfill_key), axis = 1)
+    backfill = np.take_along_axis(backfill, order, axis = 1)
+    backfill_key = np.take_along_axis(backfill_key, order, axis = 1)
+    
+    return [np.concatenate([row[np.isfinite(row_scores)], backfill_row[np.isfinite(backfill_row_key)]])[:n]
+            for row, row_scores, backfill_row, backfill_row_key in zip(top, top_scores, backfill, backfill_key)]
+
+@timed('helpers.get_article_titles')
+def get_article_titles(df):
+    '''
+    INPUT:
+    df - pandas dataframe with article_id, title, user_id columns
+    
+    OUTPUT:
+    titles - pandas series with article titles indexed by article_id
+    '''
+    return df.drop_duplicates('article_id').set_index('article_id')['title']
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains bounded LRU/TTL cache of recommendation results and a wrapper,
+which puts the cache in front of make_recs and make_recs_batch of any recommender.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+# cache key used for all users without interactions (they get the same cold-start recommendations)
+COLD_START = '__cold_start__'
+
+class RecommendationCache():
+    '''
+    Bounded cache with least recently used eviction and optional time to live.
+    Keys are tuples (model_version, method, user_key, rec_num), so entries of
+    one user can be invalidated without touching other users. Entries are also
+    indexed by the articles they contain, so entries with given articles can be
+    invalidated (e.g. articles which moved in the popularity ranking).
+    '''
+
+    def __init__(self, max_size = 10000, ttl = None, clock = time.monotonic):
+        '''
+        INPUT:
+            max_size - (int) maximum number of cached results
+            ttl - (float) time to live of cached results in seconds, None for no expiration
+            clock - function returning current time in seconds
+        '''
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+
+        self._entries = OrderedDict()
+        self._user_keys = dict()
+        self._article_keys = dict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _unindex(index, index_key, key):
+        keys = index.get(index_key)
+        if keys is not None:
+            keys.discard(key)
+            if len(keys) == 0:
+                del index[index_key]
+
+    def _remove(self, key):
+        expires, value, articles = self._entries.pop(key)
+
+        self._unindex(self._user_keys, key[2], key)
+        for article in articles:
+            self._unindex(self._article_keys, article, key)
+
+    def get(self, key):
+        '''
+        INPUT:
+            key - cache key
+
+        OUTPUT:
+            value - cached value, None if key is not cached or expired
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires, value, articles = entry
+            if expires is not None and expires <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def put(self, key, value, articles = ()):
+        '''
+        Caches value, evicts the least recently used entries if the cache is full.
+
+        INPUT:
+            key - cache key
+            value - value to cache
+            articles - ids of articles contained in value
+        '''
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        articles = frozenset(articles)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires, value, articles)
+            self._user_keys.setdefault(key[2], set()).add(key)
+            for article in articles:
+                self._article_keys.setdefault(article, set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_users(self, user_keys):
+        '''
+        Removes cached results of provided users.
+
+        INPUT:
+            user_keys - list of user ids (COLD_START for the cold-start results)
+
+        OUTPUT:
+            removed - (int) number of removed entries
+        '''
+        removed = 0
+        with self._lock:
+            for user_key in user_keys:
+                for key in list(self._user_keys.get(user_key, ())):
+                    self._remove(key)
+                    removed += 1
+            self.invalidations += removed
+
+        return removed
+
+    def invalidate_articles(self, articles):
+        '''
+        Removes cached results which contain any of provided articles.
+
+        INPUT:
+            articles - list of article ids
+
+        OUTPUT:
+            removed - (int) number of removed entries
+        '''
+        removed = 0
+        with self._lock:
+            for article in articles:
+                for key in list(self._article_keys.get(article, ())):
+                    self._remove(key)
+                    removed += 1
+            self.invalidations += removed
+
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+            self._article_keys.clear()
+
+    def stats(self):
+        '''
+        OUTPUT:
+            stats - (dict) size, hits, misses, hit_rate, evictions, expirations and invalidations
+        '''
+        with self._lock:
+            requests = self.hits + self.misses
+            return {'size': len(self._entries), 'max_size': self.max_size, 'hits': self.hits,
+                    'misses': self.misses, 'hit_rate': self.hits / requests if requests > 0 else 0.0,
+                    'evictions': self.evictions, 'expirations': self.expirations,
+                    'invalidations': self.invalidations}
+
+class CachedRecommender():
+    '''
+    Wrapper which serves recommendations of a fitted recommender from
+    RecommendationCache. All users without interactions share one cold-start
+    entry. Results are keyed by model_version of the recommender, so results
+    of a previous fit are never served after refit or load. After new interactions
+    only results of the affected users and results with articles which moved in the
+    popularity ranking are invalidated.
+
+    Cached results are shared between callers and must not be modified.
+    '''
+
+    def __init__(self, recommender, max_size = 10000, ttl = None, cache = None):
+        '''
+        INPUT:
+            recommender - fitted recommender (CollaborativeRecommender, ContentBasedRecommender
+            or MatrixFactorizationRecommender)
+            max_size - (int) maximum number of cached results
+            ttl - (float) time to live of cached results in seconds, None for no expiration
+            cache - (RecommendationCache) optional cache instance (max_size and ttl are ignored)
+        '''
+        self.recommender = recommender
+        self.cache = cache if cache is not None else RecommendationCache(max_size, ttl)
+
+    def __getattr__(self, name):
+        # other attributes and methods are served by the wrapped recommender
+        return getattr(self.recommender, name)
+
+    def _user_key(self, user_id):
+        return user_id if user_id in self.recommender.user_item else COLD_START
+
+    def make_recs(self, user_id, rec_num = 5):
+        '''
+        Makes recommendations for articles for provided user (same output as make_recs
+        of the recommender).
+        '''
+        key = (self.recommender.model_version, 'make_recs', self._user_key(user_id), rec_num)
+
+        result = self.cache.get(key)
+        if result is None:
+            result = self.recommender.make_recs(user_id, rec_num)
+            self.cache.put(key, result, result[0])
+
+        return result
+
+    def make_recs_batch(self, user_ids, rec_num = 5, block_size = 1024):
+        '''
+        Makes recommendations for articles for many users at once, only users
+        without cached results are passed to make_recs_batch of the recommender.
+        '''
+        version = self.recommender.model_version
+        keys = [(version, 'make_recs_batch', self._user_key(user_id), rec_num) for user_id in user_ids]
+
+        results = [self.cache.get(key) for key in keys]
+
+        # compute missed results with one batch call (each missed key once)
+        missed = dict()
+        for i, result in enumerate(results):
+            if result is None:
+                missed.setdefault(keys[i], user_ids[i])
+
+        if len(missed) > 0:
+            computed = self.recommender.make_recs_batch(list(missed.values()), rec_num, block_size)
+            computed = dict(zip(missed, computed))
+            for key, result in computed.items():
+                self.cache.put(key, result, result[0])
+            results = [computed[key] if result is None else result for key, result in zip(keys, results)]
+
+        return results
+
+    def add_interactions(self, records):
+        '''
+        Adds new interactions to the recommender (see add_interactions of the
+        recommender) and invalidates cached results of the affected users only.
+        Popularity orders candidates with equal scores and fills recommendations,
+        so results which contain articles which moved in the popularity ranking
+        are invalidated as well (other results keep the relative order of their
+        articles and of the articles below them). If the recommender replaced its
+        model_version, results of every user are stale and the cache is cleared.
+
+        OUTPUT:
+            user_ids - list of ids of users whose recommendations changed
+        '''
+        version = self.recommender.model_version
+        counts = self.recommender.counts
+        article_ids, rank = counts.article_ids, counts.rank
+        user_ids = self.recommender.add_interactions(records)
+
+        if self.recommender.model_version != version:
+            self.cache.clear()
+        else:
+            self.invalidate_users(user_ids)
+            moved = counts.moved_articles(article_ids, rank)
+            if len(moved) > 0:
+                self.cache.invalidate_articles(self.recommender.user_item.article_labels[moved].tolist())
+
+        return user_ids
+
+    def invalidate_users(self, user_ids):
+        '''
+        Removes cached results of provided users and cold-start results,
+        which depend on popularity of articles.
+
+        INPUT:
+            user_ids - list of ids of users with new interactions
+
+        OUTPUT:
+            removed - (int) number of removed entries
+        '''
+        return self.cache.invalidate_users(list(user_ids) + [COLD_START])
+
+    def stats(self):
+        return self.cache.stats()
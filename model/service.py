@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains asyncio based recommendation service: concurrent requests are
+collected into micro-batches within a small latency window, each micro-batch
+is scored with one make_recs_batch call in a thread or process pool and results
+are fanned out to the waiting requests. A minimal HTTP/1.1 endpoint (standard
+library only) serves the recommendations.
+
+Usage:
+    python -m model.service --model collaborative --interactions data/user-item-interactions.csv --port 8080
+    curl 'http://127.0.0.1:8080/recommendations?user_id=2&n=10'
+"""
+
+import json
+import time
+import asyncio
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from . import instrumentation
+
+# recommender of the current worker process of the process pool
+_worker_recommender = None
+
+def _load_worker(model_class, artifact_path):
+    global _worker_recommender
+    _worker_recommender = model_class.load(artifact_path)
+
+def _worker_make_recs_batch(user_ids, rec_num):
+    return _worker_recommender.make_recs_batch(user_ids, rec_num)
+
+def process_pool(model_class, artifact_path, workers = 2):
+    '''
+    Creates process pool, each worker loads the recommender from the artifact once
+    (memory-mapped, so workers share memory pages of the arrays).
+
+    INPUT:
+        model_class - class of the recommender (e.g. CollaborativeRecommender)
+        artifact_path - (str) path to the artifact created by save of the recommender
+        workers - (int) number of worker processes
+
+    OUTPUT:
+        executor - ProcessPoolExecutor
+        batch_fn - function to pass to MicroBatcher
+    '''
+    executor = ProcessPoolExecutor(workers, initializer = _load_worker, initargs = (model_class, artifact_path))
+
+    return executor, _worker_make_recs_batch
+
+class MicroBatcher():
+    '''
+    Collects concurrent requests into micro-batches. A batch is dispatched when
+    it has max_batch_size requests or max_wait seconds passed since its first
+    request. Batches are scored in executor, so new requests are collected while
+    previous batches are being scored.
+    '''
+
+    def __init__(self, batch_fn, max_batch_size = 64, max_wait = 0.005, executor = None):
+        '''
+        INPUT:
+            batch_fn - function (user_ids, rec_num) -> list of (recs, rec_names),
+            e.g. make_recs_batch of a fitted recommender
+            max_batch_size - (int) maximum number of requests in one batch
+            max_wait - (float) maximum time in seconds the first request of a batch waits for other requests
+            executor - executor to run batch_fn in, if None a single thread executor is
+            created by start and shut down by stop
+        '''
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = executor
+        self._owns_executor = executor is None
+
+        self._queue = None
+        self._collector = None
+        self._tasks = set()
+        self.batches = 0
+        self.requests = 0
+
+    async def start(self):
+        # already started batcher keeps its queue (e.g. RecommendationServer.start starts it again)
+        if self._collector is not None and not self._collector.done():
+            return
+
+        if self._owns_executor and self.executor is None:
+            self.executor = ThreadPoolExecutor(1)
+
+        self._queue = asyncio.Queue()
+        self._collector = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._collector is not None:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+            self._collector = None
+
+        # let dispatched batches finish, then shut down the executor created by start
+        if len(self._tasks) > 0:
+            await asyncio.gather(*self._tasks, return_exceptions = True)
+
+        if self._owns_executor and self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    async def recommend(self, user_id, rec_num = 5):
+        '''
+        INPUT:
+            user_id - id of the user to make recommendations for
+            rec_num - number of recommended articles
+
+        OUTPUT:
+            recs - list of recommended article_ids
+            rec_names - list of recommended article names
+        '''
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((user_id, rec_num, future))
+
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            # wait for the first request of the batch, then for more requests until batch is full or time is up
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # requests with different number of recommendations are scored separately
+            groups = dict()
+            for request in batch:
+                groups.setdefault(request[1], []).append(request)
+
+            for rec_num, requests in groups.items():
+                # keep references to running tasks, so they are not garbage collected
+                task = asyncio.create_task(self._score(requests, rec_num))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _score(self, requests, rec_num):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+
+        try:
+            results = await loop.run_in_executor(self.executor, self.batch_fn,
+                                                 [user_id for user_id, _, _ in requests], rec_num)
+        except Exception as e:
+            for _, _, future in requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        if instrumentation.registry.enabled:
+            instrumentation.registry.record('service.batch', time.perf_counter() - start)
+        self.batches += 1
+        self.requests += len(requests)
+
+        for (_, _, future), result in zip(requests, results):
+            if not future.done():
+                future.set_result(result)
+
+class RecommendationServer():
+    '''
+    Minimal HTTP/1.1 server (with keep-alive) on top of asyncio streams.
+
+    Endpoints:
+        GET /recommendations?user_id=<id>&n=<number> - JSON with article_ids and titles
+        GET /health - JSON with number of served requests and batches
+        GET /metrics - instrumentation metrics in Prometheus text format
+    '''
+
+    def __init__(self, batcher, host = '127.0.0.1', port = 8080, default_rec_num = 5, max_rec_num = 100):
+        '''
+        INPUT:
+            batcher - (MicroBatcher) batcher which scores the requests
+            host - (str) host to listen on
+            port - (int) port to listen on
+            default_rec_num - (int) number of recommendations if n is not provided
+            max_rec_num - (int) maximum allowed number of recommendations
+        '''
+        self.batcher = batcher
+        self.host = host
+        self.port = port
+        self.default_rec_num = default_rec_num
+        self.max_rec_num = max_rec_num
+        self._server = None
+
+    async def start(self):
+        await self.batcher.start()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                # read headers, requests have no body
+                keep_alive = True
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    if name.strip().lower() == 'connection' and value.strip().lower() == 'close':
+                        keep_alive = False
+
+                parts = request_line.decode('latin-1').split()
+                if len(parts) < 2:
+                    status, content_type, body = 400, 'application/json', {'error': 'bad request'}
+                else:
+                    status, content_type, body = await self._route(parts[0], parts[1])
+
+                payload = body.encode('utf-8') if isinstance(body, str) else json.dumps(body).encode('utf-8')
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+                    status, 'OK' if status == 200 else 'Error', content_type, len(payload),
+                    'keep-alive' if keep_alive else 'close').encode('latin-1') + payload)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, target):
+        '''
+        OUTPUT:
+            status - (int) HTTP status
+            content_type - (str) content type of the response
+            body - dict (sent as JSON) or str
+        '''
+        url = urlsplit(target)
+        if method != 'GET':
+            return 405, 'application/json', {'error': 'method not allowed'}
+
+        if url.path == '/health':
+            return 200, 'application/json', {'status': 'ok', 'requests': self.batcher.requests,
+                                             'batches': self.batcher.batches}
+
+        if url.path == '/metrics':
+            return 200, 'text/plain; version=0.0.4', instrumentation.registry.export(instrumentation.PrometheusExporter())
+
+        if url.path != '/recommendations':
+            return 404, 'application/json', {'error': 'not found'}
+
+        query = parse_qs(url.query)
+        try:
+            user_id = int(query['user_id'][0])
+            rec_num = int(query.get('n', [self.default_rec_num])[0])
+        except (KeyError, ValueError):
+            return 400, 'application/json', {'error': 'user_id and n must be integers'}
+        if not 0 < rec_num <= self.max_rec_num:
+            return 400, 'application/json', {'error': 'n must be between 1 and {}'.format(self.max_rec_num)}
+
+        try:
+            recs, rec_names = await self.batcher.recommend(user_id, rec_num)
+        except Exception as e:
+            return 500, 'application/json', {'error': repr(e)}
+
+        return 200, 'application/json', {'user_id': user_id, 'article_ids': list(recs), 'titles': list(rec_names)}
+
+def main():
+    from .collaborative_recommender import CollaborativeRecommender
+    from .content_based_recommender import ContentBasedRecommender
+    from .hybrid_recommender import HybridRecommender
+
+    models = {'collaborative': CollaborativeRecommender, 'content': ContentBasedRecommender, 'hybrid': HybridRecommender}
+
+    parser = argparse.ArgumentParser(description = 'Serve recommendations over HTTP with micro-batching')
+    parser.add_argument('--model', choices = sorted(models), default = 'collaborative', help = 'recommender to serve')
+    parser.add_argument('--artifact', help = 'path to artifact saved with save() of the recommender')
+    parser.add_argument('--interactions', help = 'path to user-item-interactions.csv (to fit the recommender)')
+    parser.add_argument('--articles', help = 'path to articles_community.csv (to fit content-based or hybrid recommender)')
+    parser.add_argument('--host', default = '127.0.0.1', help = 'host to listen on')
+    parser.add_argument('--port', type = int, default = 8080, help = 'port to listen on')
+    parser.add_argument('--max-batch-size', type = int, default = 64, help = 'maximum number of requests in a batch')
+    parser.add_argument('--max-wait-ms', type = float, default = 5.0, help = 'maximum wait for a batch to fill in milliseconds')
+    parser.add_argument('--workers', type = int, default = 1, help = 'number of scoring threads or processes')
+    parser.add_argument('--processes', action = 'store_true', help = 'score batches in worker processes (requires --artifact)')
+    parser.add_argument('--metrics', action = 'store_true', help = 'enable instrumentation (served at /metrics)')
+    args = parser.parse_args()
+
+    model_class = models[args.model]
+    if args.metrics:
+        instrumentation.enable()
+
+    if args.processes:
+        if args.artifact is None:
+            parser.error('--processes requires --artifact')
+        executor, batch_fn = process_pool(model_class, args.artifact, args.workers)
+    else:
+        if args.artifact is not None:
+            rec = model_class.load(args.artifact)
+        elif args.interactions is not None:
+            rec = model_class()
+            rec.fit(args.interactions, *([args.articles] if args.model in ('content', 'hybrid') else []))
+        else:
+            parser.error('either --artifact or --interactions is required')
+        executor, batch_fn = ThreadPoolExecutor(args.workers), rec.make_recs_batch
+
+    batcher = MicroBatcher(batch_fn, args.max_batch_size, args.max_wait_ms / 1000, executor)
+    server = RecommendationServer(batcher, args.host, args.port)
+
+    print('Serving {} recommender on http://{}:{}'.format(args.model, args.host, args.port))
+    asyncio.run(server.serve_forever())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains functions and classes for building top-K similarity indexes
+with blocked sparse matrix products.
+"""
+
+import os
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy import sparse
+
+# matrices and tie breaker of the current worker process of the process pool
+_worker_state = None
+
+# memory budget of one tile of blocked_top_k in bytes, dense similarities, ranking key
+# and its argpartition take about 32 bytes per element of the tile
+TILE_MEMORY = 256 * 2 ** 20
+TILE_BYTES_PER_ELEMENT = 32
+
+def tile_rows(batch_size, n):
+    '''
+    INPUT:
+        batch_size - (int) requested number of rows in one tile
+        n - (int) number of rows the tile is compared with
+
+    OUTPUT:
+        rows - (int) batch_size reduced so one tile fits into TILE_MEMORY (at least 1)
+    '''
+    return max(min(batch_size, TILE_MEMORY // (TILE_BYTES_PER_ELEMENT * max(n, 1))), 1)
+
+def _top_k_tile(matrix, matrix_t, start, end, k, tie_breaker = None, tie_scale = None):
+    '''
+    Finds k most similar rows for rows start:end of the matrix (see blocked_top_k).
+
+    INPUT:
+        matrix - scipy sparse CSR matrix
+        matrix_t - transposed matrix in CSR format
+        start, end - (int) range of rows of the tile
+        k - (int) number of most similar rows to keep for each row, at least 1
+        tie_breaker - (float64 array) optional tie breaker, one value per row
+        tie_scale - (float) number larger than any value of tie_breaker
+
+    OUTPUT:
+        neighbors - (end - start x k int32 array) indexes of most similar rows, -1 for empty positions
+        similarities - (end - start x k float32 array) similarity for each of the neighbors
+    '''
+    n = matrix.shape[0]
+    rows = np.arange(start, end)
+
+    # similarity of the tile of rows to all rows
+    sims = (matrix[start:end] @ matrix_t).toarray().astype(np.float64)
+
+    # exclude each row from its own neighbors
+    sims[rows - start, rows] = -np.inf
+
+    # build ranking key, ties in similarity are resolved with tie_breaker and then by
+    # smaller row index (key stays an exact integer, so argpartition keeps the same rows as a full sort)
+    if tie_breaker is not None:
+        key = (sims * tie_scale + tie_breaker) * n + (n - 1 - np.arange(n))
+    else:
+        key = sims
+
+    # select top k and sort them by key in descending order
+    top = np.argpartition(-key, k - 1, axis = 1)[:, :k]
+    top_key = np.take_along_axis(key, top, axis = 1)
+    order = np.lexsort((top, -top_key), axis = 1)
+    top = np.take_along_axis(top, order, axis = 1)
+    top_sims = np.take_along_axis(sims, top, axis = 1)
+
+    # keep only neighbors with positive similarity
+    positive = top_sims > 0
+
+    return np.where(positive, top, -1).astype(np.int32), np.where(positive, top_sims, 0).astype(np.float32)
+
+def _share_arrays(arrays):
+    '''
+    Copies arrays to shared memory blocks.
+
+    INPUT:
+        arrays - (dict) numpy arrays
+
+    OUTPUT:
+        blocks - list of SharedMemory blocks (to close and unlink by the caller)
+        specs - (dict) name, shape and dtype of the block of each array (to pass to _attach_arrays)
+    '''
+    blocks, specs = [], dict()
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+        blocks.append(block)
+        np.ndarray(array.shape, array.dtype, buffer = block.buf)[...] = array
+        specs[name] = (block.name, array.shape, array.dtype.str)
+
+    return blocks, specs
+
+def _attach_arrays(specs):
+    '''
+    INPUT:
+        specs - (dict) specs of shared arrays created by _share_arrays
+
+    OUTPUT:
+        blocks - list of attached SharedMemory blocks (arrays are valid while they are open)
+        arrays - (dict) numpy arrays backed by the shared memory blocks (without copying)
+    '''
+    blocks, arrays = [], dict()
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name = block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype, buffer = block.buf)
+
+    return blocks, arrays
+
+def _init_worker(specs, shape, tie_scale):
+    global _worker_state
+    blocks, arrays = _attach_arrays(specs)
+
+    matrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape = shape, copy = False)
+    matrix_t = sparse.csr_matrix((arrays['t_data'], arrays['t_indices'], arrays['t_indptr']), shape = shape[::-1], copy = False)
+
+    _worker_state = (blocks, matrix, matrix_t, arrays.get('tie_breaker'), tie_scale)
+
+def _worker_top_k_tile(start, end, k):
+    _, matrix, matrix_t, tie_breaker, tie_scale = _worker_state
+    return _top_k_tile(matrix, matrix_t, start, end, k, tie_breaker, tie_scale)
+
+def blocked_top_k(matrix, k, batch_size = 1024, tie_breaker = None, n_jobs = 1):
+    '''
+    Finds k most similar rows for each row of the matrix. Similarity is computed as
+    a dot product of rows, which is cosine similarity for normalized rows.
+    Similarity is computed for a tile of batch_size rows at a time and reduced to
+    top k right away, so memory is bounded by batch_size x number of rows instead
+    of the full number of rows x number of rows matrix. A tile takes about 32 bytes
+    per element (e.g. 3.3 GB for 1024 x 100k users), so batch_size is reduced to keep
+    each tile within TILE_MEMORY (256 MB). With n_jobs > 1 tiles are computed by a
+    pool of worker processes, which read the matrix from shared memory, and each
+    worker holds its own tile (memory is bounded by n_jobs x TILE_MEMORY then).
+
+    INPUT:
+        matrix - scipy sparse CSR matrix (rows are vectors to compare)
+        k - (int) number of most similar rows to keep for each row
+        batch_size - (int) maximum number of rows in one tile (see tile_rows)
+        tie_breaker - (array) optional array of non-negative integers, one per row,
+        rows with equal similarity are ordered by larger tie_breaker value
+        (used only if similarities are integers, e.g. for binary rows)
+        n_jobs - (int) number of worker processes, 1 to compute all tiles in the current process,
+        None to use all available cores (the result doesn't depend on n_jobs)
+
+    OUTPUT:
+        neighbors - (n x k int32 array) indexes of most similar rows sorted by similarity,
+        row itself is excluded, positions without neighbors (similarity is 0) are filled with -1
+        similarities - (n x k float32 array) similarity for each of the neighbors
+    '''
+    n = matrix.shape[0]
+    k = max(min(k, n - 1), 0)
+
+    neighbors = np.full((n, k), -1, dtype = np.int32)
+    similarities = np.zeros((n, k), dtype = np.float32)
+
+    if k == 0:
+        return neighbors, similarities
+
+    tie_scale = None
+    if tie_breaker is not None:
+        tie_breaker = np.asarray(tie_breaker, dtype = np.float64)
+        tie_scale = tie_breaker.max() + 1
+
+    # transpose once, so tile products don't convert it again
+    matrix = sparse.csr_matrix(matrix)
+    matrix_t = matrix.T.tocsr()
+
+    batch_size = tile_rows(batch_size, n)
+    starts = list(range(0, n, batch_size))
+    ends = [min(start + batch_size, n) for start in starts]
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+
+    if n_jobs == 1 or len(starts) <= 1:
+        for start, end in zip(starts, ends):
+            neighbors[start:end], similarities[start:end] = _top_k_tile(matrix, matrix_t, start, end, k, tie_breaker, tie_scale)
+
+        return neighbors, similarities
+
+    # share matrices with worker processes instead of pickling them for each worker
+    arrays = {'data': matrix.data, 'indices': matrix.indices, 'indptr': matrix.indptr,
+              't_data': matrix_t.data, 't_indices': matrix_t.indices, 't_indptr': matrix_t.indptr}
+    if tie_breaker is not None:
+        arrays['tie_breaker'] = tie_breaker
+    blocks, specs = _share_arrays(arrays)
+
+    try:
+        with ProcessPoolExecutor(max_workers = min(n_jobs, len(starts)), initializer = _init_worker,
+                                 initargs = (specs, matrix.shape, tie_scale)) as executor:
+            tiles = executor.map(_worker_top_k_tile, starts, ends, [k] * len(starts))
+            for start, end, (tile_neighbors, tile_similarities) in zip(starts, ends, tiles):
+                neighbors[start:end], similarities[start:end] = tile_neighbors, tile_similarities
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return neighbors, similarities
+
+def _top_k_candidates(candidates, sims, tie_breaker, tie_scale, k):
+    '''
+    Selects k candidates with the largest positive similarity, candidates with
+    equal similarity are ordered by larger tie_breaker value, then by smaller index
+    (same order as blocked_top_k).
+
+    INPUT:
+        candidates - array of row indexes of candidates
+        sims - array of similarity to each of the candidates
+        tie_breaker - array of non-negative integers, one per row
+        tie_scale - (float) number larger than any value of tie_breaker
+        k - (int) number of candidates to select
+
+    OUTPUT:
+        neighbors - (k int32 array) selected candidates, -1 for empty positions
+        similarities - (k float32 array) similarity to each of the selected candidates
+    '''
+    positive = sims > 0
+    candidates, sims = candidates[positive], sims[positive]
+
+    key = sims * tie_scale + tie_breaker[candidates]
+    order = np.lexsort((candidates, -key))[:k]
+
+    neighbors = np.full(k, -1, dtype = np.int32)
+    similarities = np.zeros(k, dtype = np.float32)
+    neighbors[:len(order)] = candidates[order]
+    similarities[:len(order)] = sims[order]
+
+    return neighbors, similarities
+
+def _top_k_rows(candidates, sims, tie_breaker, tie_scale, k):
+    '''
+    Selects k candidates in each row in the same order as _top_k_candidates
+    for integer similarities (e.g. of binary user-article vectors).
+
+    INPUT:
+        candidates - (b x c array) row indexes of candidates, -1 for empty positions
+        sims - (b x c array) similarity to each of the candidates
+        tie_breaker - array of non-negative integers, one per row
+        tie_scale - (float) number larger than any value of tie_breaker
+        k - (int) number of candidates to select, at most c
+
+    OUTPUT:
+        neighbors - (b x k int32 array) selected candidates, -1 for empty positions
+        similarities - (b x k float32 array) similarity to each of the selected candidates
+    '''
+    n = len(tie_breaker)
+    valid = (candidates >= 0) & (sims > 0)
+
+    # exact integer key: similarity, then tie_breaker, then smaller index
+    key = (sims * tie_scale + tie_breaker[np.maximum(candidates, 0)]) * n + (n - 1 - candidates)
+    key[~valid] = -np.inf
+
+    # candidates are mostly runs in sorted order (previous neighbor lists), which a stable sort merges in linear time
+    top = np.argsort(-key, axis = 1, kind = 'stable')[:, :k]
+    selected = np.take_along_axis(valid, top, axis = 1)
+
+    neighbors = np.where(selected, np.take_along_axis(candidates, top, axis = 1), -1).astype(np.int32)
+    similarities = np.where(selected, np.take_along_axis(sims, top, axis = 1), 0).astype(np.float32)
+
+    return neighbors, similarities
+
+class NeighborIndex():
+    '''
+    Persistent top-K nearest neighbor index for users. For each user
+    stores ids of k most similar users and their similarity (dot product of
+    user-article vectors), so neighbors are looked up in O(k).
+    '''
+
+    def __init__(self, neighbors, similarities, user_ids):
+        '''
+        INPUT:
+            neighbors - (n x k array) row indexes of neighbors, -1 for empty positions
+            similarities - (n x k array) similarity to each of the neighbors
+            user_ids - array of user ids corresponding to rows
+        '''
+        self.neighbors = neighbors
+        self.similarities = similarities
+        self.user_ids = user_ids
+
+        # arrays with spare rows for appended users, allocated on the first update
+        self._buffers = None
+
+    @classmethod
+    def build(cls, user_item, k = 100, batch_size = 1024, num_interactions = None, ann_index = None, n_jobs = 1):
+        '''
+        Builds neighbor index for all users of the user-item matrix.
+
+        INPUT:
+            user_item - (UserItemMatrix) sparse matrix of users by articles
+            k - (int) number of neighbors to keep for each user
+            batch_size - (int) number of users to process in one block
+            num_interactions - (array) optional number of interactions of each user (aligned
+            with user_item rows), used to order neighbors with equal similarity
+            ann_index - optional not fitted approximate nearest neighbor index (see ann_index.py),
+            if provided neighbors are found with it instead of exact search
+            n_jobs - (int) number of worker processes computing blocks of similarities,
+            None to use all available cores
+
+        OUTPUT:
+            neighbor_index - NeighborIndex instance
+        '''
+        if ann_index is not None:
+            neighbors, similarities = ann_index.fit(user_item.matrix).all_neighbors(k, num_interactions)
+        else:
+            neighbors, similarities = blocked_top_k(user_item.matrix, k, batch_size, num_interactions, n_jobs)
+
+        return cls(neighbors, similarities, user_item.user_ids)
+
+    def _resize(self, n, user_map):
+        '''
+        Returns writable neighbors and similarities arrays with n rows, rows of
+        existing users are moved to new row indexes given by user_map and rows of
+        new users are empty. If no existing user moves, rows are kept in place and
+        arrays are reallocated only when they run out of spare rows (capacity grows
+        by a quarter), so appending users costs O(k) per user amortized.
+        '''
+        n_old, k = self.neighbors.shape
+        moved = n_old > 0 and user_map[-1] != n_old - 1
+
+        buffers = self._buffers
+        in_buffers = buffers is not None and self.neighbors.base is buffers[0]
+
+        if not moved and in_buffers and n <= len(buffers[0]):
+            neighbors, similarities = buffers[0][:n], buffers[1][:n]
+        else:
+            # arrays passed to the index (e.g. memory-mapped) are copied on the first update
+            capacity = n if moved else max(n, n_old + n_old // 4)
+            buffers = (np.full((capacity, k), -1, dtype = np.int32), np.zeros((capacity, k), dtype = np.float32))
+            neighbors, similarities = buffers[0][:n], buffers[1][:n]
+            if moved:
+                neighbors[user_map] = np.where(self.neighbors >= 0, user_map[np.maximum(self.neighbors, 0)], -1)
+                similarities[user_map] = self.similarities
+                self._buffers = buffers
+                return neighbors, similarities
+
+            neighbors[:n_old] = self.neighbors
+            similarities[:n_old] = self.similarities
+            self._buffers = buffers
+
+        # appended users start with empty lists
+        neighbors[n_old:] = -1
+        similarities[n_old:] = 0
+
+        return neighbors, similarities
+
+    def update(self, user_item, user_map, user_idx, num_interactions, batch_size = 1024):
+        '''
+        Updates the index in place after interactions of users user_idx were added to
+        user_item with UserItemMatrix.add_interactions. Lists of these users are
+        recomputed and these users are merged into lists of other users they became
+        more similar to. Similarities only grow when interactions are added, so
+        only lists which contain the users or can admit them are touched. Lists
+        are recomputed with exact search, so an index built with exact search stays
+        the same as the index built from scratch. An index built with an approximate
+        index (ann_index) stays approximate for lists which are not touched.
+        Cost depends on the users sharing articles with the users of the new
+        interactions, not on the total number of users.
+
+        INPUT:
+            user_item - (UserItemMatrix) updated sparse matrix of users by articles
+            user_map - array mapping previous row indexes to new row indexes
+            user_idx - array of row indexes of users with new interactions
+            num_interactions - (array) updated number of interactions of each user,
+            used to order neighbors with equal similarity
+            batch_size - (int) number of users with new interactions processed at once
+
+        OUTPUT:
+            changed - sorted array of row indexes of users whose neighbor lists changed
+            or contain users with new interactions (always includes user_idx)
+        '''
+        n = user_item.shape[0]
+        k = self.neighbors.shape[1]
+        tie_breaker = np.asarray(num_interactions, dtype = np.float64)
+        tie_scale = tie_breaker.max() + 1 if len(tie_breaker) > 0 else 1
+
+        # move lists of existing users and their neighbors to new row indexes
+        neighbors, similarities = self._resize(n, user_map)
+
+        user_idx = np.unique(user_idx)
+        affected = np.zeros(n, dtype = bool)
+        affected[user_idx] = True
+        changed = set(user_idx.tolist())
+
+        # users of each article, so similarity is computed only with users sharing articles
+        article_users = user_item.csc.T
+
+        for start in range(0, len(user_idx) if k > 0 else 0, batch_size):
+            rows = user_idx[start:start + batch_size]
+            sims = (user_item.matrix[rows] @ article_users).tocsr()
+
+            # recompute lists of users with new interactions
+            for i, row in enumerate(rows.tolist()):
+                candidates = sims.indices[sims.indptr[i]:sims.indptr[i + 1]]
+                row_sims = sims.data[sims.indptr[i]:sims.indptr[i + 1]].astype(np.float64)
+                not_self = candidates != row
+                neighbors[row], similarities[row] = _top_k_candidates(candidates[not_self], row_sims[not_self],
+                                                                      tie_breaker, tie_scale, k)
+
+            # pairs of users with new interactions and other users sharing articles with them
+            sims = sims.tocoo()
+            pair_rows, others, pair_sims = rows[sims.row], sims.col, sims.data.astype(np.float64)
+            keep = ~affected[others]
+            pair_rows, others, pair_sims = pair_rows[keep], others[keep], pair_sims[keep]
+
+            # users with a user of the batch among their neighbors (only users sharing articles can have it)
+            listed = neighbors[others] == pair_rows[:, None]
+            member = listed.any(axis = 1)
+            changed.update(others[member].tolist())
+
+            # a listed user can only move up (its similarity and number of interactions grow), if it
+            # is the only user of the batch in the list and stays below the previous neighbor, the list
+            # keeps its order and only the similarity is updated in place
+            pair_keys = (pair_sims * tie_scale + tie_breaker[pair_rows]) * n + (n - 1 - pair_rows)
+            position = listed.argmax(axis = 1)
+            above = np.where(position > 0, neighbors[others, position - 1], -1)
+            above_keys = (similarities[others, position - 1] * tie_scale + tie_breaker[np.maximum(above, 0)]) * n + (n - 1 - above)
+            single = np.bincount(others, minlength = n)[others] == 1
+            stays = member & single & ((above < 0) | (pair_keys < above_keys))
+            similarities[others[stays], position[stays]] = pair_sims[stays]
+
+            pair_rows, others, pair_sims, member = pair_rows[~stays], others[~stays], pair_sims[~stays], member[~stays]
+
+            # list of other user changes if it contains the user or the user ranks above its last neighbor,
+            # if the last neighbor has new interactions its number of interactions is ignored, because
+            # lists keep the order of previous numbers of interactions until the neighbor is processed
+            last = neighbors[others, -1]
+            last_tie_breaker = np.where(affected[np.maximum(last, 0)], 0, tie_breaker[np.maximum(last, 0)])
+            threshold = np.where(last >= 0, similarities[others, -1] * tie_scale + last_tie_breaker, 0)
+            targets = np.unique(others[member | (pair_sims * tie_scale + tie_breaker[pair_rows] >= threshold)])
+
+            # pairs of each target user padded to the same length
+            in_targets = np.isin(others, targets)
+            pair_rows, others, pair_sims = pair_rows[in_targets], others[in_targets], pair_sims[in_targets]
+            order = np.argsort(others, kind = 'stable')
+            target_pos = np.searchsorted(targets, others[order])
+            pair_pos = np.arange(len(order)) - np.searchsorted(others[order], others[order], side = 'left')
+            n_pairs = pair_pos.max() + 1 if len(order) > 0 else 0
+
+            padded_rows = np.full((len(targets), n_pairs), -1, dtype = np.int64)
+            padded_sims = np.zeros((len(targets), n_pairs), dtype = np.float64)
+            padded_rows[target_pos, pair_pos] = pair_rows[order]
+            padded_sims[target_pos, pair_pos] = pair_sims[order]
+
+            # merge users with new interactions into lists of target users (their previous entries are replaced)
+            in_batch = np.zeros(n, dtype = bool)
+            in_batch[rows] = True
+            block = max(4000000 // (k + n_pairs), 1)
+            for block_start in range(0, len(targets), block):
+                block_targets = targets[block_start:block_start + block]
+                previous = neighbors[block_targets]
+                kept = (previous >= 0) & ~in_batch[np.maximum(previous, 0)]
+
+                candidates = np.hstack([np.where(kept, previous, -1), padded_rows[block_start:block_start + block]])
+                candidate_sims = np.hstack([np.where(kept, similarities[block_targets], 0),
+                                            padded_sims[block_start:block_start + block]])
+                neighbors[block_targets], similarities[block_targets] = _top_k_rows(candidates, candidate_sims,
+                                                                                    tie_breaker, tie_scale, k)
+
+                changed.update(block_targets[(neighbors[block_targets] != previous).any(axis = 1)].tolist())
+
+        self.neighbors = neighbors
+        self.similarities = similarities
+        self.user_ids = user_item.user_ids
+
+        return np.array(sorted(changed), dtype = np.int64)
+
+    def to_arrays(self):
+        '''
+        OUTPUT:
+            arrays - (dict) numpy arrays to save the index
+        '''
+        return {'neighbors': self.neighbors, 'similarities': self.similarities, 'user_ids': self.user_ids}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        INPUT:
+            arrays - (dict) numpy arrays produced by to_arrays (can be memory-mapped)
+
+        OUTPUT:
+            neighbor_index - NeighborIndex instance
+        '''
+        return cls(arrays['neighbors'], arrays['similarities'], arrays['user_ids'])
+
+    def get_neighbors(self, user_idx):
+        '''
+        INPUT:
+            user_idx - (int) row index of the user
+
+        OUTPUT:
+            neighbor_ids - array of user ids of neighbors sorted by similarity
+            similarities - array of similarities of neighbors
+        '''
+        neighbors = self.neighbors[user_idx]
+        valid = neighbors >= 0
+
+        return self.user_ids[neighbors[valid]], self.similarities[user_idx][valid]
@@ -0,0 +1,909 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains sparse user-item matrix used by both recommenders.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+def _remap_compressed(indptr, indices, major_map, n_major, minor_map = None):
+    '''
+    Moves rows (major axis) of a compressed sparse structure to new positions
+    and renumbers its column indexes (minor axis), both maps must be increasing,
+    so indices stay sorted.
+
+    INPUT:
+        indptr, indices - arrays of CSR (or CSC) structure
+        major_map - array mapping previous row indexes to new row indexes
+        n_major - (int) new number of rows
+        minor_map - optional array mapping previous column indexes to new column indexes
+
+    OUTPUT:
+        indptr, indices - arrays of the remapped structure
+    '''
+    lengths = np.zeros(n_major, dtype = np.int64)
+    lengths[major_map] = np.diff(indptr)
+
+    new_indptr = np.zeros(n_major + 1, dtype = np.int64)
+    np.cumsum(lengths, out = new_indptr[1:])
+
+    if minor_map is not None:
+        indices = minor_map[indices]
+
+    return new_indptr, np.asarray(indices, dtype = np.int32)
+
+def _merge_ids(ids, new_ids):
+    '''
+    Merges new ids into a sorted array of unique ids.
+
+    INPUT:
+        ids - sorted array of unique ids
+        new_ids - array of ids to merge (can repeat and contain known ids)
+
+    OUTPUT:
+        merged - sorted array of unique ids
+        index_map - array mapping positions in ids to positions in merged
+        moved - (bool) True if positions of some ids changed (an id was inserted before them)
+    '''
+    new_ids = np.unique(new_ids)
+    idx = np.searchsorted(ids, new_ids)
+    found = idx < len(ids)
+    found[found] = ids[idx[found]] == new_ids[found]
+    new_ids, idx = new_ids[~found], idx[~found]
+
+    # known ids only or ids appended after the last one (e.g. new users from EmailEncoder)
+    if len(new_ids) == 0 or idx[0] == len(ids):
+        return np.concatenate([ids, new_ids]) if len(new_ids) > 0 else ids, np.arange(len(ids)), False
+
+    merged = np.insert(ids, idx, new_ids)
+
+    return merged, np.searchsorted(merged, ids), True
+
+def _insert_compressed(indptr, indices, major, minor):
+    '''
+    Inserts entries into a compressed sparse structure with sorted indices,
+    entries which are already present are skipped.
+
+    INPUT:
+        indptr, indices - arrays of CSR (or CSC) structure
+        major, minor - arrays of row and column indexes of unique entries sorted by row, then by column
+
+    OUTPUT:
+        indptr, indices - arrays of the structure with inserted entries
+        inserted - boolean array, True for entries which were not present before
+    '''
+    indptr = np.asarray(indptr, dtype = np.int64)
+    major = np.asarray(major, dtype = np.int64)
+    minor = np.asarray(minor)
+
+    # find position of each entry in its row with binary search, all entries are searched at once
+    lo, hi = indptr[major], indptr[major + 1]
+    end = hi.copy()
+    active = np.flatnonzero(lo < hi)
+    while len(active) > 0:
+        mid = (lo[active] + hi[active]) // 2
+        right = indices[mid] < minor[active]
+        lo[active[right]] = mid[right] + 1
+        hi[active[~right]] = mid[~right]
+        active = active[lo[active] < hi[active]]
+
+    positions = lo
+    inserted = positions == end
+    present = np.flatnonzero(~inserted)
+    inserted[present] = indices[positions[present]] != minor[present]
+
+    # entries of one row are inserted in sorted order at positions of the previous structure
+    indices = np.insert(indices, positions[inserted], minor[inserted]).astype(np.int32)
+    added = np.bincount(major[inserted], minlength = len(indptr) - 1)
+    indptr = indptr.copy()
+    indptr[1:] += np.cumsum(added)
+
+    return indptr, indices, inserted
+
+class UserItemMatrix():
+    '''
+    Sparse matrix of users by articles: 1's when a user has interacted with
+    an article, 0 otherwise.
+
+    Rows and columns are contiguous integer indexes. Arrays user_ids and
+    article_ids map row and column indexes back to user ids and article ids,
+    both arrays are sorted, so ids are mapped to indexes with binary search.
+    Integer user ids (e.g. produced by email_mapper) are additionally mapped
+    to rows with a lookup array, so known-user checks are O(1). Article ids
+    are returned by the recommenders as strings (e.g. '1430.0'), article_labels
+    holds the string of each column, so ids are translated once and not on every request.
+    Memory scales with the number of interactions and not with
+    number of users x number of articles.
+    '''
+
+    def __init__(self, matrix, user_ids, article_ids):
+        '''
+        INPUT:
+            matrix - scipy sparse matrix of users by articles
+            user_ids - sorted array of user ids corresponding to matrix rows
+            article_ids - sorted array of article ids corresponding to matrix columns
+        '''
+        self.matrix = sparse.csr_matrix(matrix, dtype = np.float32)
+        self.matrix.sort_indices()
+        self.user_ids = np.asarray(user_ids)
+        self.article_ids = np.asarray(article_ids)
+        self._csc = None
+        self._article_labels = None
+        self._build_user_lookup()
+
+    def _build_user_lookup(self):
+        '''
+        Builds array mapping user id to row index for dense non-negative integer user ids.
+        '''
+        self._user_lookup = None
+
+        if len(self.user_ids) == 0 or not np.issubdtype(self.user_ids.dtype, np.integer):
+            return
+
+        # use lookup array only if it is not much larger than the number of users
+        min_id, max_id = self.user_ids[0], self.user_ids[-1]
+        if min_id >= 0 and max_id < 2 * len(self.user_ids) + 1024:
+            self._user_lookup = np.full(max_id + 1, -1, dtype = np.int32)
+            self._user_lookup[self.user_ids] = np.arange(len(self.user_ids))
+
+    @classmethod
+    def from_interactions(cls, user_ids, article_ids):
+        '''
+        Builds user-item matrix from log of interactions.
+
+        INPUT:
+            user_ids - array-like of user ids, one per interaction
+            article_ids - array-like of article ids, one per interaction
+
+        OUTPUT:
+            user_item - UserItemMatrix instance
+        '''
+        # map ids to contiguous indexes
+        unique_users, rows = np.unique(np.asarray(user_ids), return_inverse = True)
+        unique_articles, cols = np.unique(np.asarray(article_ids), return_inverse = True)
+
+        # repeated interactions are summed up, so set all stored values to 1
+        matrix = sparse.csr_matrix((np.ones(len(rows), dtype = np.float32), (rows, cols)),
+                                   shape = (len(unique_users), len(unique_articles)))
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+
+        return cls(matrix, unique_users, unique_articles)
+
+    def add_interactions(self, user_ids, article_ids):
+        '''
+        Adds interactions to the matrix in place. New users and articles get rows and
+        columns in sorted order of ids, so indexes of existing users and articles
+        can shift. If no rows or columns move (known or appended users and articles,
+        e.g. new users from EmailEncoder), index arrays are not renumbered and the
+        update costs one copy of the index arrays to insert the new entries.
+
+        INPUT:
+            user_ids - array-like of user ids, one per interaction
+            article_ids - array-like of article ids, one per interaction
+
+        OUTPUT:
+            user_map - array mapping previous row indexes to new row indexes
+            article_map - array mapping previous column indexes to new column indexes
+            rows - array of row indexes of the users of the interactions
+            cols - array of column indexes of the articles of the interactions
+        '''
+        user_ids = np.asarray(user_ids, dtype = self.user_ids.dtype)
+        article_ids = np.asarray(article_ids, dtype = self.article_ids.dtype)
+
+        # merge new ids into sorted ids and map previous indexes to new indexes
+        new_user_ids, user_map, users_moved = _merge_ids(self.user_ids, user_ids)
+        new_article_ids, article_map, articles_moved = _merge_ids(self.article_ids, article_ids)
+        shape = (len(new_user_ids), len(new_article_ids))
+
+        # rows of appended users are added at the end, other rows are moved only if a user was inserted before them
+        if users_moved or articles_moved:
+            indptr, indices = _remap_compressed(self.matrix.indptr, self.matrix.indices, user_map, shape[0],
+                                                article_map if articles_moved else None)
+        else:
+            indptr = np.concatenate([self.matrix.indptr, np.full(shape[0] - len(user_map), self.matrix.indptr[-1])])
+            indices = self.matrix.indices
+
+        # insert unique user-article pairs, which are not in the matrix yet
+        rows = np.searchsorted(new_user_ids, user_ids)
+        cols = np.searchsorted(new_article_ids, article_ids)
+        pairs = np.unique(rows.astype(np.int64) * shape[1] + cols)
+        pair_rows, pair_cols = pairs // shape[1], pairs % shape[1]
+        indptr, indices, inserted = _insert_compressed(indptr, indices, pair_rows, pair_cols)
+
+        # column oriented copy is updated the same way, so it is not rebuilt on next use
+        if self._csc is not None:
+            if users_moved or articles_moved:
+                csc_indptr, csc_indices = _remap_compressed(self._csc.indptr, self._csc.indices, article_map, shape[1],
+                                                            user_map if users_moved else None)
+            else:
+                csc_indptr = np.concatenate([self._csc.indptr, np.full(shape[1] - len(article_map), self._csc.indptr[-1])])
+                csc_indices = self._csc.indices
+            order = np.lexsort((pair_rows[inserted], pair_cols[inserted]))
+            csc_indptr, csc_indices, _ = _insert_compressed(csc_indptr, csc_indices,
+                                                            pair_cols[inserted][order], pair_rows[inserted][order])
+            self._csc = sparse.csc_matrix((np.ones(len(csc_indices), dtype = np.float32), csc_indices, csc_indptr),
+                                          shape = shape)
+
+        self.matrix = sparse.csr_matrix((np.ones(len(indices), dtype = np.float32), indices, indptr), shape = shape)
+        self.matrix.has_sorted_indices = True
+        self.user_ids = new_user_ids
+        self.article_ids = new_article_ids
+        self._article_labels = None
+        self._build_user_lookup()
+
+        return user_map, article_map, rows, cols
+
+    def to_arrays(self):
+        '''
+        OUTPUT:
+            arrays - (dict) numpy arrays to save the matrix
+        '''
+        return {'data': self.matrix.data, 'indices': self.matrix.indices, 'indptr': self.matrix.indptr,
+                'user_ids': self.user_ids, 'article_ids': self.article_ids}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        INPUT:
+            arrays - (dict) numpy arrays produced by to_arrays (can be memory-mapped)
+
+        OUTPUT:
+            user_item - UserItemMatrix instance sharing memory with arrays
+        '''
+        shape = (len(arrays['user_ids']), len(arrays['article_ids']))
+        matrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape = shape, copy = False)
+
+        return cls(matrix, arrays['user_ids'], arrays['article_ids'])
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @property
+    def csc(self):
+        '''
+        Column oriented copy of the matrix for fast access to users of an article.
+        '''
+        if self._csc is None:
+            self._csc = self.matrix.tocsc()
+        return self._csc
+
+    @property
+    def article_labels(self):
+        '''
+        Array of article ids as strings (e.g. '1430.0') corresponding to matrix columns.
+        '''
+        if self._article_labels is None:
+            self._article_labels = self.article_ids.astype(str).astype(object)
+        return self._article_labels
+
+    def user_index(self, user_id):
+        '''
+        INPUT:
+            user_id - id of the user
+
+        OUTPUT:
+            row index of the user or -1 if user is not in the matrix
+        '''
+        if self._user_lookup is not None:
+            if isinstance(user_id, (int, np.integer)) and 0 <= user_id < len(self._user_lookup):
+                return int(self._user_lookup[user_id])
+            if not isinstance(user_id, (float, np.floating)) or not float(user_id).is_integer():
+                return -1
+
+        idx = np.searchsorted(self.user_ids, user_id)
+        if idx < len(self.user_ids) and self.user_ids[idx] == user_id:
+            return int(idx)
+        return -1
+
+    def article_index(self, article_id):
+        '''
+        INPUT:
+            article_id - id of the article
+
+        OUTPUT:
+            column index of the article or -1 if article is not in the matrix
+        '''
+        idx = np.searchsorted(self.article_ids, article_id)
+        if idx < len(self.article_ids) and self.article_ids[idx] == article_id:
+            return int(idx)
+        return -1
+
+    def user_indexes(self, user_ids):
+        '''
+        INPUT:
+            user_ids - array-like of user ids
+
+        OUTPUT:
+            array of row indexes of the users, -1 for users not in the matrix
+        '''
+        user_ids = np.asarray(user_ids)
+        if self._user_lookup is not None and np.issubdtype(user_ids.dtype, np.integer):
+            known = (user_ids >= 0) & (user_ids < len(self._user_lookup))
+            return np.where(known, self._user_lookup[np.where(known, user_ids, 0)], -1)
+
+        idx = np.searchsorted(self.user_ids, user_ids)
+        idx_clipped = np.minimum(idx, max(len(self.user_ids) - 1, 0))
+        found = (idx < len(self.user_ids)) & (self.user_ids[idx_clipped] == user_ids)
+
+        return np.where(found, idx, -1)
+
+    def article_indexes(self, article_ids):
+        '''
+        INPUT:
+            article_ids - array-like of article ids (numbers or strings like '1430.0')
+
+        OUTPUT:
+            array of column indexes of the articles, -1 for articles not in the matrix
+        '''
+        article_ids = np.asarray(article_ids)
+        if article_ids.dtype.kind in 'USO':
+            article_ids = article_ids.astype(float).astype(self.article_ids.dtype)
+        idx = np.searchsorted(self.article_ids, article_ids)
+        found = idx < len(self.article_ids)
+        found[found] = self.article_ids[idx[found]] == article_ids[found]
+
+        return np.where(found, idx, -1)
+
+    def rows(self, user_idx):
+        '''
+        INPUT:
+            user_idx - array of row indexes, -1 for unknown users
+
+        OUTPUT:
+            sparse CSR matrix with rows for the users, rows of unknown users are empty
+        '''
+        user_idx = np.asarray(user_idx)
+        known = user_idx >= 0
+        selector = sparse.csr_matrix((np.ones(known.sum(), dtype = np.float32), (np.flatnonzero(known), user_idx[known])),
+                                     shape = (len(user_idx), self.matrix.shape[0]))
+
+        return selector @ self.matrix
+
+    def __contains__(self, user_id):
+        return self.user_index(user_id) >= 0
+
+    def user_article_indexes(self, user_idx):
+        '''
+        INPUT:
+            user_idx - (int) row index of the user
+
+        OUTPUT:
+            sorted array of column indexes of articles the user interacted with
+        '''
+        return self.matrix.indices[self.matrix.indptr[user_idx]:self.matrix.indptr[user_idx + 1]]
+
+    def user_articles(self, user_id):
+        '''
+        INPUT:
+            user_id - id of the user
+
+        OUTPUT:
+            article_ids - array of ids of articles the user interacted with,
+            empty if user is not in the matrix
+        '''
+        idx = self.user_index(user_id)
+        if idx < 0:
+            return self.article_ids[:0]
+
+        return self.article_ids[self.user_article_indexes(idx)]
+
+    def to_dataframe(self):
+        '''
+        OUTPUT:
+            user_item - dense pandas dataframe with user ids as index and
+            article ids as columns (use for small matrices only)
+        '''
+        return pd.DataFrame(self.matrix.toarray(), index = self.user_ids, columns = self.article_ids)
+
+class InteractionCounts():
+    '''
+    Number of interactions of each article and each user, and ranking of
+    articles by popularity. Counts are computed once from the log of interactions,
+    so top articles and counts for k ids are looked up in O(k).
+    '''
+
+    def __init__(self, article_ids, article_counts, user_ids, user_counts, ranking = None, rank = None):
+        '''
+        INPUT:
+            article_ids - sorted array of article ids
+            article_counts - array of number of interactions of each article
+            user_ids - sorted array of user ids
+            user_counts - array of number of interactions of each user
+            ranking, rank - optional precomputed ranking of articles (positions of articles
+            sorted by popularity) and rank of each article, computed from counts if not provided
+        '''
+        self.article_ids = np.asarray(article_ids)
+        self.article_counts = np.asarray(article_counts, dtype = np.int32)
+        self.user_ids = np.asarray(user_ids)
+        self.user_counts = np.asarray(user_counts, dtype = np.int32)
+
+        if ranking is None or rank is None:
+            ranking, rank = self._rank_articles(self.article_counts)
+
+        self.ranking = ranking
+        self.rank = rank
+
+    @staticmethod
+    def _rank_articles(article_counts):
+        '''
+        Ranks articles by number of interactions, articles with equal number of interactions by id.
+
+        OUTPUT:
+            ranking - positions of articles sorted by popularity
+            rank - rank of each article
+        '''
+        ranking = np.argsort(-article_counts, kind = 'stable').astype(np.int32)
+        rank = np.empty(len(ranking), dtype = np.int32)
+        rank[ranking] = np.arange(len(ranking))
+
+        return ranking, rank
+
+    def to_arrays(self):
+        '''
+        OUTPUT:
+            arrays - (dict) numpy arrays to save the counts
+        '''
+        return {'article_ids': self.article_ids, 'article_counts': self.article_counts,
+                'user_ids': self.user_ids, 'user_counts': self.user_counts,
+                'ranking': self.ranking, 'rank': self.rank}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        INPUT:
+            arrays - (dict) numpy arrays produced by to_arrays (can be memory-mapped)
+
+        OUTPUT:
+            counts - InteractionCounts instance
+        '''
+        return cls(arrays['article_ids'], arrays['article_counts'], arrays['user_ids'], arrays['user_counts'],
+                   arrays['ranking'], arrays['rank'])
+
+    @classmethod
+    def build(cls, df, user_item):
+        '''
+        Counts interactions aligned with rows and columns of user-item matrix.
+
+        INPUT:
+            df - pandas dataframe with article_id, title, user_id columns
+            user_item - (UserItemMatrix) sparse matrix of users by articles
+
+        OUTPUT:
+            counts - InteractionCounts instance
+        '''
+        n_users, n_articles = user_item.shape
+        article_counts = np.bincount(user_item.article_indexes(df['article_id'].values), minlength = n_articles)
+        user_counts = np.bincount(user_item.user_indexes(df['user_id'].values), minlength = n_users)
+
+        return cls(user_item.article_ids, article_counts, user_item.user_ids, user_counts)
+
+    def add_interactions(self, user_item, user_map, article_map, rows, cols):
+        '''
+        Updates counts and ranking after interactions were added to the user-item
+        matrix with UserItemMatrix.add_interactions.
+
+        INPUT:
+            user_item - (UserItemMatrix) updated sparse matrix of users by articles
+            user_map, article_map, rows, cols - arrays returned by UserItemMatrix.add_interactions
+        '''
+        n_users, n_articles = user_item.shape
+
+        article_counts = np.zeros(n_articles, dtype = np.int32)
+        article_counts[article_map] = self.article_counts
+        article_counts += np.bincount(cols, minlength = n_articles)
+
+        user_counts = np.zeros(n_users, dtype = np.int32)
+        user_counts[user_map] = self.user_counts
+        user_counts += np.bincount(rows, minlength = n_users)
+
+        self.article_ids = user_item.article_ids
+        self.article_counts = article_counts
+        self.user_ids = user_item.user_ids
+        self.user_counts = user_counts
+        self.ranking, self.rank = self._rank_articles(article_counts)
+
+    def moved_articles(self, article_ids, rank):
+        '''
+        Finds articles whose position in the popularity ranking differs from
+        a previous ranking (e.g. before add_interactions).
+
+        INPUT:
+            article_ids - sorted array of article ids of the previous counts
+            rank - rank of each article of the previous counts
+
+        OUTPUT:
+            columns - array of column indexes of articles which moved in the ranking
+            or were added
+        '''
+        previous = np.full(len(self.article_ids), -1, dtype = np.int64)
+        previous[np.searchsorted(self.article_ids, article_ids)] = rank
+
+        return np.flatnonzero(previous != self.rank)
+
+    @property
+    def popularity(self):
+        '''
+        Popularity score of each article in (0, 1], the most popular article has score 1.
+        '''
+        return 1 - self.rank / max(len(self.rank), 1)
+
+    def top_article_ids(self, n):
+        '''
+        INPUT:
+            n - (int) number of articles
+
+        OUTPUT:
+            array of ids of n most popular articles
+        '''
+        return self.article_ids[self.ranking[:n]]
+
+    def _lookup(self, ids, all_ids, counts):
+        ids = np.asarray(ids)
+        idx = np.searchsorted(all_ids, ids)
+        idx_clipped = np.minimum(idx, max(len(all_ids) - 1, 0))
+        found = (idx < len(all_ids)) & (all_ids[idx_clipped] == ids)
+
+        return np.where(found, counts[idx_clipped], 0)
+
+    def get_article_counts(self, article_ids):
+        '''
+        INPUT:
+            article_ids - array-like of article ids
+
+        OUTPUT:
+            array of number of interactions of each article, 0 for unknown articles
+        '''
+        return self._lookup(article_ids, self.article_ids, self.article_counts)
+
+    def get_user_counts(self, user_ids):
+        '''
+        INPUT:
+            user_ids - array-like of user ids
+
+        OUTPUT:
+            array of number of interactions of each user, 0 for unknown users
+        '''
+        return self._lookup(user_ids, self.user_ids, self.user_counts)
+
+class EmailEncoder():
+    '''
+    Maps anonymized user emails to user ids. Ids are assigned in order of
+    first appearance starting from 1 (missing emails share one id), the mapping is
+    kept between calls, so the log of interactions can be encoded chunk by chunk.
+    '''
+
+    def __init__(self, emails = None, missing = None):
+        '''
+        INPUT:
+            emails - optional array of already known emails ordered by user id,
+            mapping is built from it on first use
+            missing - optional boolean array, True for users with missing email
+        '''
+        self._emails = emails
+        self._missing = missing
+        self._mapping = None if emails is not None else dict()
+
+    @property
+    def mapping(self):
+        '''
+        Dictionary mapping email (None for missing email) to user id.
+        '''
+        if self._mapping is None:
+            emails = self._emails.tolist()
+            if self._missing is not None:
+                for i in np.flatnonzero(self._missing):
+                    emails[i] = None
+
+            self._mapping = {email: user_id for user_id, email in enumerate(emails, start = 1)}
+            self._emails = None
+            self._missing = None
+        return self._mapping
+
+    def encode(self, emails):
+        '''
+        INPUT:
+            emails - array-like of emails
+
+        OUTPUT:
+            user_ids - int32 array of user ids
+        '''
+        mapping = self.mapping
+
+        # factorize emails of the chunk, codes follow the order of first appearance
+        codes, uniques = pd.factorize(np.asarray(emails, dtype = object), use_na_sentinel = False)
+
+        # map unique emails of the chunk to global ids, assigning new ids to new emails
+        ids = np.array([mapping.setdefault(None if pd.isna(email) else email, len(mapping) + 1)
+                        for email in uniques], dtype = np.int32)
+
+        return ids[codes]
+
+    def to_arrays(self):
+        '''
+        OUTPUT:
+            arrays - (dict) numpy arrays to save the mapping: emails ordered by user id
+            and flags of missing emails
+        '''
+        emails = list(self.mapping)
+        missing = np.array([email is None for email in emails], dtype = bool)
+        emails = np.array(['' if email is None else email for email in emails], dtype = str)
+
+        return {'emails': emails, 'missing': missing}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        INPUT:
+            arrays - (dict) numpy arrays produced by to_arrays
+
+        OUTPUT:
+            email_encoder - EmailEncoder instance, mapping is built lazily on first encode
+        '''
+        return cls(arrays['emails'], arrays['missing'])
+
+class ArticleTitles():
+    '''
+    Titles of articles aligned with columns of the user-item matrix. Titles are
+    stored as an interned string table and an array of codes indexed by column,
+    so names of k articles are resolved with an O(k) gather in the given order
+    without touching the log of interactions.
+    '''
+
+    def __init__(self, article_ids, codes, titles):
+        '''
+        INPUT:
+            article_ids - sorted array of article ids (columns of the user-item matrix)
+            codes - array of positions of titles in titles table for each article, -1 for unknown title
+            titles - array of unique titles
+        '''
+        self.article_ids = np.asarray(article_ids)
+        self.codes = np.asarray(codes)
+        self.titles = np.asarray(titles, dtype = object)
+        self._title_codes = None
+
+    @classmethod
+    def build(cls, df, user_item):
+        '''
+        Takes title of the first interaction with each article.
+
+        INPUT:
+            df - pandas dataframe with article_id, title (categorical), user_id columns
+            user_item - (UserItemMatrix) sparse matrix of users by articles
+
+        OUTPUT:
+            article_titles - ArticleTitles instance
+        '''
+        title = pd.Categorical(df['title'])
+        cols = user_item.article_indexes(df['article_id'].values)
+
+        # assign in reverse order, so the first interaction with the article wins
+        codes = np.full(user_item.shape[1], -1, dtype = np.int32)
+        codes[cols[::-1]] = title.codes[::-1]
+
+        return cls(user_item.article_ids, codes, title.categories.values)
+
+    def to_arrays(self):
+        '''
+        OUTPUT:
+            arrays - (dict) numpy arrays to save the titles
+        '''
+        return {'article_ids': self.article_ids, 'codes': self.codes, 'titles': self.titles.astype(str)}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        INPUT:
+            arrays - (dict) numpy arrays produced by to_arrays (can be memory-mapped)
+
+        OUTPUT:
+            article_titles - ArticleTitles instance
+        '''
+        return cls(arrays['article_ids'], arrays['codes'], arrays['titles'])
+
+    def names(self, article_idx):
+        '''
+        INPUT:
+            article_idx - array-like of column indexes of articles
+
+        OUTPUT:
+            list of titles of the articles in the same order, None for unknown articles
+        '''
+        article_idx = np.asarray(article_idx, dtype = np.int64)
+
+        # articles out of the table and articles without title get None, so an empty table is valid
+        known = (article_idx >= 0) & (article_idx < len(self.codes))
+        codes = np.full(len(article_idx), -1, dtype = np.int64)
+        codes[known] = self.codes[article_idx[known]]
+
+        names = np.full(len(article_idx), None, dtype = object)
+        names[codes >= 0] = self.titles[codes[codes >= 0]]
+
+        return names.tolist()
+
+    def get_names(self, article_ids):
+        '''
+        INPUT:
+            article_ids - array-like of article ids (numbers or strings like '1430.0')
+
+        OUTPUT:
+            list of titles of the articles in the same order, None for unknown articles
+        '''
+        article_ids = np.asarray(article_ids, dtype = float).astype(self.article_ids.dtype)
+        idx = np.searchsorted(self.article_ids, article_ids)
+        found = idx < len(self.article_ids)
+        found[found] = self.article_ids[idx[found]] == article_ids[found]
+
+        return self.names(np.where(found, idx, -1))
+
+    def add_interactions(self, user_item, article_map, article_ids, titles):
+        '''
+        Aligns titles with the updated user-item matrix and adds titles of new articles
+        after interactions were added with UserItemMatrix.add_interactions.
+
+        INPUT:
+            user_item - (UserItemMatrix) updated sparse matrix of users by articles
+            article_map - array mapping previous column indexes to new column indexes
+            article_ids - array of article ids of the new interactions
+            titles - array of titles of the new interactions
+        '''
+        codes = np.full(user_item.shape[1], -1, dtype = np.int32)
+        codes[article_map] = self.codes
+
+        # titles of new articles are interned, the first interaction with the article wins
+        if self._title_codes is None:
+            self._title_codes = {title: code for code, title in enumerate(self.titles.tolist())}
+        new_titles = []
+        for col, title in zip(user_item.article_indexes(article_ids).tolist(), titles):
+            if codes[col] < 0 and not pd.isna(title):
+                code = self._title_codes.get(title)
+                if code is None:
+                    code = self._title_codes[title] = len(self._title_codes)
+                    new_titles.append(title)
+                codes[col] = code
+
+        if len(new_titles) > 0:
+            self.titles = np.concatenate([self.titles, np.array(new_titles, dtype = object)])
+        self.article_ids = user_item.article_ids
+        self.codes = codes
+
+def _codes_dtype(n_categories):
+    '''
+    Returns the smallest integer dtype pandas uses for codes of a categorical with
+    n_categories categories, so categoricals share the codes array without converting it.
+    '''
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+class InteractionLog():
+    '''
+    Append-only log of interactions (article_id, title, user_id). Columns are
+    stored in buffers with spare capacity, which double when they are full, so
+    appending m interactions costs O(m) amortized instead of copying the whole
+    log. Titles are stored as codes into a table of unique titles.
+
+    frame returns the log as a dataframe, which shares memory with the buffers,
+    dataframes returned before an append keep showing the previous interactions.
+    '''
+
+    def __init__(self, article_ids, user_ids, title_codes, title_categories):
+        '''
+        INPUT:
+            article_ids - array of article ids (float32), one per interaction
+            user_ids - array of user ids (int32), one per interaction
+            title_codes - array of positions of titles in title_categories, -1 for missing titles
+            title_categories - array of unique titles
+        '''
+        self.title_categories = pd.Index(np.asarray(title_categories, dtype = object), dtype = str)
+        self._size = len(article_ids)
+        self._article_ids = np.asarray(article_ids, dtype = np.float32)
+        self._user_ids = np.asarray(user_ids, dtype = np.int32)
+        self._title_codes = np.asarray(title_codes, dtype = _codes_dtype(len(self.title_categories)))
+
+        # buffers passed in (e.g. memory-mapped or used by a dataframe) are copied on the first append
+        self._owned = False
+        self._title_index = None
+        self._frame = None
+
+    def __len__(self):
+        return self._size
+
+    @classmethod
+    def from_frame(cls, df):
+        '''
+        INPUT:
+            df - pandas dataframe with article_id, title, user_id columns
+
+        OUTPUT:
+            log - InteractionLog instance
+        '''
+        title = pd.Categorical(df['title'])
+
+        return cls(df['article_id'].values, df['user_id'].values, title.codes, title.categories)
+
+    def to_arrays(self):
+        '''
+        OUTPUT:
+            arrays - (dict) numpy arrays to save the log (same arrays as interactions_to_arrays)
+        '''
+        return {'article_id': self._article_ids[:self._size], 'user_id': self._user_ids[:self._size],
+                'title_codes': self._title_codes[:self._size], 'title_categories': np.asarray(self.title_categories, dtype = str)}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        INPUT:
+            arrays - (dict) numpy arrays produced by to_arrays (can be memory-mapped)
+
+        OUTPUT:
+            log - InteractionLog instance sharing memory with arrays
+        '''
+        return cls(arrays['article_id'], arrays['user_id'], arrays['title_codes'], arrays['title_categories'])
+
+    def _reserve(self, size, codes_dtype):
+        '''
+        Makes sure buffers can hold size interactions and title codes of codes_dtype.
+        '''
+        capacity = len(self._article_ids)
+        if self._owned and size <= capacity and self._title_codes.dtype == codes_dtype:
+            return
+
+        if not self._owned or size > capacity:
+            capacity = max(size, 2 * capacity, 1024)
+
+        n = self._size
+        article_ids = np.empty(capacity, dtype = np.float32)
+        user_ids = np.empty(capacity, dtype = np.int32)
+        title_codes = np.empty(capacity, dtype = codes_dtype)
+        article_ids[:n] = self._article_ids[:n]
+        user_ids[:n] = self._user_ids[:n]
+        title_codes[:n] = self._title_codes[:n]
+
+        self._article_ids, self._user_ids, self._title_codes = article_ids, user_ids, title_codes
+        self._owned = True
+
+    def append(self, article_ids, titles, user_ids):
+        '''
+        Appends interactions to the log.
+
+        INPUT:
+            article_ids - array of article ids of the new interactions
+            titles - array of titles of the new interactions (missing titles are NaN or None)
+            user_ids - array of user ids of the new interactions
+        '''
+        # unique titles of the new interactions are mapped to codes, new titles are added to the table
+        local_codes, uniques = pd.factorize(np.asarray(titles, dtype = object))
+        if self._title_index is None:
+            self._title_index = {title: code for code, title in enumerate(self.title_categories.tolist())}
+        new_titles = [title for title in uniques.tolist() if title not in self._title_index]
+        for title in new_titles:
+            self._title_index[title] = len(self._title_index)
+        # missing titles have code -1, which picks the last code (-1 as well)
+        unique_codes = np.array([self._title_index[title] for title in uniques.tolist()] + [-1], dtype = np.int64)
+        if len(new_titles) > 0:
+            self.title_categories = self.title_categories.append(pd.Index(new_titles, dtype = self.title_categories.dtype))
+
+        n, m = self._size, len(local_codes)
+        self._reserve(n + m, _codes_dtype(len(self.title_categories)))
+        self._article_ids[n:n + m] = article_ids
+        self._user_ids[n:n + m] = user_ids
+        self._title_codes[n:n + m] = unique_codes[local_codes]
+        self._size = n + m
+        self._frame = None
+
+    @property
+    def frame(self):
+        '''
+        Log as pandas dataframe with article_id (float32), title (categorical), user_id (int32) columns.
+        '''
+        if self._frame is None:
+            n = self._size
+            title = pd.Categorical.from_codes(self._title_codes[:n], categories = self.title_categories, validate = False)
+            self._frame = pd.DataFrame({'article_id': self._article_ids[:n], 'title': title,
+                                        'user_id': self._user_ids[:n]}, copy = False)
+        return self._frame
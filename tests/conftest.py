@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains shared fixtures of the tests: a small synthetic log of interactions
+split into a fitted part and new interactions, and articles' content.
+"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+# tests import the model package from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from model import content_based_helpers as cbh
+
+N_USERS = 60
+N_ARTICLES = 40
+
+def make_interactions(seed = 0):
+    '''
+    INPUT:
+        seed - (int) seed of the random generator
+
+    OUTPUT:
+        df - pandas dataframe with article_id, title, email columns, articles are
+        picked with skewed popularity and some interactions are repeated
+    '''
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, N_ARTICLES + 1)
+
+    rows = []
+    for user in range(N_USERS):
+        articles = rng.choice(N_ARTICLES, size = rng.integers(1, 10), p = weights / weights.sum())
+        rows += [(float(article), 'title of article {}'.format(article), 'user{}@mail'.format(user)) for article in articles]
+
+    # interactions of users are mixed in time
+    df = pd.DataFrame(rows, columns = ['article_id', 'title', 'email'])
+    return df.iloc[rng.permutation(len(df))].reset_index(drop = True)
+
+@pytest.fixture
+def data(tmp_path):
+    '''
+    Writes the first 80% of the log as the fitted dataset and the whole log with
+    new users and new articles as the dataset to refit on.
+
+    OUTPUT:
+        data - (dict) paths 'head', 'full', 'articles' and new interactions 'records'
+    '''
+    df = make_interactions()
+    extra = pd.DataFrame({'article_id': [5.5, 5.5, 1000.0], 'title': ['new article', 'new article', np.nan],
+                          'email': [df['email'].iloc[0], 'new@mail', df['email'].iloc[3]]})
+    full = pd.concat([df, extra], ignore_index = True)
+    n = int(len(df) * 0.8)
+
+    paths = {name: str(tmp_path / '{}.csv'.format(name)) for name in ('head', 'full', 'articles')}
+    full.iloc[:n].to_csv(paths['head'], index = False)
+    full.to_csv(paths['full'], index = False)
+
+    # content of articles, words of articles with the same topic overlap
+    rng = np.random.default_rng(1)
+    bodies = [' '.join('topic{}word{}'.format(article % 4, word) for word in rng.integers(0, 12, size = 8))
+              for article in range(N_ARTICLES)]
+    pd.DataFrame({'article_id': np.arange(N_ARTICLES), 'doc_body': bodies}).to_csv(paths['articles'], index = False)
+
+    return dict(paths, records = full.iloc[n:])
+
+@pytest.fixture
+def keywords(monkeypatch):
+    '''
+    Replaces Rake keywords extraction with splitting of texts into words,
+    so content-based tests don't depend on NLTK corpora.
+    '''
+    monkeypatch.setattr(cbh, 'extract_keywords', lambda texts, n_jobs = 1, chunk_size = 256: [str(text) for text in texts])
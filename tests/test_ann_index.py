@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains tests of the nearest neighbor indexes: recall of LSH, fallback
+to exact search and ordering of neighbors with equal similarity.
+"""
+
+import numpy as np
+from scipy import sparse
+
+from model.ann_index import ExactIndex, RandomProjectionLSH, recall_at_k
+from model.similarity_index import blocked_top_k
+from model.collaborative_recommender import CollaborativeRecommender
+
+def clustered_vectors(n = 1000, dim = 32, n_clusters = 20):
+    # normalized vectors around random centers, so neighbors are mostly in the same cluster
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((n_clusters, dim))
+    vectors = centers[rng.integers(0, n_clusters, n)] + 0.3 * rng.standard_normal((n, dim))
+
+    return (vectors / np.linalg.norm(vectors, axis = 1, keepdims = True)).astype(np.float32)
+
+def test_lsh_recall():
+    vectors = clustered_vectors()
+    exact, _ = ExactIndex().fit(vectors).query(vectors, 10, exclude = np.arange(len(vectors)))
+
+    index = RandomProjectionLSH(n_tables = 8, n_bits = 8).fit(vectors)
+    neighbors, _ = index.all_neighbors(10)
+    probed, _ = RandomProjectionLSH(n_tables = 16, n_bits = 8, n_probes = 2).fit(vectors).all_neighbors(10)
+
+    # queries re-rank a small share of vectors
+    assert np.mean([len(index.candidates(keys)) for keys in index._hash(vectors[:50])]) < len(vectors) / 4
+    assert recall_at_k(neighbors, exact) >= 0.95
+    assert recall_at_k(probed, exact) >= recall_at_k(neighbors, exact)
+
+def test_lsh_exact_fallback():
+    vectors = clustered_vectors()
+    exact, exact_sims = ExactIndex().fit(vectors).query(vectors, 10, exclude = np.arange(len(vectors)))
+
+    # small buckets leave queries without enough candidates
+    index = RandomProjectionLSH(n_tables = 2, n_bits = 12, exact_fallback = False).fit(vectors)
+    neighbors, _ = index.all_neighbors(10)
+    assert (neighbors < 0).any(axis = 1).any()
+
+    # with the fallback these queries get exact neighbors
+    index = RandomProjectionLSH(n_tables = 2, n_bits = 12).fit(vectors)
+    neighbors, similarities = index.all_neighbors(10)
+    few = np.array([len(index.candidates(keys)) - 1 < 10 for keys in index._hash(vectors)])
+    assert few.any() and (neighbors >= 0).all()
+    assert np.array_equal(neighbors[few], exact[few]) and np.allclose(similarities[few], exact_sims[few])
+
+def test_indexes_order_ties_by_tie_breaker(data):
+    matrix = sparse.random(200, 30, density = 0.1, format = 'csr', random_state = 0)
+    matrix.data[:] = 1
+    tie_breaker = np.random.default_rng(0).integers(0, 50, 200)
+    expected = blocked_top_k(matrix, 10, tie_breaker = tie_breaker)
+
+    # binary rows have many equal similarities, every query of LSH falls back to exact search
+    for index in (ExactIndex(batch_size = 64), RandomProjectionLSH(min_candidates = 200)):
+        neighbors, similarities = index.fit(matrix).all_neighbors(10, tie_breaker)
+        assert np.array_equal(neighbors, expected[0]) and np.array_equal(similarities, expected[1])
+
+    # collaborative recommender with exact index equals the default exact search
+    default = CollaborativeRecommender(n_neighbors = 5)
+    default.fit(data['full'])
+    exact = CollaborativeRecommender(n_neighbors = 5, ann_params = {'method': 'exact'})
+    exact.fit(data['full'])
+    assert np.array_equal(exact.neighbor_index.neighbors, default.neighbor_index.neighbors)
+    user_ids = default.user_item.user_ids.tolist()
+    assert exact.make_recs_batch(user_ids, 10) == default.make_recs_batch(user_ids, 10)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains tests of the content-based helpers: keywords extracted by worker
+processes compared with extraction in the current process and the persistent
+keywords cache.
+"""
+
+import multiprocessing
+import pytest
+
+from model import content_based_helpers as cbh
+
+class FakeRake():
+    '''
+    Splits texts into words instead of Rake keywords extraction, so tests don't
+    depend on NLTK corpora.
+    '''
+
+    def extract_keywords_from_text(self, text):
+        self.words = text.split()
+
+    def get_word_degrees(self):
+        return {word: 1 for word in self.words}
+
+def texts(n = 50):
+    return ['article {} word{} word{}'.format(i, i % 7, i % 3) for i in range(n)]
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason = 'worker processes inherit the fake Rake instance only with fork')
+def test_parallel_extraction_equals_serial(monkeypatch):
+    monkeypatch.setattr(cbh, '_rake', FakeRake())
+    expected = cbh.extract_keywords(texts(), n_jobs = 1)
+
+    assert expected[3] == 'article 3 word3 word0'
+    for n_jobs, chunk_size in ((2, 8), (2, 7), (None, 1), (3, 256)):
+        assert cbh.extract_keywords(texts(), n_jobs = n_jobs, chunk_size = chunk_size) == expected
+
+def test_keyword_cache_hits_and_invalidation(monkeypatch, tmp_path):
+    extracted = []
+    def extract_keywords(texts, n_jobs = 1, chunk_size = 256):
+        extracted.append(list(texts))
+        return [text.upper() for text in texts]
+    monkeypatch.setattr(cbh, 'extract_keywords', extract_keywords)
+
+    path = str(tmp_path / 'keywords.json')
+    cache = cbh.KeywordCache(path)
+    assert cache.get_keywords([1, 2], ['alpha beta', 'gamma']) == ['ALPHA BETA', 'GAMMA']
+    columns = cache.count_matrix(['alpha beta', 'gamma']).toarray()
+    cache.save()
+
+    # a loaded cache extracts keywords only for the new and the changed article
+    cache = cbh.KeywordCache(path)
+    assert cache.get_keywords([1, 2, 3], ['alpha beta', 'gamma delta', 'beta']) == ['ALPHA BETA', 'GAMMA DELTA', 'BETA']
+    assert extracted[1:] == [['gamma delta', 'beta']]
+
+    # the old entry of the changed article is removed, the vocabulary only grows
+    assert sorted(cache.entries) == sorted(cache._key(article_id, cache.content_hash(text)) for article_id, text in
+                                           [(1, 'alpha beta'), (2, 'gamma delta'), (3, 'beta')])
+    matrix = cache.count_matrix(['alpha beta', 'gamma', 'delta']).toarray()
+    assert (matrix[:2, :columns.shape[1]] == columns).all() and matrix.shape[1] == columns.shape[1] + 1
+
+    # all articles are cached now
+    cache.get_keywords([1, 2, 3], ['alpha beta', 'gamma delta', 'beta'])
+    assert extracted[2:] == [[]]
+
+    # cache files of other versions are ignored
+    cache.VERSION = 0
+    cache.save()
+    assert cbh.KeywordCache(path).entries == dict()
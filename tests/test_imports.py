@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains tests of the package imports: recommender classes are exported
+lazily and importing the package or its modules doesn't load heavy dependencies.
+"""
+
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+import model
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['sklearn', 'nltk', 'rake_nltk']
+
+def loaded_modules(code):
+    # run the imports in a fresh interpreter, modules imported by tests are already loaded here
+    probe = code + '\nimport sys, json\nprint(json.dumps(sorted(sys.modules)))'
+    output = subprocess.run([sys.executable, '-c', probe], cwd = ROOT, capture_output = True, text = True, check = True)
+
+    return set(json.loads(output.stdout.splitlines()[-1]))
+
+def heavy(modules):
+    return sorted(name for name in modules if name.split('.')[0] in HEAVY_MODULES)
+
+def test_package_import_is_lazy():
+    modules = loaded_modules('import model')
+    assert 'model.collaborative_recommender' not in modules and 'model.content_based_recommender' not in modules
+    assert heavy(modules) == []
+
+def test_exports_load_no_heavy_modules():
+    modules = loaded_modules('import model\n'
+                             'classes = [getattr(model, name) for name in model.__all__]\n'
+                             'import model.service, model.ann_index, model.persistence, model.content_based_helpers')
+    assert {'model.' + module for module in model._EXPORTS.values()} <= modules
+    assert heavy(modules) == []
+
+def test_exports():
+    assert set(model.__all__) <= set(dir(model))
+    assert model.CachedRecommender.__name__ == 'CachedRecommender'
+    with pytest.raises(AttributeError):
+        model.UnknownRecommender
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains tests of incremental updates of the recommenders: results after
+add_interactions compared with refitting, users reported as changed and
+updated neighbor indexes compared with indexes built from scratch.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from model.collaborative_recommender import CollaborativeRecommender
+from model.content_based_recommender import ContentBasedRecommender
+from model.hybrid_recommender import HybridRecommender
+from model.user_item_store import UserItemMatrix
+from model.similarity_index import NeighborIndex
+
+# recommenders updated with add_interactions, content-based ones are fitted with articles' content
+INCREMENTAL = {'collaborative': lambda: CollaborativeRecommender(n_neighbors = 5),
+               'collaborative_similarity': lambda: CollaborativeRecommender(n_neighbors = 5, scoring = 'similarity'),
+               'content': lambda: ContentBasedRecommender(n_similar = 10),
+               'hybrid': lambda: HybridRecommender(collaborative_params = {'n_neighbors': 5, 'scoring': 'similarity'},
+                                                   content_params = {'n_similar': 10})}
+
+def fit(name, path, data):
+    rec = INCREMENTAL[name]()
+    if isinstance(rec, CollaborativeRecommender):
+        rec.fit(path)
+    else:
+        rec.fit(path, data['articles'])
+
+    return rec
+
+@pytest.mark.parametrize('name', sorted(INCREMENTAL))
+def test_add_interactions_matches_refit(data, keywords, name):
+    rec = fit(name, data['head'], data)
+    records = data['records']
+    for start in range(0, len(records), 7):
+        rec.add_interactions(records.iloc[start:start + 7])
+    assert rec.add_interactions([]) == []
+
+    refitted = fit(name, data['full'], data)
+
+    assert (rec.user_item.matrix != refitted.user_item.matrix).nnz == 0
+    assert np.array_equal(rec.counts.ranking, refitted.counts.ranking)
+    assert rec.make_recs_batch(refitted.user_item.user_ids.tolist() + [-1], 10) == \
+        refitted.make_recs_batch(refitted.user_item.user_ids.tolist() + [-1], 10)
+
+@pytest.mark.parametrize('name', sorted(INCREMENTAL))
+def test_add_interactions_reports_changed_users(data, keywords, name):
+    rec = fit(name, data['head'], data)
+    records = data['records']
+
+    checked = 0
+    for start in range(0, len(records), 2):
+        user_ids = rec.user_item.user_ids.tolist() + [-1]
+        before = rec.make_recs_batch(user_ids, 10)
+        version = rec.model_version
+        article_ids, rank = rec.counts.article_ids, rec.counts.rank
+        reported = set(rec.add_interactions(records.iloc[start:start + 2]))
+
+        # a new version means recommendations of every user may have changed
+        if rec.model_version != version:
+            continue
+
+        # recommendations with articles which moved in the popularity ranking may have changed
+        moved = set(rec.user_item.article_labels[rec.counts.moved_articles(article_ids, rank)].tolist())
+        after = rec.make_recs_batch(user_ids, 10)
+        assert {user_id for user_id, old, new in zip(user_ids, before, after)
+                if old != new and moved.isdisjoint(old[0])} <= reported
+        checked += 1
+
+    assert checked > 0
+
+def test_add_interactions_reports_users_of_changed_neighbors(tmp_path):
+    # a has b as the only neighbor, article 9 is the most popular one
+    rows = [(1.0, 'a'), (2.0, 'a'), (1.0, 'b'), (2.0, 'b'), (3.0, 'b'), (9.0, 'c'), (9.0, 'd'), (9.0, 'e')]
+    pd.DataFrame([(article, 'title', email) for article, email in rows],
+                 columns = ['article_id', 'title', 'email']).to_csv(tmp_path / 'log.csv', index = False)
+    rec = CollaborativeRecommender(n_neighbors = 1)
+    rec.fit(str(tmp_path / 'log.csv'))
+    user_a = rec.email_encoder.encode(np.array(['a'], dtype = object))[0]
+    version = rec.model_version
+    assert rec.make_recs(user_a, 2)[0] == ['3.0', '9.0']
+
+    # b reads article 9, which becomes a candidate of a, ranking of articles doesn't change
+    user_ids = rec.add_interactions([{'article_id': 9.0, 'title': 'title', 'email': 'b'}])
+
+    assert rec.model_version == version
+    assert rec.make_recs(user_a, 2)[0] == ['9.0', '3.0']
+    assert user_a in user_ids
+
+def test_neighbor_index_update_matches_build():
+    rng = np.random.default_rng(0)
+    for trial in range(100):
+        users = rng.integers(0, 30, 80)
+        articles = rng.integers(0, 12, 80).astype(np.float32)
+        user_item = UserItemMatrix.from_interactions(users, articles)
+        k = int(rng.integers(1, 8))
+        index = NeighborIndex.build(user_item, k, 7, np.bincount(user_item.user_indexes(users)))
+
+        # small batches with new users and articles, some of them appended and some inserted
+        for step in range(3):
+            new_users = rng.integers(0, 33, 4)
+            new_articles = rng.integers(0, 14, 4).astype(np.float32)
+            users = np.concatenate([users, new_users])
+            user_map, article_map, rows, cols = user_item.add_interactions(new_users, new_articles)
+            num_interactions = np.bincount(user_item.user_indexes(users))
+            index.update(user_item, user_map, rows, num_interactions, batch_size = int(rng.integers(1, 4)))
+
+            expected = NeighborIndex.build(user_item, k, 7, num_interactions)
+            assert np.array_equal(index.neighbors, expected.neighbors)
+            assert np.allclose(index.similarities, expected.similarities)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains tests of the instrumentation: the metrics registry, its exporters
+and stage names reported by the recommenders.
+"""
+
+import logging
+import pytest
+
+from model import instrumentation
+from model.instrumentation import MetricsRegistry, LogExporter, PrometheusExporter
+from model.collaborative_recommender import CollaborativeRecommender
+from model.content_based_recommender import ContentBasedRecommender
+from model.matrix_factorization_recommender import MatrixFactorizationRecommender
+from model.hybrid_recommender import HybridRecommender
+
+@pytest.fixture
+def enabled_registry():
+    '''
+    Enables the default registry with no recorded stages, disables it after the test.
+    '''
+    instrumentation.registry.reset()
+    instrumentation.enable()
+    yield instrumentation.registry
+    instrumentation.disable()
+    instrumentation.registry.reset()
+
+def test_registry_records_stages():
+    registry = MetricsRegistry()
+
+    # disabled registry records nothing
+    with registry.stage('disabled'):
+        pass
+    assert registry.snapshot() == {}
+
+    registry.enable()
+    with registry.stage('stage') as s:
+        s.add_bytes(10)
+    registry.record('stage', 2.0, 5)
+
+    stats = registry.snapshot()['stage']
+    assert stats['calls'] == 2 and stats['total_bytes'] == 15
+    assert stats['max_time'] == 2.0 and stats['mean_time'] == stats['total_time'] / 2
+
+    registry.reset()
+    assert registry.snapshot() == {}
+
+def test_timed_records_size_of_result(enabled_registry):
+    @instrumentation.timed('test.timed')
+    def allocate(n):
+        return [0] * n, bytearray(n)
+
+    allocate(3)
+    allocate(3)
+
+    assert enabled_registry.snapshot()['test.timed']['calls'] == 2
+
+def test_exporters():
+    registry = MetricsRegistry(enabled = True)
+    registry.record('fit "x"', 0.5, 8)
+
+    text = registry.export(PrometheusExporter(prefix = 'test'))
+    assert '# TYPE test_stage_calls_total counter' in text
+    assert 'test_stage_calls_total{stage="fit \\"x\\""} 1' in text
+    assert 'test_stage_seconds_max{stage="fit \\"x\\""} 0.5' in text
+    assert 'test_stage_allocated_bytes_total{stage="fit \\"x\\""} 8' in text
+
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger = logging.getLogger('test.metrics')
+    logger.addHandler(handler)
+    try:
+        registry.export(LogExporter(logger, logging.WARNING))
+    finally:
+        logger.removeHandler(handler)
+    assert len(records) == 1 and 'stage=fit "x" calls=1' in records[0].getMessage()
+
+@pytest.mark.parametrize('name, rec', [('collaborative', CollaborativeRecommender),
+                                       ('content', ContentBasedRecommender),
+                                       ('matrix_factorization', MatrixFactorizationRecommender),
+                                       ('hybrid', HybridRecommender)])
+def test_recommenders_report_same_stages(data, keywords, enabled_registry, name, rec):
+    rec = rec()
+    if name in ('content', 'hybrid'):
+        rec.fit(data['head'], data['articles'])
+    else:
+        rec.fit(data['head'])
+    rec.make_recs(rec.user_item.user_ids[0], 5)
+    rec.make_recs_batch(rec.user_item.user_ids[:3].tolist(), 5)
+
+    stages = enabled_registry.snapshot()
+    for suffix in ('fit', 'make_recs', 'make_recs_batch', 'make_recs_batch.scores', 'make_recs_batch.names'):
+        assert '{}.{}'.format(name, suffix) in stages
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains tests of saved artifacts: round trips of the recommenders and
+saving over an artifact which is memory-mapped by a loaded recommender.
+"""
+
+import os
+import pytest
+
+from model.collaborative_recommender import CollaborativeRecommender
+from model.content_based_recommender import ContentBasedRecommender
+from model.matrix_factorization_recommender import MatrixFactorizationRecommender
+from model.hybrid_recommender import HybridRecommender
+
+RECOMMENDERS = {'collaborative': lambda: CollaborativeRecommender(n_neighbors = 5),
+                'content': lambda: ContentBasedRecommender(n_similar = 10),
+                'matrix_factorization': lambda: MatrixFactorizationRecommender(latent_features = 5),
+                'hybrid': lambda: HybridRecommender(collaborative_params = {'n_neighbors': 5, 'scoring': 'similarity'},
+                                                    content_params = {'n_similar': 10})}
+
+def fit(name, path, data):
+    rec = RECOMMENDERS[name]()
+    if name in ('content', 'hybrid'):
+        rec.fit(path, data['articles'])
+    else:
+        rec.fit(path)
+
+    return rec
+
+@pytest.mark.parametrize('name', sorted(RECOMMENDERS))
+def test_save_load_round_trip(data, keywords, tmp_path, name):
+    rec = fit(name, data['head'], data)
+    rec.save(str(tmp_path / 'artifact'))
+
+    loaded = type(rec).load(str(tmp_path / 'artifact'))
+
+    user_ids = rec.user_item.user_ids.tolist() + [-1]
+    assert loaded.make_recs_batch(user_ids, 10) == rec.make_recs_batch(user_ids, 10)
+    assert loaded.model_version != rec.model_version
+
+    # loaded recommenders keep accepting new interactions
+    if name != 'matrix_factorization':
+        loaded.add_interactions(data['records'])
+        refitted = fit(name, data['full'], data)
+        user_ids = refitted.user_item.user_ids.tolist() + [-1]
+        assert loaded.make_recs_batch(user_ids, 10) == refitted.make_recs_batch(user_ids, 10)
+
+@pytest.mark.parametrize('name', sorted(RECOMMENDERS))
+def test_save_over_memory_mapped_artifact(data, keywords, tmp_path, name):
+    path = str(tmp_path / 'artifacts' / 'artifact')
+    rec = fit(name, data['head'], data)
+    rec.save(path)
+    user_ids = rec.user_item.user_ids.tolist() + [-1]
+    expected = rec.make_recs_batch(user_ids, 10)
+
+    # the loaded recommender reads arrays of the artifact it is saved over
+    loaded = type(rec).load(path, mmap = True)
+    loaded.save(path)
+
+    assert loaded.make_recs_batch(user_ids, 10) == expected
+    assert type(rec).load(path).make_recs_batch(user_ids, 10) == expected
+    assert os.listdir(str(tmp_path / 'artifacts')) == ['artifact']
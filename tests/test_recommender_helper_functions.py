@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains tests of the helper functions: ranking of selected articles,
+chunked reads of the interaction log (with counts and titles of articles)
+and appending of new interactions.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+
+from model import recommender_helper_functions as hf
+from model.user_item_store import InteractionLog, InteractionCounts, ArticleTitles
+
+def full_sort(scores, seen, popularity, n):
+    '''
+    Reference ranking of select_top_articles: candidates by score, then popularity, then column,
+    other unseen articles by popularity, then column.
+    '''
+    seen = seen.toarray() > 0
+    columns = np.arange(scores.shape[1])
+
+    top_articles = []
+    for row_scores, row_seen in zip(scores, seen):
+        group = np.where(row_seen, 2, np.where(row_scores > 0, 0, 1))
+        order = np.lexsort((columns, -popularity, -np.where(row_scores > 0, row_scores, 0), group))
+        top_articles.append(order[group[order] < 2][:n])
+
+    return top_articles
+
+@pytest.mark.parametrize('n_articles, score', [(100000, 300), (714, 20000)])
+def test_select_top_articles_orders_equal_scores_by_popularity(n_articles, score):
+    # the last columns are the most popular ones
+    popularity = (1 - np.arange(n_articles) / n_articles)[::-1].copy()
+    scores = np.full((1, n_articles), float(score))
+
+    top = hf.select_top_articles(scores, sparse.csr_matrix((1, n_articles)), popularity, 5)
+
+    assert top[0].tolist() == list(range(n_articles - 1, n_articles - 6, -1))
+
+def test_select_top_articles_matches_full_sort():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        b, m, n = rng.integers(1, 5), rng.integers(1, 40), rng.integers(0, 12)
+        scores = rng.integers(0, 4, size = (b, m)) * rng.choice([1.0, 1e-12, 1e6])
+        seen = sparse.csr_matrix(rng.random((b, m)) < 0.3)
+        popularity = 1 - rng.permutation(m) / m
+
+        top = hf.select_top_articles(scores, seen, popularity, n)
+
+        for selected, expected in zip(top, full_sort(scores, seen, popularity, n)):
+            assert selected.tolist() == expected.tolist()
+
+@pytest.mark.parametrize('records', [[], pd.DataFrame(columns = ['article_id', 'title', 'email'])])
+def test_append_no_interactions(data, records):
+    df, user_item, email_encoder, counts, article_titles = hf.read_interactions(data['head'])
+    log = InteractionLog.from_frame(df)
+    frame = log.frame
+    shape = user_item.shape
+
+    user_ids, user_map, article_map, rows, cols = hf.append_interactions(log, user_item, email_encoder, records)
+
+    assert log.frame is frame and user_item.shape == shape
+    assert len(user_ids) == len(rows) == len(cols) == 0
+    assert np.array_equal(user_map, np.arange(shape[0])) and np.array_equal(article_map, np.arange(shape[1]))
+
+def test_append_interactions_without_title(data):
+    df, user_item, email_encoder, counts, article_titles = hf.read_interactions(data['head'])
+    records = [{'article_id': 7.5, 'title': np.nan, 'email': 'new@mail'},
+               {'article_id': 1.0, 'title': 'title of article 1', 'email': 'new@mail'}]
+
+    log = InteractionLog.from_frame(df)
+
+    user_ids, user_map, article_map, rows, cols = hf.append_interactions(log, user_item, email_encoder, records)
+
+    new_df = log.frame
+    assert len(new_df) == len(df) + 2 and new_df.iloc[:len(df)].equals(df)
+    assert pd.isna(new_df['title'].iloc[-2]) and new_df['title'].iloc[-1] == 'title of article 1'
+    assert user_item.article_index(7.5) >= 0
+
+def test_read_interactions_in_chunks(data):
+    df, user_item, email_encoder, counts, article_titles = hf.read_interactions(data['full'])
+    chunked_df, chunked_user_item, chunked_email_encoder, chunked_counts, chunked_titles = hf.read_interactions(
+        data['full'], chunksize = 17)
+
+    assert chunked_df.equals(df)
+    assert (chunked_user_item.matrix != user_item.matrix).nnz == 0
+    assert np.array_equal(chunked_user_item.user_ids, user_item.user_ids)
+    assert np.array_equal(chunked_user_item.article_ids, user_item.article_ids)
+
+    # counts and titles combined from the chunks equal the ones built from the whole log
+    for read_counts, read_titles in ((counts, article_titles), (chunked_counts, chunked_titles)):
+        expected_counts = InteractionCounts.build(df, user_item)
+        assert np.array_equal(read_counts.article_counts, expected_counts.article_counts)
+        assert np.array_equal(read_counts.user_counts, expected_counts.user_counts)
+        assert np.array_equal(read_counts.ranking, expected_counts.ranking)
+        columns = np.arange(user_item.shape[1])
+        assert read_titles.names(columns) == ArticleTitles.build(df, user_item).names(columns)
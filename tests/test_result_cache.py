@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains tests of the result cache: eviction, expiration and invalidation
+of entries (by users and by articles) and cached results of recommenders after
+new interactions.
+"""
+
+import pytest
+
+from model.collaborative_recommender import CollaborativeRecommender
+from model.content_based_recommender import ContentBasedRecommender
+from model.hybrid_recommender import HybridRecommender
+from model.result_cache import RecommendationCache, CachedRecommender
+
+RECOMMENDERS = {'collaborative': lambda: CollaborativeRecommender(n_neighbors = 5),
+                'content': lambda: ContentBasedRecommender(n_similar = 10),
+                'hybrid': lambda: HybridRecommender(collaborative_params = {'n_neighbors': 5, 'scoring': 'similarity'},
+                                                    content_params = {'n_similar': 10})}
+
+def test_cache_evicts_expires_and_invalidates():
+    now = [0.0]
+    cache = RecommendationCache(max_size = 2, ttl = 10, clock = lambda: now[0])
+
+    cache.put((0, 'make_recs', 1, 5), 'a')
+    cache.put((0, 'make_recs', 2, 5), 'b')
+    assert cache.get((0, 'make_recs', 1, 5)) == 'a'
+
+    # the least recently used entry (user 2) is evicted
+    cache.put((0, 'make_recs', 3, 5), 'c')
+    assert cache.get((0, 'make_recs', 2, 5)) is None and cache.evictions == 1
+
+    assert cache.invalidate_users([3, 4]) == 1
+    assert cache.get((0, 'make_recs', 3, 5)) is None
+
+    now[0] = 10.0
+    assert cache.get((0, 'make_recs', 1, 5)) is None and cache.expirations == 1
+    assert len(cache) == 0
+
+def test_cache_invalidates_articles():
+    cache = RecommendationCache()
+    cache.put((0, 'make_recs', 1, 5), 'a', ['1.0', '2.0'])
+    cache.put((0, 'make_recs', 2, 5), 'b', ['2.0', '3.0'])
+    cache.put((0, 'make_recs', 3, 5), 'c', ['4.0'])
+
+    # replaced entry is indexed by its new articles only
+    cache.put((0, 'make_recs', 3, 5), 'c', ['5.0'])
+    assert cache.invalidate_articles(['4.0']) == 0
+
+    assert cache.invalidate_articles(['3.0', '1.0']) == 2
+    assert cache.get((0, 'make_recs', 3, 5)) == 'c'
+    assert cache.invalidate_users([3]) == 1 and len(cache) == 0
+
+@pytest.mark.parametrize('name', sorted(RECOMMENDERS))
+def test_cached_recommender_after_add_interactions(data, keywords, name):
+    rec = RECOMMENDERS[name]()
+    rec.fit(data['head'], *([data['articles']] if name != 'collaborative' else []))
+    cached = CachedRecommender(rec, max_size = 100000)
+    records = data['records']
+
+    for start in range(0, len(records), 3):
+        user_ids = rec.user_item.user_ids.tolist() + [-1]
+        cached.make_recs_batch(user_ids, 10)
+        cached.add_interactions(records.iloc[start:start + 3])
+
+        # cached results match results of the updated recommender, entries of old versions are dropped
+        user_ids = rec.user_item.user_ids.tolist() + [-1]
+        assert cached.make_recs_batch(user_ids, 10) == rec.make_recs_batch(user_ids, 10)
+        assert len(cached.cache) <= len(user_ids)
+
+@pytest.mark.parametrize('name', ['collaborative', 'content'])
+def test_ranking_change_keeps_other_results(data, keywords, name):
+    rec = RECOMMENDERS[name]()
+    rec.fit(data['head'], *([data['articles']] if name != 'collaborative' else []))
+    cached = CachedRecommender(rec, max_size = 100000)
+    records = data['records']
+
+    kept = 0
+    for start in range(len(records)):
+        user_ids = rec.user_item.user_ids.tolist() + [-1]
+        cached.make_recs_batch(user_ids, 10)
+        version = rec.model_version
+        article_ids, rank = rec.counts.article_ids, rec.counts.rank
+        cached.add_interactions(records.iloc[start:start + 1])
+
+        # popularity ranking changes don't replace the version, only results with moved articles are removed
+        assert rec.model_version == version
+        if len(rec.counts.moved_articles(article_ids, rank)) > 0:
+            kept += len(cached.cache)
+
+        user_ids = rec.user_item.user_ids.tolist() + [-1]
+        assert cached.make_recs_batch(user_ids, 10) == rec.make_recs_batch(user_ids, 10)
+
+    assert kept > 0
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains tests of the recommendation service: micro-batching of concurrent
+requests, start and stop of the batcher and the HTTP endpoints.
+"""
+
+import json
+import asyncio
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+from model.collaborative_recommender import CollaborativeRecommender
+from model.service import MicroBatcher, RecommendationServer
+
+@pytest.fixture
+def rec(data):
+    rec = CollaborativeRecommender(n_neighbors = 5)
+    rec.fit(data['head'])
+    return rec
+
+def test_micro_batcher_batches_concurrent_requests(rec):
+    user_ids = rec.user_item.user_ids.tolist()[:20] + [-1]
+
+    async def run():
+        batcher = MicroBatcher(rec.make_recs_batch, max_batch_size = 8, max_wait = 0.05)
+        await batcher.start()
+        try:
+            results = await asyncio.gather(*[batcher.recommend(user_id, 5) for user_id in user_ids],
+                                           batcher.recommend(user_ids[0], 3))
+        finally:
+            await batcher.stop()
+        return results, batcher
+
+    results, batcher = asyncio.run(run())
+
+    assert results[:-1] == rec.make_recs_batch(user_ids, 5)
+    assert results[-1] == rec.make_recs(user_ids[0], 3)
+    assert batcher.requests == len(user_ids) + 1 and batcher.batches < batcher.requests
+
+def test_micro_batcher_start_stop(rec):
+    executor = ThreadPoolExecutor(1)
+
+    async def run():
+        owned = MicroBatcher(rec.make_recs_batch)
+        await owned.start()
+        collector = owned._collector
+        owned_executor = owned.executor
+
+        # starting a started batcher keeps its collector and queue
+        await owned.start()
+        assert owned._collector is collector
+        await owned.stop()
+
+        # the executor created by the batcher is shut down, a passed executor is not
+        with pytest.raises(RuntimeError):
+            owned_executor.submit(print)
+        passed = MicroBatcher(rec.make_recs_batch, executor = executor)
+        await passed.start()
+        await passed.stop()
+        executor.submit(print).result()
+
+        # a stopped batcher can be started again
+        await owned.start()
+        try:
+            return await owned.recommend(-1, 5)
+        finally:
+            await owned.stop()
+
+    assert asyncio.run(run()) == rec.make_recs(-1, 5)
+    executor.shutdown()
+
+def test_server_endpoints(rec):
+    user_id = rec.user_item.user_ids[0]
+
+    async def get(port, target):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write('GET {} HTTP/1.1\r\nConnection: close\r\n\r\n'.format(target).encode('latin-1'))
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+
+        head, _, body = response.partition(b'\r\n\r\n')
+        return int(head.split()[1]), json.loads(body)
+
+    async def run():
+        batcher = MicroBatcher(rec.make_recs_batch)
+        await batcher.start()
+        server = RecommendationServer(batcher, port = 0)
+        await server.start()
+        collector = batcher._collector
+        try:
+            responses = [await get(server.port, target) for target in
+                         ['/recommendations?user_id={}&n=3'.format(user_id), '/recommendations?user_id=x',
+                          '/recommendations?user_id=1&n=1000', '/health', '/unknown']]
+        finally:
+            await server.stop()
+        return responses, batcher._collector is None and collector.done()
+
+    responses, stopped = asyncio.run(run())
+
+    recs, rec_names = rec.make_recs(user_id, 3)
+    assert responses[0] == (200, {'user_id': int(user_id), 'article_ids': recs, 'titles': rec_names})
+    assert [status for status, body in responses[1:]] == [400, 400, 200, 404]
+    assert responses[3][1]['requests'] == 1
+    assert stopped
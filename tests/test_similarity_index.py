@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains tests of the blocked top-K similarity search: results computed
+by worker processes and with tiles reduced to the memory budget.
+"""
+
+import numpy as np
+from scipy import sparse
+
+from model import similarity_index
+from model.similarity_index import blocked_top_k, tile_rows
+
+def binary_matrix():
+    matrix = sparse.random(300, 40, density = 0.1, format = 'csr', random_state = 0)
+    matrix.data[:] = 1
+    return matrix
+
+def test_blocked_top_k_n_jobs():
+    matrix = binary_matrix()
+    tie_breaker = np.random.default_rng(0).integers(0, 20, matrix.shape[0])
+
+    for ties in (None, tie_breaker):
+        expected = blocked_top_k(matrix, 10, batch_size = 64, tie_breaker = ties, n_jobs = 1)
+        neighbors, similarities = blocked_top_k(matrix, 10, batch_size = 64, tie_breaker = ties, n_jobs = 2)
+        assert np.array_equal(neighbors, expected[0]) and np.array_equal(similarities, expected[1])
+
+def test_tiles_fit_memory_budget(monkeypatch):
+    matrix = binary_matrix()
+    expected = blocked_top_k(matrix, 10, batch_size = 1024)
+
+    # budget of 10 rows of 300 elements
+    monkeypatch.setattr(similarity_index, 'TILE_MEMORY', 10 * 300 * similarity_index.TILE_BYTES_PER_ELEMENT)
+    assert tile_rows(1024, 300) == 10 and tile_rows(4, 300) == 4 and tile_rows(1024, 10 ** 9) == 1
+
+    neighbors, similarities = blocked_top_k(matrix, 10, batch_size = 1024)
+    assert np.array_equal(neighbors, expected[0]) and np.array_equal(similarities, expected[1])
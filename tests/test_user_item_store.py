@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File contains tests of the user-item store: insertion of entries into
+compressed sparse matrices, the article titles table and the interaction log.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from model.user_item_store import ArticleTitles, InteractionLog, _insert_compressed
+
+def test_insert_compressed_matches_rebuilt_matrix():
+    rng = np.random.default_rng(0)
+    matrix = sparse.random(20, 30, density = 0.2, format = 'csr', random_state = 1)
+    matrix.sort_indices()
+    entries = np.unique(rng.integers(0, 20 * 30, size = 60))
+    major, minor = entries // 30, entries % 30
+
+    indptr, indices, inserted = _insert_compressed(matrix.indptr, matrix.indices, major, minor)
+
+    expected = matrix.copy()
+    expected.data[:] = 1
+    expected = (expected + sparse.csr_matrix((np.ones(len(major)), (major, minor)), shape = (20, 30))).astype(bool).tocsr()
+    expected.sort_indices()
+    assert np.array_equal(indptr, expected.indptr) and np.array_equal(indices, expected.indices)
+    assert np.array_equal(inserted, ~np.asarray(matrix[major, minor] != 0).ravel())
+
+def test_article_titles_empty_table():
+    titles = ArticleTitles(np.zeros(0, dtype = np.float32), np.zeros(0, dtype = np.int32), np.zeros(0, dtype = object))
+
+    assert titles.names([0, -1]) == [None, None]
+    assert titles.get_names([1.0]) == [None]
+    assert titles.names([]) == [] and titles.get_names([]) == []
+
+def test_interaction_log_appends():
+    df = pd.DataFrame({'article_id': np.array([1.0, 2.0], dtype = np.float32),
+                       'title': pd.Categorical(['a', 'b']), 'user_id': np.array([1, 2], dtype = np.int32)})
+    # buffers of a loaded log are read-only
+    arrays = {name: array.copy() for name, array in InteractionLog.from_frame(df).to_arrays().items()}
+    for array in arrays.values():
+        array.flags.writeable = False
+    log = InteractionLog.from_arrays(arrays)
+    frame = log.frame
+
+    # appends grow the buffers and the table of titles beyond int8 codes
+    titles = ['title {}'.format(i % 300) if i % 7 else np.nan for i in range(3000)]
+    for start in range(0, 3000, 100):
+        log.append(np.arange(start, start + 100, dtype = np.float32), titles[start:start + 100],
+                   np.full(100, start, dtype = np.int32))
+
+    assert len(log) == 3002 and frame.equals(df)
+    assert log.frame['title'].tolist()[:2] == ['a', 'b']
+    assert [title if isinstance(title, str) else None for title in log.frame['title'].tolist()[2:]] == \
+        [title if isinstance(title, str) else None for title in titles]
+    assert np.array_equal(log.frame['user_id'].values[2:], np.repeat(np.arange(0, 3000, 100), 100))
+    assert InteractionLog.from_arrays(log.to_arrays()).frame.equals(log.frame)